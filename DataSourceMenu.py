@@ -7,6 +7,7 @@ File    - Take data from an event/parameter file.
 Pipe    - Take data from a program via a pipe (SpecTcl only).
 -----
 List of Runs - Take data from a list of run. (cluster file) - SpecTcl later than version 5.13-(???)
+Distributed cluster file - Cluster file processed by several histogramers then merged.
 Filter File - Take data from a filter file. (SpecTcl only).
 -----
 Detach - Detach from the data source.
@@ -16,7 +17,7 @@ Abort Cluster File (SpecTcl only later than 5.13-xxx)
 
 from PyQt5.QtWidgets import (
     QAction, QFileDialog, QDialog, QDialogButtonBox, QRadioButton, QPushButton,
-    QLabel, QWidget, QLineEdit, QMessageBox,
+    QLabel, QWidget, QLineEdit, QMessageBox, QInputDialog, QCheckBox, QPlainTextEdit,
     QVBoxLayout, QHBoxLayout
 )
 from PyQt5.QtCore import QObject
@@ -26,9 +27,12 @@ import os
 import capabilities
 from spectrumeditor import error, confirm
 from editablelist import EditableList
-from clusterprocessor import ClusterProcessor
+from clusterprocessor import ClusterProcessor, DistributedClusterProcessor
+import clusterpreflight
+import clustertelemetry
+import clusterscheduler
 
-#  This constant is the poll interval for checking to see if we are still 
+#  This constant is the (slowest) poll interval for checking to see if we are still 
 # Processing a cluster file:
 
 CLUSTER_CHECK_INTERVAL = 2 * 1000    # units of milliseconds.
@@ -80,6 +84,10 @@ class DataSourceMenu(QObject):
         self._cluster.triggered.connect(self._attach_cluster)
         self._menu.addAction(self._cluster)
         
+        self._distributed = QAction('Distributed cluster file...', self)
+        self._distributed.triggered.connect(self._attach_distributed_cluster)
+        self._menu.addAction(self._distributed)
+        
         self._abort_cluster = QAction('Abort Cluster processing', self)
         self._abort_cluster.triggered.connect(self._stop_cluster)
         self._menu.addAction(self._abort_cluster)
@@ -113,10 +121,18 @@ class DataSourceMenu(QObject):
         try:
             cluster_filename = QFileDialog.getOpenFileName(self._ui, "Cluster definition file", '.',
                                                            "Cluster Files (*.clu);; All Files (*.*)" )
-            if cluster_filename != "":
-                self._cluster_processor = ClusterProcessor(cluster_filename[0], CLUSTER_CHECK_INTERVAL, self._client)
+            if cluster_filename[0] != "":
+                checked = self._preflight(cluster_filename[0])
+                if checked is None:
+                    return
+                (event_files, prefetch) = checked
+                self._cluster_processor = ClusterProcessor(
+                    event_files, CLUSTER_CHECK_INTERVAL, self._client, prefetch=prefetch
+                )
                 self._cluster_processor.done.connect(self._cluster_done)
+                self._cluster_processor.metrics.connect(self._cluster_metrics)
                 self._cluster.setEnabled(False)
+                self._distributed.setEnabled(False)
                 self._abort_cluster.setEnabled(True)
            
         except Exception as e:
@@ -124,6 +140,88 @@ class DataSourceMenu(QObject):
             QMessageBox.information(self._ui, 'Failed to start cluster processing', str(e))
     
             
+    def _attach_distributed_cluster(self):
+        # Like _attach_cluster but the event files are processed by all of the
+        # histogramers that the port manager on our server's host advertises 
+        # with a service name prefix the user gives us.  Our server's definitions
+        # are pushed to them first.  When all files are processed, the 
+        # spectra are summed back into our server.  The DistributedClusterProcessor
+        # does the server work off the GUI thread and tells us how it's going.
+        
+        cluster_filename = QFileDialog.getOpenFileName(self._ui, "Cluster definition file", '.',
+                                                       "Cluster Files (*.clu);; All Files (*.*)" )
+        if cluster_filename[0] == '':
+            return
+        try:
+            checked = self._preflight(cluster_filename[0])
+        except Exception as e:
+            QMessageBox.information(self._ui, 'Failed to start distributed cluster processing', str(e))
+            return
+        if checked is None:
+            return
+        (event_files, prefetch) = checked
+        (prefix, ok) = QInputDialog.getText(self._ui, 'Histogramers', 'Service name prefix of the histogramers to use:')
+        if not ok or prefix == '':
+            return
+        try:
+            servers = clusterscheduler.discover_servers(self._client.host, prefix)
+            if len(servers) == 0:
+                error(f'No histogramers advertise services beginning with {prefix} on {self._client.host}')
+                return
+            self._cluster_processor = DistributedClusterProcessor(
+                servers, event_files, self._client, CLUSTER_CHECK_INTERVAL, prefetch=prefetch
+            )
+        except Exception as e:
+            QMessageBox.information(self._ui, 'Failed to start distributed cluster processing', str(e))
+            return
+        self._cluster_processor.pushed.connect(self._distributed_pushed)
+        self._cluster_processor.progress.connect(self._distributed_progress)
+        self._cluster_processor.processing.connect(self._distributed_processing)
+        self._cluster_processor.done.connect(self._distributed_done)
+        self._cluster.setEnabled(False)
+        self._distributed.setEnabled(False)
+        self._abort_cluster.setEnabled(True)
+        self._cluster_processor.push()
+    
+    def _distributed_pushed(self, reports):
+        # Definitions are in the histogramers - if some didn't make it the user
+        # decides if we go on:
+        failures = [f'{name}: {report.summary()}' for (name, report) in reports.items() if not report.ok()]
+        if len(failures) > 0 and not confirm(
+            'Not all definitions could be pushed:\n' + '\n'.join(failures) + '\nContinue anyway?', self._ui):
+            self._cluster_processor.abort()
+        self._cluster_processor.process()
+    
+    def _distributed_progress(self, stage, done, total):
+        self._ui.statusBar().showMessage(f'{stage}: {done}/{total}')
+    
+    def _distributed_processing(self, files):
+        self._ui.statusBar().showMessage(
+            ', '.join([f'{server} processing {os.path.basename(file)}' for (server, file) in files.items()])
+        )
+    
+    def _distributed_done(self, message):
+        if message != '':
+            error(f'Distributed cluster processing failed: {message}')
+        self._cluster_done()
+        
+    def _preflight(self, cluster_filename):
+        # Check the event files in a cluster file and let the user choose how to
+        # order them.  Returns (event files, prefetch) or None if the user
+        # cancelled or some files can't be processed.
+        
+        event_files = clusterscheduler.read_cluster_file(cluster_filename, check=False)
+        report = clusterpreflight.preflight(event_files)
+        if not report.ok():
+            error(f'Cannot process {cluster_filename}:\n' + '\n'.join(report.errors))
+            return None
+        dialog = PreflightPrompter(report, self._ui)
+        if not dialog.exec():
+            return None
+        if dialog.sort() is not None or dialog.dedupe():
+            report = clusterpreflight.preflight(event_files, dialog.sort(), dialog.dedupe())
+        return (report.names(), dialog.prefetch())
+        
     def _stop_cluster(self):
         # If we have a cluster_processor tell it to abort:
         
@@ -135,7 +233,13 @@ class DataSourceMenu(QObject):
         # Kill off the processor and set the menu item enables appropriately. 
         self._cluster_processor = None
         self._cluster.setEnabled(True)
+        self._distributed.setEnabled(True)
         self._abort_cluster.setEnabled(False)
+        self._ui.statusBar().showMessage('Cluster processing done', 10000)
+    
+    def _cluster_metrics(self, metrics):
+        # Slot for cluster processing progress - show it in the status bar.
+        self._ui.statusBar().showMessage(clustertelemetry.format_metrics(metrics))
         
         
     def _read_event_file(self):
@@ -310,6 +414,44 @@ class RingFormat(QWidget):
                 return version
             
         raise AssertionError("No radio buttons are checked!!")
+class PreflightPrompter(QDialog):
+    #  Shows the results of the pre-flight check of a cluster file
+    #  and lets the user choose how to process it.
+    
+    def __init__(self, report, *args):
+        super().__init__(*args)
+        self.setWindowTitle('Cluster file check')
+        layout = QVBoxLayout()
+        layout.addWidget(QLabel(report.summary(), self))
+        if len(report.warnings) > 0:
+            warnings = QPlainTextEdit(self)
+            warnings.setReadOnly(True)
+            warnings.setPlainText('\n'.join(report.warnings))
+            layout.addWidget(warnings)
+        
+        self._sort = QCheckBox('Sort by run number', self)
+        layout.addWidget(self._sort)
+        self._dedupe = QCheckBox('Remove duplicate files', self)
+        self._dedupe.setEnabled(len(report.duplicates) > 0)
+        layout.addWidget(self._dedupe)
+        self._prefetch = QCheckBox('Read ahead the next file', self)
+        self._prefetch.setEnabled(clusterpreflight.Prefetcher().enabled())
+        layout.addWidget(self._prefetch)
+        
+        self._buttonBox = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, self)
+        self._buttonBox.accepted.connect(self.accept)
+        self._buttonBox.rejected.connect(self.reject)
+        layout.addWidget(self._buttonBox)
+        
+        self.setLayout(layout)
+    
+    def sort(self):
+        return 'run' if self._sort.isChecked() else None
+    def dedupe(self):
+        return self._dedupe.isChecked()
+    def prefetch(self):
+        return self._prefetch.isChecked()
+
 class FormatPrompter(QDialog):
     #  Provides a prompter dialog for the ring format.
     #  exec returns:
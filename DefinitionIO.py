@@ -11,8 +11,72 @@ called 'rustogramer_gui'.
 
 import sqlite3
 import time
+import zlib
+
+import numpy as np
+
+import conditiongraph
 
 save_set_name = 'rustogramer_gui'
+contents_chunk_size = 65536          # Max channels per spectrum_contents_blobs row.
+
+def condition_levels(definitions, key='gates'):
+    '''
+    Partition condition definitions into dependency levels.  Level 0 conditions
+    depend on no other condition in 'definitions', level n conditions depend only
+    on conditions in levels < n.  All conditions in a level can therefore be
+    created in any order (or concurrently) once the prior levels exist.
+    
+    *  definitions - iterable of condition definition dicts.
+    *  key  - Key in each definition that has the names of the conditions it
+              depends on. This is 'gates' for definitions from the server and
+              'dependencies' for definitions from DefinitionReader.read_condition_defs.
+    
+    Dependencies on conditions not in 'definitions' are assumed to already exist
+    and don't contribute to the level.  A ValueError is raised if the dependencies
+    have a cycle.
+    
+    Returns a list of lists of definitions.
+    '''
+    name_map = dict()
+    for cond in definitions:
+        name_map[cond['name']] = cond
+    depth = dict()                  # Name -> level once known.
+    
+    def _level(name, active):
+        # Depth first computation of the level of 'name'.  'active' has
+        # the names on the current path so we can detect cycles.
+        if name in depth:
+            return depth[name]
+        if name in active:
+            raise ValueError(f'Condition {name} depends on itself through {", ".join(active)}')
+        active.append(name)
+        level = 0
+        for dep_name in name_map[name].get(key, list()):
+            if dep_name in name_map:
+                level = max(level, _level(dep_name, active) + 1)
+        active.pop()
+        depth[name] = level
+        return level
+    
+    levels = list()
+    for cond in name_map.values():
+        level = _level(cond['name'], list())
+        while len(levels) <= level:
+            levels.append(list())
+        levels[level].append(cond)
+    return levels
+
+def order_conditions(definitions, key='gates'):
+    '''
+    Return the condition definitions ordered so that each condition comes after
+    all of the conditions it depends on.  See condition_levels for the parameters.
+    The order is a topological sort of a conditiongraph.ConditionGraph.
+    '''
+    definitions = list(definitions)
+    by_name = {d['name']: d for d in definitions}
+    graph = conditiongraph.ConditionGraph(definitions, key=key)
+    return [by_name[name] for name in graph.order()]
 
 class DefinitionWriter:
     ''' Writer for definitions.  Insantiating the writer creates the initial schema if
@@ -21,7 +85,9 @@ class DefinitionWriter:
        database file can result in undefined consequences.
        
        Note as well that while the SpecTcl data store includes scheme components to store
-       e.g. runs and spectrum contents, we don't create those elements.
+       e.g. runs and spectrum contents, we don't create those elements.  Spectrum contents
+       are, instead, optionally saved in the spectrum_contents_blobs table (see
+       save_spectrum_contents) which stores them sparse and compressed.
     '''
     def __init__(self, filename):
         self._sqlite = sqlite3.connect(filename)
@@ -29,6 +95,15 @@ class DefinitionWriter:
         self._saveid = self.open_saveset(save_set_name)
     def __del__(self):
         self._sqlite.close()
+    
+    def close(self):
+        '''
+        Close the database file.  Normally this happens when the writer is
+        destroyed but when the file must be closed at a well defined time
+        (e.g. so it can be renamed), call this.  The writer cannot be used 
+        after it is closed.
+        '''
+        self._sqlite.close()
         
     def open_saveset(self, name):
         '''
@@ -243,6 +318,51 @@ class DefinitionWriter:
         
         for definition in definitions:
             self._save_binding(definition)
+    
+    def save_spectrum_contents(self, contents):
+        '''
+            Saves spectrum channel contents to the database.
+            contents is an iterable (it can be a generator, e.g. 
+            spectrumcontents.iter_contents) of dicts with the keys:
+            'name'  - Name of the spectrum.
+            'xbins' - numpy array of the x bin numbers of the non-zero channels.
+            'ybins' - numpy array of the y bin numbers of the non-zero channels.
+            'values' - numpy array of channel values.
+            
+            Each spectrum is written in its own transaction as rows of at most 
+            contents_chunk_size channels whose arrays are zlib compressed blobs.
+            
+            IMPORTANT: The spectrum definitions must have been saved first as the
+            spectrum names are converted to ids.  Contents for spectra that
+            are not defined are ignored.
+        '''
+        cursor = self._sqlite.cursor()
+        for spectrum in contents:
+            cursor.execute('''
+                SELECT id FROM spectrum_defs WHERE save_id = :saveid AND name = :name
+            ''', {'saveid': self._saveid, 'name': spectrum['name']})
+            specid = cursor.fetchone()
+            if specid is None:
+                continue
+            specid = specid[0]
+            xbins = np.asarray(spectrum['xbins'], dtype=np.int32)
+            ybins = np.asarray(spectrum['ybins'], dtype=np.int32)
+            values = np.asarray(spectrum['values'], dtype=np.float64)
+            
+            rows = list()
+            for (chunk, start) in enumerate(range(0, len(values), contents_chunk_size)):
+                end = start + contents_chunk_size
+                rows.append({
+                    'specid': specid, 'chunk': chunk, 'channels': len(values[start:end]),
+                    'xbins': zlib.compress(xbins[start:end].tobytes()),
+                    'ybins': zlib.compress(ybins[start:end].tobytes()),
+                    'vals': zlib.compress(values[start:end].tobytes())
+                })
+            cursor.executemany('''
+                INSERT INTO spectrum_contents_blobs (spectrum_id, chunk, channels, xbins, ybins, vals)
+                    VALUES (:specid, :chunk, :channels, :xbins, :ybins, :vals)
+            ''', rows)
+            self._sqlite.commit()
     # Private methods    
     def _create_schema(self):
         # Create the databas schema; again see 
@@ -412,6 +532,23 @@ class DefinitionWriter:
             )
         '''
         )
+        # Spectrum contents.  This is not the SpecTcl spectrum_contents table which
+        # has a row per channel.  Each row here holds a chunk of the non zero channels of a
+        # spectrum as zlib compressed numpy arrays: int32 for the bins and float64 for
+        # the values.
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS spectrum_contents_blobs (
+                id          INTEGER PRIMARY KEY,
+                spectrum_id INTEGER NOT NULL,  -- FK to spectrum_defs.id
+                chunk       INTEGER NOT NULL,  -- Order of the chunks in the spectrum.
+                channels    INTEGER NOT NULL,  -- Number of channels in the chunk.
+                xbins       BLOB NOT NULL,
+                ybins       BLOB NOT NULL,
+                vals        BLOB NOT NULL
+            )
+        '''
+        )
     def _save_specdef(self, cursor, d):
         # Given a database cursor 'cursor' and spectrum definition 'd', performs the
         # SQL to save that defintiion to file.  Note that it is best if there's a transaction
@@ -515,45 +652,7 @@ class DefinitionWriter:
         #  Reorders the condition definitions so that if a condition is dependent on other
         #  conditions all of those will get written out before us.
 
-        reordered = list()
-        # Toss all conditions up into a map indexed by name:
-        
-        name_map = dict()
-        for cond in definitions:
-            cond['written'] = False       # Not yet written to file.
-            name_map[cond['name']] = cond
-        
-        #  The work:
-        
-        for cond in definitions:
-            name = cond['name']
-            if not name_map[name]['written']:
-                deps = self._enumerate_dependencies(cond, name_map)
-                reordered.extend(deps)
-                # Unlikely but possible that cond is in deps:
-                
-                if not name_map[name]['written']:
-                    reordered.append(cond)
-                    name_map[name]['written'] = True
-             
-        return reordered
-    def _enumerate_dependencies(self, cond, name_map):
-        #  Given a condition, provide an ordered list of dependencies
-        #  that have not yet been 'written'  This is recursive
-        #  as dependent conditions might, themselves have
-        #  dependencies.
-        #  NOTE:  The condition itself is not  in the returned list.
-        result = list()
-        for dep_name in cond['gates']:
-            if not name_map[dep_name]['written']:
-                dep = name_map[dep_name]
-                deps = self._enumerate_dependencies(dep, name_map)
-                result.extend(deps)
-                # Unlikely but maybe written was set in dep:
-                if not name_map[dep_name]['written']:
-                    result.append(dep)
-                    name_map[dep_name]['written'] = True
-        return result
+        return order_conditions(definitions, 'gates')
     
     def _save_condition(self, cursor, condition):
         #  Save a single condition to the database.  Since this is not atomic, the
@@ -1018,6 +1117,26 @@ class DefinitionReader:
         
         return [{'spectrum': x[0], 'condition': x[1]} for x in data]
 
+    def read_variables(self):
+        '''
+        Return the tree variables saved by DefinitionWriter.save_variables.  This is
+        a list of dicts with the keys:
+        name  - name of the variable.
+        value - its value.
+        units - its units of measure.
+        
+        The list is empty if no variables were saved (e.g. the definitions came
+        from Rustogramer).
+        '''
+        
+        cursor = self._sqlite.cursor()
+        cursor.execute('''
+            SELECT name, value, units FROM treevariables WHERE save_id = :saveid
+            ORDER BY id
+        ''', {'saveid': self._saveid})
+        
+        return [{'name': x[0], 'value': x[1], 'units': x[2]} for x in cursor.fetchall()]
+
     def read_bindsets(self):
         '''
             Reads the binding sets from the database.
@@ -1074,3 +1193,68 @@ class DefinitionReader:
                 }) 
             
         return result           
+    
+    def has_spectrum_contents(self):
+        '''
+        Returns True if the current save set has any saved spectrum contents.
+        Files written by earlier versions (or without contents) return False.
+        '''
+        cursor = self._sqlite.cursor()
+        cursor.execute('''
+            SELECT COUNT(*) from sqlite_master WHERE name = 'spectrum_contents_blobs'
+        ''', {})
+        if cursor.fetchall()[0][0] == 0:
+            return False
+        cursor.execute('''
+            SELECT COUNT(*) FROM spectrum_contents_blobs
+            INNER JOIN spectrum_defs ON spectrum_defs.id = spectrum_contents_blobs.spectrum_id
+            WHERE spectrum_defs.save_id = :saveid
+        ''', {'saveid': self._saveid})
+        return cursor.fetchall()[0][0] > 0
+    
+    def read_spectrum_contents(self, names=None):
+        '''
+        Reads saved spectrum contents (see DefinitionWriter.save_spectrum_contents).
+        *  names - if not None, an iterable of the names of the spectra whose contents
+           are wanted, otherwise all saved contents are read.
+        
+        Returns a list of dicts with the keys 'name', 'xbins', 'ybins' and 'values' 
+        (the latter three numpy arrays).  If the database has no contents table an 
+        empty list is returned.
+        '''
+        if not self.has_spectrum_contents():
+            return list()
+        if names is not None:
+            names = set(names)
+        
+        cursor = self._sqlite.cursor()
+        cursor.execute('''
+            SELECT name, xbins, ybins, vals FROM spectrum_contents_blobs
+            INNER JOIN spectrum_defs ON spectrum_defs.id = spectrum_contents_blobs.spectrum_id
+            WHERE spectrum_defs.save_id = :saveid
+            ORDER BY spectrum_id, chunk
+        ''', {'saveid': self._saveid})
+        
+        chunks = dict()              # name -> list of (xbins, ybins, values) 
+        order = list()
+        for (name, xbins, ybins, vals) in cursor:
+            if names is not None and name not in names:
+                continue
+            if name not in chunks:
+                chunks[name] = list()
+                order.append(name)
+            chunks[name].append((
+                np.frombuffer(zlib.decompress(xbins), dtype=np.int32),
+                np.frombuffer(zlib.decompress(ybins), dtype=np.int32),
+                np.frombuffer(zlib.decompress(vals), dtype=np.float64)
+            ))
+        result = list()
+        for name in order:
+            parts = chunks[name]
+            result.append({
+                'name': name,
+                'xbins': np.concatenate([x[0] for x in parts]),
+                'ybins': np.concatenate([x[1] for x in parts]),
+                'values': np.concatenate([x[2] for x in parts])
+            })
+        return result
@@ -1,6 +1,6 @@
 from PyQt5.QtWidgets import (
     QAction, QDialog, QDialogButtonBox, QVBoxLayout, QHBoxLayout, QRadioButton, QFileDialog,
-    QLabel, QCheckBox, QPushButton, QTextEdit, QMessageBox
+    QLabel, QCheckBox, QPushButton, QTextEdit, QMessageBox, QProgressDialog, QApplication
 )
 from PyQt5.QtCore import QObject
 from PyQt5.Qt import Qt
@@ -10,6 +10,10 @@ import SpectrumList
 import os
 from  rustogramer_client import RustogramerException
 import DefinitionIO
+import saveset
+import restorepipeline
+import spectrumcontents
+import spectrumwriter
 
 bindings_controller = None
 
@@ -38,6 +42,10 @@ class FileMenu(QObject):
         self._save.triggered.connect(self._save_definitions)
         self._menu.addAction(self._save)
         
+        self._save_all = QAction('Save with spectrum contents...', self)
+        self._save_all.triggered.connect(self._save_definitions_and_contents)
+        self._menu.addAction(self._save_all)
+        
         # Only for SpecTcl:
         
         if program == capabilities.Program.SpecTcl:
@@ -49,6 +57,10 @@ class FileMenu(QObject):
         self._save_spectra.triggered.connect(self.saveSpectra)
         self._menu.addAction(self._save_spectra)
         
+        self._export_spectra = QAction('Export spectrum contents locally...', self)
+        self._export_spectra.triggered.connect(self.exportSpectra)
+        self._menu.addAction(self._export_spectra)
+        
         self._menu.addSeparator()
         
         self._load = QAction('Load...', self)
@@ -85,50 +97,38 @@ class FileMenu(QObject):
         
     def _save_definitions(self):
         #  Prompt for the file and defer the actual save to the 
-        #  DefintionIO module.
+        #  DefintionIO module via the same snapshot code autosave uses (saveset)
+        #  (write_snapshot deletes any existing file).
         
         file = self. _getSqliteFilename()
         if file == ('',''):
             return
         filename = self._genfilename(file)
         
-        # If the file exists, delete it:
-        
-        try:
-            os.remove(filename)
-        except:
-            pass
-        saver = DefinitionIO.DefinitionWriter(filename)
-        
         try:
+            snapshot = saveset.snapshot_definitions(
+                self._client, bindings_controller.fetchGroups()
+            )
+            saveset.write_snapshot(filename, snapshot)
+        except Exception as  e:
+            error(f'Failed to write {filename}: {e}')
+    
+    def _save_definitions_and_contents(self):
+        #  Same as _save_definitions but the spectrum contents are saved too.
+        #  These are fetched a few at a time so that we don't need to hold all
+        #  spectra in memory at once.
         
-        # Save the parameters:
+        file = self. _getSqliteFilename()
+        if file == ('',''):
+            return
+        filename = self._genfilename(file)
         
-            parameter_defs = self._client.parameter_list()['detail']
-            saver.save_parameter_definitions(parameter_defs)
-            
-            # Spectrum definitions:
-            
-            spectrum_defs = self._client.spectrum_list()['detail']
-            saver.save_spectrum_definitions(spectrum_defs)
-            
-            #  Conditions:
-            
-            condition_defs = self._client.condition_list()['detail']
-            saver.save_condition_definitions(condition_defs)
-            
-            gate_defs = self._client.apply_list()['detail']
-            saver.save_gates(gate_defs)
-            
-            # SpecTcl has variables:
-            
-            if self._program == capabilities.Program.SpecTcl:
-                var_defs = self._client.treevariable_list()['detail']
-                saver.save_variables(var_defs)
-            
-            # Save the bindings groups 
-            
-            saver.save_binding_sets(bindings_controller.fetchGroups())
+        try:
+            snapshot = saveset.snapshot_definitions(
+                self._client, bindings_controller.fetchGroups()
+            )
+            contents = spectrumcontents.iter_contents(self._client, snapshot['spectra'])
+            saveset.write_snapshot(filename, snapshot, contents)
         except Exception as  e:
             error(f'Failed to write {filename}: {e}')
             
@@ -184,59 +184,153 @@ class FileMenu(QObject):
                     except RustogramerException as e:
                         error(f'Failed to save spectra to {filename} : {e}')
         
+    def exportSpectra(self):
+        '''
+          Prompt for a set of spectra and write them to a file on this system
+          (saveSpectra has the server write the file on its system).  This is
+          public so that it is accessible to the spectrum menu.
+        '''
+        namePrompter = SpectrumSaveDialog(self._menu, formats=spectrumwriter.supported_formats())
+        if not namePrompter.exec():
+            return
+        names = set(namePrompter.selectedSpectra())
+        format = namePrompter.format()
+        if len(names) == 0:
+            return
+        name = QFileDialog.getSaveFileName(
+            self._menu, 'Spectrum File', os.getcwd(), 
+            spectrumwriter.file_filter(format), spectrumwriter.file_filter(format)
+        )
+        if name == ('', ''):
+            return
+        filename = self._genfilename(name)
+        definitions = [x for x in self._client.spectrum_list()['detail'] if x['name'] in names]
+        
+        progress = QProgressDialog(f'Writing {filename}', 'Cancel', 0, len(definitions), self._menu)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(500)
+        def update(spectrum, done, total):
+            progress.setLabelText(f'Wrote {spectrum} ({done}/{total})')
+            progress.setMaximum(total)
+            progress.setValue(done)
+            QApplication.processEvents()
+            return not progress.wasCanceled()
+        skipped = list()
+        try:
+            spectrumwriter.write_spectra(self._client, filename, format, definitions, update, skipped=skipped)
+        except Exception as e:
+            error(f'Failed to export spectra to {filename} : {e}')
+        progress.setValue(progress.maximum())
+        if len(skipped) > 0:
+            error(f'These spectra have no axes and were not written to {filename}: {", ".join(skipped)}')
+        
     def _load_definitions(self):
-        #  Load definitions from a database file:
+        #  Load definitions from a database file.  The user is asked all the
+        #  questions up front, then the restore is done by a RestorePipeline
+        #  which issues requests in parallel, level by level in dependency order,
+        #  while we show progress.
         
-        self._client.unbind_all()
         file = self._getExistingSqliteFilename()
         if file[0] == '':
             return
         filename = self._genfilename(file)
-        reader = DefinitionIO.DefinitionReader(filename)
+        try:
+            reader = DefinitionIO.DefinitionReader(filename)
+            parameters = reader.read_parameter_defs()
+            spectra = reader.read_spectrum_defs()
+            conditions = reader.read_condition_defs()
+            applications = reader.read_applications()
+            variables = reader.read_variables()
+            bindsets = reader.read_bindsets()
+        except Exception as e:
+            error(f'Unable to read definitions from {filename}: {e}')
+            return
         
-        #  Read the parameters from the database and restore them (not so simple actually):
+        self._client.unbind_all()
+        pipeline = restorepipeline.RestorePipeline(self._client)
         
-        parameters = reader.read_parameter_defs()
-        self._update_parameters(parameters)
+        existing_parameters = [x['name'] for x in self._client.parameter_list()['detail']]
+        pipeline.add_parameters(parameters, existing_parameters)
         
-        spectra = reader.read_spectrum_defs()
         # There are several things they may want to do with existing spectra:
         # figure them out:
+        restored = list()
         if len(spectra) > 0:
             existing_dialog = DupSpectrumDialog(self._menu)
             choice = existing_dialog.exec()
-            existing = set()               # Will be existing indexed by name:
-            existing_spectra = self._client.spectrum_list()['detail']
+            existing = [x['name'] for x in self._client.spectrum_list()['detail']]
             if choice == 1:
-                # Existing is an empty set after we delete everything:
-                for spectrum in existing_spectra:
-                    self._client.spectrum_delete(spectrum['name'])
+                pipeline.add_spectrum_deletions(existing)
+                created = pipeline.add_spectra(spectra, [], False)
             elif choice == 2 or choice == 3:
-                # Need the existing spectrum names set:
-                for spectrum in existing_spectra:
-                    existing.add(spectrum['name'])
+                created = pipeline.add_spectra(spectra, existing, choice == 2)
             else:
-                pass
-            self._restore_spectra(choice, spectra, existing)
-        
-        conditions = reader.read_condition_defs()
-        for condition in conditions:
-            self._recreate_condition(condition)
+                created = list()    # Canceled - don't touch the spectra.
+            if choice != 0:
+                restored = [x['name'] for x in spectra]
             
+            # Saved contents are only put into spectra we make:
             
-        applications = reader.read_applications()
-        self._restore_gate_applications(applications)
+            if len(created) > 0 and reader.has_spectrum_contents():
+                pipeline.add_contents(reader.read_spectrum_contents(created), spectra)
+        try:
+            pipeline.add_conditions(conditions)
+        except ValueError as e:
+            error(f'Conditions in {filename} cannot be restored: {e}')
         
-        bindsets = reader.read_bindsets()
-        bindings_controller.loadBindingGroups(bindsets)
+        # Gate applications may need existing ones removed first:
         
-        # Simplest is to unbind all and rebind all:
+        if len(applications) > 0:
+            current = self._get_current_applications()
+            response = 2
+            if len(current) > 0:
+                response = ExistingApplicationsDialog(self._menu).exec()
+            if response == 1:
+                pipeline.add_ungate([x['spectrum'] for x in current])
+            if response != 0:
+                pipeline.add_applications(applications)
         
+        # Tree variables only exist in SpecTcl.  Everything was unbound above so
+        # the spectra from the file are bound again last:
         
+        if capabilities.get_program() == capabilities.Program.SpecTcl:
+            pipeline.add_variables(variables)
+        pipeline.add_bindings(restored)
         
+        report = self._run_restore(pipeline, filename)
         
+        bindings_controller.loadBindingGroups(bindsets)
         
+        if not report.ok():
+            msg = QMessageBox(QMessageBox.Warning, 'Restore failures', 
+                f'Not all definitions in {filename} could be restored: {report.summary()}',
+                QMessageBox.Ok, self._menu
+            )
+            msg.setDetailedText(report.details())
+            msg.exec()
+    
+    def _run_restore(self, pipeline, filename):
+        # Run a restore pipeline with a progress dialog; the pipeline calls
+        # back into us from this thread so we can keep the GUI alive.
+        
+        levels = pipeline.levels()
+        total = sum([len(x[1]) for x in levels])
+        progress = QProgressDialog(f'Restoring {filename}', 'Cancel', 0, max(total, 1), self._menu)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(500)
+        progress.canceled.connect(pipeline.cancel)
+        
+        def update(stage, done, total, rate):
+            progress.setLabelText(f'{stage}: {done}/{total} ({rate:.0f}/sec)')
+            progress.setValue(done)
+            QApplication.processEvents()
+        pipeline.set_progress(update)
+        
+        report = pipeline.run()
+        progress.setValue(max(total, 1))
+        return report
         
+
     def read_spectrum_file(self):
         '''
            Prompt for how and which file to read spectra from...and do it.
@@ -305,288 +399,6 @@ class FileMenu(QObject):
             self._menu, 'Definition File', os.getcwd(), 
             'Sqlite3 (*.sqlite)'
         )        
-    def _update_parameters(self, definitions):
-        #  Takes a set of parameter definitions and does what's needed.
-        # What's needed:
-        #   If the parameter does not exist, first just create it.
-        #   Then edit the parameter's properties to match what's in its new definition.
-        
-        existing_defs = self._client.parameter_list()['detail']
-        existing_map = dict()
-        for p in existing_defs:
-            existing_map[p['name']] = p
-
-        # Now we can run through the new definitions:
-        
-        names = existing_map.keys()
-        for p in definitions:
-            name = p['name']
-            if not name in names:
-                self._client.parameter_create(name, {})
-            # Only pull the non null ones out:
-            
-            mods = dict()
-            if p['low'] is not None:
-                mods['low'] = p['low']
-            if p['high'] is not None:
-                mods['high'] = p['high']
-            if p['units'] is not None:
-                mods['units'] = ['units']
-            
-            if mods:
-                # Dicts are true if non-empty:
-                self._client.parameter_modify(name, mods)
-    def _restore_spectra(self, dupchoice, spectra, existing):
-        #  dupchoice - selection from the DupSpectrumDialog   
-        #  spectra   - Description of spectra to restore.
-        #  existing  - Set of existing spectrum names.
-        
-        for spectrum in spectra:
-            if spectrum['name'] in existing:
-                if dupchoice == 2:          # Replace
-                    self._client.spectrum_delete(spectrum['name'])
-                else:
-                    # Else is ok because existing is empty if dupchoice is 1 so
-                    # Choice must be 3 (keep existing).
-                    continue            # Do nothing with that definition.
-            # At this point we can create the spectrum:
-            
-            self._create_spectrum(spectrum)
-    def _create_spectrum(self, definition):
-        
-        # Create a spectrum given its definition;  how depends on type:
-        
-        name = definition ['name']
-        stype = definition['type']
-        dtype = definition['datatype']
-        
-        
-        # If interchanging spectra between SpecTcl <--> Rustogramer we may need to 
-        # massage the data type:
-        
-        if capabilities.DataTypeStringsToChannelTypes[dtype] not in \
-            capabilities.get_supported_channelTypes():
-            dtype = capabilities.ChannelTypesToDataTypeStrings[
-                capabilities.get_default_channelType()]
-        
-        bad_types = []    # Spectra we could not make due to their types:
-        
-        if stype == '1':
-            if capabilities.has_1d():
-                self._client.spectrum_create1d(
-                    name, definition['xparameters'][0], 
-                    definition['xaxis']['low'], definition['xaxis']['high'], definition['xaxis']['bins'],
-                    dtype
-                )
-            else:
-                bad_types.append(name)
-        elif stype == '2':
-            if capabilities.has_2d():
-                self._client.spectrum_create2d(
-                    name, definition['xparameters'][0], definition['yparameters'][0],
-                    definition['xaxis']['low'], definition['xaxis']['high'], definition['xaxis']['bins'],
-                    definition['yaxis']['low'], definition['yaxis']['high'], definition['yaxis']['bins'],
-                    dtype
-                )
-            else:
-                bad_types.append(name)
-        elif stype == 'g1':
-            if capabilities.has_gamma1d():
-                self._client.spectrum_createg1(
-                    name, definition['parameters'],
-                    definition['xaxis']['low'], definition['xaxis']['high'], definition['xaxis']['bins'],
-                    dtype
-                )
-            else:
-                bad_types.append(name)
-        elif stype == 'g2':
-            if capabilities.has_gamma2d():
-                self._client.spectrum_createg2(
-                    name, definition['parameters'],
-                    definition['xaxis']['low'], definition['xaxis']['high'], definition['xaxis']['bins'],
-                    definition['yaxis']['low'], definition['yaxis']['high'], definition['yaxis']['bins'],
-                    dtype
-                )
-            else:
-                bad_types.append(name)
-        elif stype == 'gd':
-            if capabilities.has_pgamma():
-                self._client.spectrum_creategd(
-                    name, definition['xparameters'], definition['yparameters'],
-                    definition['xaxis']['low'], definition['xaxis']['high'], definition['xaxis']['bins'],
-                    definition['yaxis']['low'], definition['yaxis']['high'], definition['yaxis']['bins'],
-                    dtype
-                )
-            else:
-                bad_types.append(name)
-        elif stype == 's':
-            if capabilities.hasw_summmary():
-                # Axis definition...if there's a y axis we use it otherwise the X
-                # That may be a SpecTcl Rustogramer difference:
-                if definition['yaxis'] is not None and len(definition['yaxis']) != 0:
-                    axis = definition['yaxis']
-                else:
-                    axis = definition['xaxis']
-                self._client.spectrum_createsummary(
-                    name, definition['parameters'],
-                    axis['low'], axis['high'], axis['bins'],
-                    dtype
-                )
-            else:
-                bad_types.append(name)
-        elif stype == 'm2':
-            if capabilities.has_twosd_sum():
-                # If there's no y parameters, then every other parameter in x/y is 
-                # x,y
-                if definition['yparameters'] is None:
-                    xparams =list()
-                    yparams = list()
-                    p  = iter(definition['parameters'])
-                    for x in p:
-                        xparams.append(x)
-                        yparams.append(next(p))
-                else:
-                    xparams = definition['xparameters']
-                    yparams = definition['yparameters']
-                self._client.spectruM_create2dsum(
-                    name, xparams, yparams,
-                    definition['xaxis']['low'], definition['xaxis']['high'], definition['xaxis']['bins'],
-                    definition['yaxis']['low'], definition['yaxis']['high'], definition['yaxis']['bins'],
-                    dtype
-                )
-            else:
-                bad_types.append(name)
-        elif stype == 'S':
-            if capabilities.has_stripchart():
-                self._client.spectrum_createstripchart(
-                    name, definition['xparameters'][0], definition['yparameters'][1],
-                    definition['xaxis']['low'], definition['xaxis']['high'], definition['xaxis']['bins'],
-                    definition['yaxis']['low'], definition['yaxis']['high'], definition['yaxis']['bins'],
-                    dtype
-                )
-            else:
-                bad_types.append(name)
-        elif stype == 'b':
-            if capabilities.has_bitmask():
-                self._client.spectrum_createbitmask(
-                    name, definition['xparameters'][0],
-                    definition['xaxis']['low'], definition['xaxis']['high'], definition['xaxis']['bins'],
-                    dtype
-                )
-            else:
-                bad_types.append(name)
-        elif stype == 'gs':
-            if capabilities.has_gamma_summary():
-                print(' gamma summary def looks like: ', definition)
-            else:
-                bad_types.append(name)
-        else:
-            error(f'Specturm if type {stype} is not supported at this time.')
-    
-        # IF there are any spectra we could not create due to their types pop up a dialog
-        
-        if len(bad_types) > 0:
-            bad_names = ', '.join(bad_types)
-            QMessageBox.warning(None, 'Unsupported Type',
-                f'The following spectrum could not be made because it has an unsupp0rted type: {bad_names}'
-            )
-            
-    def _recreate_condition(self, cond):
-        # Re create a condition in the server:
-        # JUst return if the condition type is not supported by our histogramer:
-        
-        
-        cname = cond['name']
-        ctype = cond['type']
-        
-        if not capabilities.has_condition_name(ctype):
-            QMessageBox.warning(None, "Unsupported condition type", 
-                f'Cannot make condition {cname} because it is of type {ctype} which is not supported by the server'
-            )
-            return
-        
-        if ctype == 'T':
-            self._client.condition_make_true(cname)
-        elif ctype == 'F':
-            self._client.condition_make_false(cname)
-        elif ctype == '-':
-            self._client.condition_make_not(cname, cond['dependencies'][0])
-        elif ctype == '*':
-            self._client.condition_make_and(cname, cond['dependencies'])
-        elif ctype == '+':
-            self._client.condition_make_or(cname, cond['dependencies'])
-        elif ctype == 's':
-            self._client.condition_make_slice(
-                cname, cond['parameters'][0], 
-                cond['points'][0][0], cond['points'][1][0]
-            ) 
-        elif ctype== 'c':
-            self._client.condition_make_contour(
-                cname, cond['parameters'][0], cond['parameters'][1],
-                [{'x': x[0], 'y': x[1]} for x in cond['points']]
-            )
-        elif ctype== 'b':
-            self._client.condition_make_band(
-                cname, cond['parameters'][0], cond['parameters'][1],
-                [{'x': x[0], 'y': x[1]} for x in cond['points']]
-            )
-        elif ctype =='gs':
-            self._client.condition_make_gamma_slice(
-                cname, cond['parameters'],
-                cond['points'][0][0], cond['points'][1][0]
-            )
-        elif ctype == 'gc':
-            self._client.conditino_make_gamma_contour(
-                cname, cond['parameters'],
-                [{'x': x[0], 'y': x[1]} for x in cond['points']]
-            )
-        elif ctype == 'gb':
-            self._client.condition_make_gamma_band(
-                cname, cond['parameters'],
-                [{'x': x[0], 'y': x[1]} for x in cond['points']]
-            )
-        elif ctype == 'em':
-            self._client.condition_make_mask_equal(
-                cname, cond['parameters'][0], cond['mask']
-            )
-        elif ctype == 'am':
-            self._client.condition_make_mask_and(
-                cname, cond['parameters'][0], cond['mask']
-            )
-        elif ctype =='nm':
-            self._client.condition_make_mask_nand(
-                cname, cond['parameters'][0], cond['mask']
-            )
-        else:
-            error(f'Gate type {ctype} is not supported.')
-    
-    def _restore_gate_applications(self, apps):
-        # Restore the gate applications.  Doing this in a separate
-        # method makes handling the cancel from the ExistingApplcationsDialog eaiser.
-        
-        current = self._get_current_applications()
-        if len(current) > 0:
-            dlg = ExistingApplicationsDialog()
-            response = dlg.exec()
-            if response == 0:
-                return                # Cancel.
-            elif response == 1:
-                names =  [x['spectrum'] for x in current]
-                self._client.ungate_spectrum(names)
-            else:
-                pass                          # Should be 2.
-        # make the applications:
-        
-        fails = []
-        for app in apps:
-            try:
-                self._client.apply_gate(app['condition'], app['spectrum'])
-            except:
-                fails.append(f'{app["condition"]} -> {app["spectrum"]}')
-        if len(fails) > 0:
-            QMessageBox.warning(None, 'appy failures',
-                f'Some gate applications could not be restored because either the spectrum or condition could not be restored: {", ".join(fails)}'
-            )
     def _get_current_applications(self):
         # This is hidden in a method because there's some actual massaging in both Rustogramer
         # and SpecTcl needed to make the actual list of spectra with gates applied:
@@ -598,7 +410,6 @@ class FileMenu(QObject):
         #
         apps = [x for x in apps 
                 if (x['gate'] is not None) and (x['gate'] != '-Ungated-') and (x['gate'] != '-TRUE-')]
-        print(apps)
         return apps
     def _source_file(self):
         file = QFileDialog.getOpenFileName(
@@ -628,7 +439,11 @@ class SpectrumSaveDialog(QDialog):
     *   Buttons for Ok and Cancel.
     *  Selectors to get the selected spectra and the format name.
     '''
-    def __init__(self, *args):
+    def __init__(self, *args, formats=None):
+        '''
+        formats, if supplied, is the list of format names to offer, by default
+        these are the formats the server can write.
+        '''
         super().__init__(*args)
         layout = QVBoxLayout()
         
@@ -637,7 +452,8 @@ class SpectrumSaveDialog(QDialog):
         
         #  Radio boxes for formats:
         
-        formats = capabilities.get_supported_spectrum_format_strings()
+        if formats is None:
+            formats = capabilities.get_supported_spectrum_format_strings()
         radio_layout = QHBoxLayout()
         
         self._formats = []
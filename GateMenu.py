@@ -4,11 +4,17 @@ Proivides the Gate class which defines and implements the Gate menu items.
 
 from PyQt5.QtWidgets import(
     QAction, QDialog, QDialogButtonBox, QAbstractItemView, QPushButton,
-    QVBoxLayout
+    QVBoxLayout, QHBoxLayout, QGridLayout, QLabel, QLineEdit, QComboBox,
+    QFileDialog, QProgressDialog, QMessageBox, QApplication
 )
 from PyQt5.QtCore import pyqtSignal
+from PyQt5.Qt import Qt
+import os
 from gatelist import ConditionList, common_condition_model
 from conditionEditor import ConditionEditor
+from conditiongraph import common_condition_graph
+from spectrumeditor import confirm, error
+import gatearray
 class Gate():
     def __init__(self, menu, client, main, spectra):
         '''
@@ -28,6 +34,10 @@ class Gate():
         self._create.triggered.connect(self._create_gates)
         self._menu.addAction(self._create)
         
+        self._create_array = QAction('Create array...')
+        self._create_array.triggered.connect(self._create_gate_array)
+        self._menu.addAction(self._create_array)
+        
         self._apply = QAction('Apply...')
         self._apply.triggered.connect(self._spectra.apply_gate)
         self._menu.addAction(self._apply)
@@ -42,6 +52,65 @@ class Gate():
         dlg = ConditionCreationDialog(self._menu)
         dlg.exec()
         
+    def _create_gate_array(self):
+        dlg = GateArrayDialog(self._menu)
+        if not dlg.exec():
+            return
+        try:
+            parameters = [x['name'] for x in self._client.parameter_list()['detail']]
+            table = None
+            if dlg.table() != '':
+                table = gatearray.read_table(dlg.table())
+            definitions = gatearray.expand(
+                dlg.type(), dlg.name(), dlg.parameters(), parameters,
+                dlg.low(), dlg.high(), dlg.points(), table
+            )
+        except (OSError, ValueError) as e:
+            error(f'Unable to make the gate array: {e}')
+            return
+        if len(definitions) == 0:
+            error(f'No parameters match {", ".join(dlg.parameters())}')
+            return
+        definitions += gatearray.aggregates(definitions, dlg.or_name(), dlg.and_name())
+        
+        existing = set([x['name'] for x in self._client.condition_list()['detail']])
+        replaced = [d['name'] for d in definitions if d['name'] in existing]
+        if len(replaced) > 0 and \
+            not confirm(f'{len(replaced)} of the {len(definitions)} conditions exist (e.g. {replaced[0]}), replace them?', self._menu):
+            return
+        
+        report = self._run_pipeline(gatearray.create(self._client, definitions), len(definitions))
+        
+        # One refresh of the condition model once everything is made:
+        
+        self._refresh_gates()
+        common_condition_graph.load(self._client)
+        if not report.ok():
+            msg = QMessageBox(QMessageBox.Warning, 'Gate array failures',
+                f'Not all conditions could be made: {report.summary()}',
+                QMessageBox.Ok, self._menu
+            )
+            msg.setDetailedText(report.details())
+            msg.exec()
+    
+    def _run_pipeline(self, pipeline, total):
+        # Run the creation pipeline with a progress dialog (see FileMenu._run_restore).
+        
+        progress = QProgressDialog('Creating gate array', 'Cancel', 0, max(total, 1), self._menu)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(500)
+        progress.canceled.connect(pipeline.cancel)
+        
+        def update(stage, done, total, rate):
+            progress.setLabelText(f'{stage}: {done}/{total} ({rate:.0f}/sec)')
+            progress.setValue(done)
+            QApplication.processEvents()
+        pipeline.set_progress(update)
+        
+        report = pipeline.run()
+        progress.setValue(max(total, 1))
+        return report
+        
     def _delete_gates(self):
         dlg = GateListPrompter(self._menu)
         dlg.refresh.connect(self._refresh_gates)
@@ -102,4 +171,131 @@ class ConditionCreationDialog(QDialog):
         
         layout.addWidget(self._buttonBox)
         
-        self.setLayout(layout)
\ No newline at end of file
+        self.setLayout(layout)
+
+class GateArrayDialog(QDialog):
+    '''
+    Prompts for a gate array template (see gatearray):
+    
+        Type:        [Slice v]
+        Name:        [strip.*      ]
+        X parameter: [det.*        ]   Y parameter: [time.*   ]
+        Low: [    ] High: [    ]       Points: [x y, x y, ... ]
+        Table:       [             ] [Browse...]
+        OR name:     [             ]   AND name:    [         ]
+                      [Ok] [Cancel]
+    '''
+    _types = [('Slice', 's'), ('Contour', 'c'), ('Band', 'b')]
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.setWindowTitle('Create gate array')
+        layout = QVBoxLayout()
+        grid = QGridLayout()
+        
+        self._type = QComboBox(self)
+        self._type.addItems([x[0] for x in self._types])
+        grid.addWidget(QLabel('Type:', self), 0, 0)
+        grid.addWidget(self._type, 0, 1)
+        
+        self._name = QLineEdit(self)
+        self._name.setPlaceholderText('e.g. strip.*')
+        grid.addWidget(QLabel('Name:', self), 1, 0)
+        grid.addWidget(self._name, 1, 1)
+        
+        self._xparameter = QLineEdit(self)
+        self._xparameter.setPlaceholderText('e.g. det.*')
+        grid.addWidget(QLabel('X parameter:', self), 2, 0)
+        grid.addWidget(self._xparameter, 2, 1)
+        self._yparameter = QLineEdit(self)
+        grid.addWidget(QLabel('Y parameter:', self), 2, 2)
+        grid.addWidget(self._yparameter, 2, 3)
+        
+        self._low = QLineEdit(self)
+        grid.addWidget(QLabel('Low:', self), 3, 0)
+        grid.addWidget(self._low, 3, 1)
+        self._high = QLineEdit(self)
+        grid.addWidget(QLabel('High:', self), 3, 2)
+        grid.addWidget(self._high, 3, 3)
+        
+        self._points = QLineEdit(self)
+        self._points.setPlaceholderText('x y, x y, ...')
+        grid.addWidget(QLabel('Points:', self), 4, 0)
+        grid.addWidget(self._points, 4, 1, 1, 3)
+        
+        table = QHBoxLayout()
+        self._table = QLineEdit(self)
+        self._table.setPlaceholderText('Optional per element limits/points')
+        table.addWidget(self._table)
+        self._browse = QPushButton('Browse...', self)
+        table.addWidget(self._browse)
+        grid.addWidget(QLabel('Table:', self), 5, 0)
+        grid.addLayout(table, 5, 1, 1, 3)
+        
+        self._or = QLineEdit(self)
+        grid.addWidget(QLabel('OR name:', self), 6, 0)
+        grid.addWidget(self._or, 6, 1)
+        self._and = QLineEdit(self)
+        grid.addWidget(QLabel('AND name:', self), 6, 2)
+        grid.addWidget(self._and, 6, 3)
+        layout.addLayout(grid)
+        
+        self._buttonBox = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, self)
+        self._buttonBox.accepted.connect(self.accept)
+        self._buttonBox.rejected.connect(self.reject)
+        layout.addWidget(self._buttonBox)
+        self.setLayout(layout)
+        
+        self._type.currentIndexChanged.connect(self._type_changed)
+        self._browse.clicked.connect(self._browse_table)
+        self._type_changed(0)
+    
+    def type(self):
+        return self._types[self._type.currentIndex()][1]
+    def name(self):
+        return self._name.text().strip()
+    def parameters(self):
+        result = [self._xparameter.text().strip()]
+        if self.type() in gatearray.TWOD_TYPES:
+            result.append(self._yparameter.text().strip())
+        return result
+    def low(self):
+        return self._number(self._low)
+    def high(self):
+        return self._number(self._high)
+    def points(self):
+        # Points are x y pairs separated by commas.  ValueError if they're not numbers.
+        
+        text = self._points.text().strip()
+        if text == '':
+            return None
+        result = list()
+        for point in text.split(','):
+            xy = point.split()
+            if len(xy) != 2:
+                raise ValueError(f'Points must be x y pairs: {point.strip()}')
+            result.append((float(xy[0]), float(xy[1])))
+        return result
+    def table(self):
+        return self._table.text().strip()
+    def or_name(self):
+        return self._or.text().strip()
+    def and_name(self):
+        return self._and.text().strip()
+    
+    def _number(self, field):
+        text = field.text().strip()
+        if text == '':
+            return None
+        return float(text)
+    def _type_changed(self, index):
+        twod = self.type() in gatearray.TWOD_TYPES
+        self._yparameter.setEnabled(twod)
+        self._points.setEnabled(twod)
+        self._low.setEnabled(not twod)
+        self._high.setEnabled(not twod)
+    def _browse_table(self):
+        file = QFileDialog.getOpenFileName(
+            self, 'Gate array table', os.getcwd(), 'Text files (*.txt *.dat *.csv);;All files (*.*)'
+        )
+        if file[0] != '':
+            self._table.setText(file[0])
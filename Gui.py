@@ -5,6 +5,8 @@
     --port - port on which the REST server is listening (defaults to 8000)
     --service - Defaults to None - service the REST server advertises
     --service_user - User the service is advertised under defaults to the name of the current user.
+    --autosave-interval - Seconds between definition checkpoints (0 disables), defaults to 300.
+    --autosave-file - Most recent checkpoint file, defaults to spectcl-gui-autosave.sqlite
 
 '''
 
@@ -36,6 +38,10 @@ import bindings
 import bindingscontroller
 import waveformview, waveformcontroller
 import vectorparams
+import rateview
+import traceservice
+import pollscheduler
+import autosave
 
 def _updateBindableSpectra(index):
     if index == bindings_tab_index:
@@ -162,6 +168,16 @@ parsed_args.add_argument('-p', '--port',
 parsed_args.add_argument('-s', '--service', default=None, action='store', help='Service the REST server advertises defaults to None')
 parsed_args.add_argument('-u', '--service-user', default=OsServices.getlogin(), action='store', help=f'Username the REST server advertises under defaults to "{OsServices.getlogin()}"')
 
+parsed_args.add_argument('--autosave-interval', default=autosave.DEFAULT_INTERVAL, type=float, action='store',
+    help=f'Seconds between automatic definition checkpoints, 0 disables autosave. Defaults to {autosave.DEFAULT_INTERVAL}'
+)
+parsed_args.add_argument('--autosave-file', default='spectcl-gui-autosave.sqlite', action='store',
+    help='Definition file autosave checkpoints are written to. Defaults to "spectcl-gui-autosave.sqlite"'
+)
+parsed_args.add_argument('--trace-retention', default=traceservice.DEFAULT_RETENTION, type=float, action='store',
+    help=f'Seconds the server keeps change traces for us (changes are polled at half this), 0 disables tracking changes made by other clients. Defaults to {traceservice.DEFAULT_RETENTION}'
+)
+
 args = parsed_args.parse_args()
 
 client_args = {'host' : args.host, 'port':args.port, 'pmanport': PORTMAN_PORT}
@@ -183,6 +199,13 @@ app = QApplication(sys.argv)
 main = QMainWindow()
 main.setWindowTitle("SpecTcl/Rustogramer ReST GUI - powered by Qt5")
 
+# All periodic server work is scheduled by one scheduler which pauses
+# display-only work while the main window is hidden:
+
+scheduler = pollscheduler.PollScheduler(client)
+pollscheduler.set_scheduler(scheduler)
+window_watcher = pollscheduler.WindowWatcher(main, scheduler)
+
 # Style sheet to make the selected tabs stand out more:
 
 setTabStyle(app)
@@ -238,6 +261,16 @@ if capabilities.has_vector_parameters():
     vector_tab_index = tab_num
     tab_num += 1
     
+# Rates of the analysis and of the spectra - only sampled when the tab is visible:
+
+rates_view = rateview.RatesTab()
+rates_controller = rateview.RatesController(rates_view, client)
+tabs.addTab(rates_view, 'Rates')
+rates_tab_index = tab_num
+rates_controller.set_visible(False)
+tabs.currentChanged.connect(lambda index: rates_controller.set_visible(index == rates_tab_index))
+tab_num += 1
+    
 # if you add tabs, be sure to update tab_num so that, if necessary a tab can save its tab number.
 #  Note that the tab number below are capability dependent.
 
@@ -253,6 +286,37 @@ main.setCentralWidget(tabs)
 
 setup_menubar(main, client)
 
+# Background checkpoints of the definitions.  Results are reported in the status bar:
+
+if args.autosave_interval > 0:
+    autosave_service = autosave.AutosaveService(
+        client, args.autosave_file, args.autosave_interval,
+        bindsets=FileMenu.bindings_controller.fetchGroups
+    )
+    autosave_service.saved.connect(
+        lambda filename, seconds: main.statusBar().showMessage(
+            f'Autosaved definitions to {filename} in {seconds:.2f} seconds', 10000
+        )
+    )
+    autosave_service.failed.connect(lambda msg: main.statusBar().showMessage(msg, 10000))
+    autosave_service.start()
+
+# Track changes other clients make in the server (SpecTcl traces or listing diffs):
+
+if args.trace_retention > 0:
+    if capabilities.has_traces():
+        trace_source = traceservice.TraceSource(client, args.trace_retention)
+    else:
+        trace_source = traceservice.DiffSource(client, args.trace_retention/2)
+    trace_service = traceservice.TraceService(client, trace_source)
+    model_updater = traceservice.ModelUpdater(trace_service, client, [spectrum_view.spectrumModel()])
+    trace_service.failed.connect(lambda msg: main.statusBar().showMessage(msg, 10000))
+    model_updater.failed.connect(lambda msg: main.statusBar().showMessage(msg, 10000))
+    FileMenu.bindings_controller.track(trace_service)
+    trace_service.start()
+    app.aboutToQuit.connect(trace_service.stop)
+app.aboutToQuit.connect(scheduler.stop)
+
 main.show()
 app.exec()
  
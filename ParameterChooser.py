@@ -51,6 +51,57 @@ def update_model(client):
         _subtree(top, tree[key])
         _parameter_model.appendRow(top)
 
+def add_parameter(name):
+    '''
+    Add a single parameter to the shared model without reloading it.  The
+    tree path of the name (see TreeMaker) is created as needed.
+    '''
+    if name in _parameter_names:
+        return
+    _parameter_names.append(name)
+    parent = _parameter_model.invisibleRootItem()
+    for element in name.split('.'):
+        child = _find_child(parent, element)
+        if child is None:
+            child = QStandardItem(element)
+            _insert_sorted(parent, child)
+        parent = child
+
+def remove_parameter(name):
+    '''
+    Remove a single parameter from the shared model without reloading it.
+    Tree nodes left without children are pruned.
+    '''
+    if name not in _parameter_names:
+        return
+    _parameter_names.remove(name)
+    path = [_parameter_model.invisibleRootItem()]
+    for element in name.split('.'):
+        child = _find_child(path[-1], element)
+        if child is None:
+            return
+        path.append(child)
+    
+    # Remove the leaf and any ancestors it leaves empty:
+    
+    while len(path) > 1 and not path[-1].hasChildren():
+        item = path.pop()
+        path[-1].removeRow(item.row())
+
+def _find_child(parent, text):
+    for row in range(parent.rowCount()):
+        child = parent.child(row)
+        if child.text() == text:
+            return child
+    return None
+
+def _insert_sorted(parent, child):
+    # update_model sorts the names so keep siblings in order:
+    row = 0
+    while row < parent.rowCount() and parent.child(row).text() < child.text():
+        row += 1
+    parent.insertRow(row, child)
+
 def parameters():
     global _parameter_names
     return _parameter_names
@@ -20,6 +20,7 @@ from PyQt5.Qt import *
 from spectrumeditor import error
 from ParameterChooser import LabeledParameterChooser
 from editablelist import EditableList
+from TwodConditionEditor import ConditionPreview
 
 
 default_low =  0.0
@@ -44,8 +45,12 @@ class EditorView(QWidget):
             name - name of the gate.
             low, high - limits selected by the user.
             parameter - parameter selected by the user.
+            previewSpectrum - Spectrum to preview on.
+            previewResult - Text describing the preview.
     '''
     commit = pyqtSignal()
+    preview = pyqtSignal()
+    changed = pyqtSignal()
     def __init__(self, *args):
         super().__init__(*args)
         
@@ -87,6 +92,10 @@ class EditorView(QWidget):
         line3.addStretch(1)
         layout.addLayout(line3)
         
+        # Then the preview:
+        
+        self._preview = ConditionPreview(self)
+        layout.addWidget(self._preview)
         
         # Bottom is our button.
         
@@ -103,6 +112,12 @@ class EditorView(QWidget):
         
         self._commit.clicked.connect(self.validate)
         
+        # Preview relays;  editing the limits changes the previewed condition:
+        
+        self._preview.preview.connect(self.preview)
+        self._low.textChanged.connect(self.changed)
+        self._high.textChanged.connect(self.changed)
+        
     # Attribute implementations:
     
     def name(self):
@@ -111,19 +126,19 @@ class EditorView(QWidget):
         self._name.setText(name)
         
     def low(self):
-        ''' can return None if the text is empty otherwise it's a float'''
-        t = self._low.text()
-        if t == '' or t.isspace():
+        ''' can return None if the text is empty or not (yet) a number otherwise it's a float'''
+        try:
+            return float(self._low.text())
+        except ValueError:
             return None
-        return float(t)
     def setLow(self, value):
         self._low.setText(f'{value}')
     
     def high(self):
-        t = self._high.text()
-        if t == '' or t.isspace():
+        try:
+            return float(self._high.text())
+        except ValueError:
             return None
-        return float(t)
     def setHigh(self, value):
         self._high.setText(f'{value}')
         
@@ -131,6 +146,15 @@ class EditorView(QWidget):
         return self._parameter.parameter()
     def setParameter(self, name):
         self._parameter.setParameter(name)
+    
+    def previewSpectrum(self):
+        return self._preview.spectrum()
+    def setPreviewSpectrum(self, name):
+        self._preview.setSpectrum(name)
+    def previewResult(self):
+        return self._preview.result()
+    def setPreviewResult(self, text):
+        self._preview.setResult(text)
         
     # Public methods:
     
@@ -140,6 +164,7 @@ class EditorView(QWidget):
         self.setLow(default_low)
         self.setHigh(default_high)
         self.setParameter('')
+        self.setPreviewResult('')
         
     # Slots:
     
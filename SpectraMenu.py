@@ -37,6 +37,10 @@ class SpectraMenu():
     self._save.triggered.connect(self._file_menu.saveSpectra)
     self._menu.addAction(self._save)
     
+    self._export = QAction('Export Contents of Spectra locally...')
+    self._export.triggered.connect(self._file_menu.exportSpectra)
+    self._menu.addAction(self._export)
+    
     self._read = QAction('Read Spectrum file...')
     self._read.triggered.connect(self._file_menu.read_spectrum_file)
     self._menu.addAction(self._read)
@@ -228,6 +228,22 @@ class SpectrumModel(QStandardItemModel):
         self._addItem(definition)
         self.sort(0)
 
+    def replaceSpectrum(self, definition):
+        ''' Replace the row for definition['name'] or add it if there is none '''
+        items = self.findItems(definition['name'])
+        if len(items) == 0:
+            self.addSpectrum(definition)
+        else:
+            self.replaceRow(items[0].row(), definition)
+
+    def setGates(self, gates):
+        ''' Update just the gate column of the rows in the dict of name -> gate '''
+        for (name, gate) in gates.items():
+            if gate is None:
+                gate = ''
+            for item in self.findItems(name):
+                self._replaceItem(item.row(), 10, gate)
+
     def removeSpectrum(self, name):
         items = self.findItems(name)
         for item in items:      # Deals correctly with no/multiple matches:
@@ -7,6 +7,8 @@
    *   A Y parameter.
    *   A list of points (settable minimum number of required points defaults to 3)
    
+   ConditionPreview is a line that lets a condition being edited be previewed
+   on a spectrum (see gatepreview) before it's made.
    
 '''
 
@@ -113,6 +115,9 @@ class PointListEditor(QWidget):
             y = pt['y']
             items.append(f'({x}, {y})')
         self._points.setList(items)    
+    def pointList(self):
+        ''' The EditableList holding the points '''
+        return self._points
     # internal slots:
     
     def _addpoint(self):
@@ -122,10 +127,51 @@ class PointListEditor(QWidget):
             return         # Need both x and y.
         
         self._points.appendItem(f'({x}, {y})')    
+
+class ConditionPreview(QWidget):
+    ''' A line with:
+        Preview on: [spectrum name] [Preview]  result text
+        
+    Signals:
+        preview - the Preview button was clicked.
+    Attributes:
+        spectrum - name of the spectrum to preview on.
+        result   - Text describing the preview result.
+    '''
+    preview = pyqtSignal()
+    def __init__(self, *args):
+        super().__init__(*args)
+        layout = QHBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(QLabel('Preview on: ', self))
+        self._spectrum = QLineEdit(self)
+        layout.addWidget(self._spectrum)
+        self._preview = QPushButton('Preview', self)
+        layout.addWidget(self._preview)
+        self._result = QLabel('', self)
+        layout.addWidget(self._result)
+        layout.addStretch(1)
+        self.setLayout(layout)
+        
+        self._preview.clicked.connect(self.preview)
+        self._spectrum.returnPressed.connect(self.preview)
+    
+    def spectrum(self):
+        return self._spectrum.text()
+    def setSpectrum(self, name):
+        self._spectrum.setText(name)
+    
+    def result(self):
+        return self._result.text()
+    def setResult(self, text):
+        self._result.setText(text)
+        
 class TwodConditionEditor(QWidget):
     '''
         Signals:
            commit - Create/replace the condition.
+           preview - Preview the condition on previewSpectrum.
+           changed - The points changed (a preview can be updated).
         Slots:
             validate - Called from the Create/Replace button's clicked signal. If
                 -   There's a condition name.
@@ -141,8 +187,12 @@ class TwodConditionEditor(QWidget):
             yparam - name of the y parameter.
             points - list of points, each point containing {'x':xxxx, 'y':yyyy}  
             minpoints - Minimum allowed # of points     
+            previewSpectrum - Spectrum to preview on.
+            previewResult - Text describing the preview.
     '''
     commit = pyqtSignal()
+    preview = pyqtSignal()
+    changed = pyqtSignal()
     def __init__(self, *args):
         super().__init__(*args)
         
@@ -178,6 +228,10 @@ class TwodConditionEditor(QWidget):
         ptlist.addStretch(1)
         layout.addLayout(ptlist)
         
+        # Line 4 previews the condition:
+        
+        self._preview = ConditionPreview(self)
+        layout.addWidget(self._preview)
         
         #  The create/replace is bottom.
         
@@ -195,6 +249,14 @@ class TwodConditionEditor(QWidget):
 
         self._minpoints = 3        # Contour
         
+        # Relay the preview signals - any change to the point list is a change:
+        
+        self._preview.preview.connect(self.preview)
+        points = self._pointlist.pointList().listbox().model()
+        points.rowsInserted.connect(self.changed)
+        points.rowsRemoved.connect(self.changed)
+        points.rowsMoved.connect(self.changed)
+        
         
         
         # Similarly the commit button goes to our validate slot
@@ -231,6 +293,15 @@ class TwodConditionEditor(QWidget):
     def setPoints(self, pts):
         self._pointlist.setPoints(pts)
     
+    def previewSpectrum(self):
+        return self._preview.spectrum()
+    def setPreviewSpectrum(self, name):
+        self._preview.setSpectrum(name)
+    def previewResult(self):
+        return self._preview.result()
+    def setPreviewResult(self, text):
+        self._preview.setResult(text)
+    
     # Public Methods:
     
     def clear(self):
@@ -240,6 +311,7 @@ class TwodConditionEditor(QWidget):
         self.setPoints(list())
         self._pointlist.setX(0.0)
         self._pointlist.setY(0.0)
+        self.setPreviewResult('')
         
     
         
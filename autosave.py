@@ -0,0 +1,157 @@
+'''
+This module provides a background autosave (checkpoint) service for the
+definitions held by the histogramer.  Periodically the service snapshots the
+parameter, spectrum, condition, gate application, tree variable (SpecTcl only)
+and binding set definitions and, if they changed since the last checkpoint,
+writes them to a rolling set of sqlite3 checkpoint files using the
+DefinitionIO module.  The checkpoint files can be loaded with File->Load...
+just like any file written by File->Save...
+
+The REST requests and the database writes are done in a worker thread so that
+the Qt event loop is never blocked waiting for the server or the disk.  Only
+the binding sets, which are local GUI state, are gathered in the GUI thread.
+
+Checkpoint files roll: the most recent checkpoint is always in the filename
+given to the service.  Prior checkpoints are named by inserting .1, .2 ... before
+the extension, with .1 being the most recent prior checkpoint.  So, with a
+filename of autosave.sqlite and 3 generations you'd have:
+autosave.sqlite, autosave.1.sqlite and autosave.2.sqlite.
+
+Snapshots are taken and written by the functions in the saveset module.
+Checkpoints are timed by the pollscheduler.
+'''
+
+import os
+import threading
+import time
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+import pollscheduler
+from saveset import snapshot_definitions, snapshot_digest, write_snapshot
+
+DEFAULT_INTERVAL = 5*60           # Seconds between checkpoints.
+DEFAULT_GENERATIONS = 3           # Number of checkpoint files retained.
+
+
+def generation_filename(filename, generation):
+    '''
+    Return the name of a prior checkpoint file.  Generation 0 is 'filename'
+    itself, generation 1 is the most recent prior checkpoint and so on.
+    '''
+    if generation == 0:
+        return filename
+    (base, ext) = os.path.splitext(filename)
+    return f'{base}.{generation}{ext}'
+
+
+class AutosaveService(QObject):
+    '''
+    Periodically checkpoints the definitions.
+
+    Signals:
+        saved(filename, seconds) - A checkpoint was written to filename and
+                   took seconds to take and write.
+        unchanged  - A checkpoint was skipped because nothing changed.
+        failed(message) - A checkpoint failed, message describes why.
+    Methods:
+        start      - Start periodic checkpoints.
+        stop       - Stop periodic checkpoints.
+        set_interval - Change the checkpoint interval.
+        checkpoint - Request a checkpoint now.
+    Note that signals are emitted from the worker thread, connections to
+    slots in the GUI are therefore queued by Qt.
+    '''
+    saved = pyqtSignal(str, float)
+    unchanged = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def __init__(self, client, filename, interval=DEFAULT_INTERVAL,
+                 generations=DEFAULT_GENERATIONS, bindsets=None, *args):
+        '''
+        *  client - REST client used to fetch the definitions.
+        *  filename - Name of the most recent checkpoint file.
+        *  interval - Seconds between checkpoints.
+        *  generations - Number of checkpoint files to keep (at least 1).
+        *  bindsets - Callable that returns the current binding sets
+           (e.g. BindingsController.fetchGroups) or None.
+        '''
+        super().__init__(*args)
+        self._client = client
+        self._filename = filename
+        self._generations = max(1, int(generations))
+        self._bindsets = bindsets
+        self._last_digest = None
+        self._worker = None
+        self._job = None
+        self._interval = interval
+
+    def filename(self):
+        return self._filename
+
+    def set_interval(self, seconds):
+        ''' Set the checkpoint interval in seconds  - takes effect now '''
+        self._interval = seconds
+        if self._job is not None:
+            self._job.set_period(seconds)
+
+    def start(self):
+        ''' Checkpoints are scheduled by the pollscheduler, the first after one interval '''
+        if self._job is None:
+            self._job = pollscheduler.get_scheduler().register(
+                'autosave', self.checkpoint, self._interval, delay=self._interval
+            )
+
+    def stop(self):
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+
+    def checkpoint(self):
+        '''
+        Start a checkpoint in the worker thread.  If a checkpoint is still
+        in progress from the last interval, this one is skipped.
+        '''
+        if self._worker is not None and self._worker.is_alive():
+            return
+        bindsets = None
+        if self._bindsets is not None:
+            bindsets = self._bindsets()      # GUI state must be fetched in the GUI thread.
+        self._worker = threading.Thread(
+            target=self._checkpoint, args=(bindsets,), daemon=True
+        )
+        self._worker.start()
+
+    # Private methods:
+
+    def _checkpoint(self, bindsets):
+        # Runs in the worker thread.
+
+        start = time.monotonic()
+        try:
+            snapshot = snapshot_definitions(self._client, bindsets)
+            digest = snapshot_digest(snapshot)
+            if digest == self._last_digest:
+                self.unchanged.emit()
+                return
+
+            # Write to a temporary then roll the generations; that way an
+            # interrupted checkpoint never costs us the last good one.
+
+            temp = self._filename + '.tmp'
+            write_snapshot(temp, snapshot)
+            self._roll()
+            os.replace(temp, self._filename)
+            self._last_digest = digest
+            self.saved.emit(self._filename, time.monotonic() - start)
+        except Exception as e:
+            self.failed.emit(f'Autosave to {self._filename} failed: {e}')
+
+    def _roll(self):
+        # Move each generation up one, the oldest falls off the end.
+
+        for generation in range(self._generations - 1, 0, -1):
+            older = generation_filename(self._filename, generation)
+            newer = generation_filename(self._filename, generation - 1)
+            if os.path.exists(newer):
+                os.replace(newer, older)
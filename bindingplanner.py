@@ -0,0 +1,172 @@
+'''
+This module plans bindings of spectra into the server's display (shared)
+memory before they are made.  sbind_spectra either binds everything or fails
+and the failure doesn't say which spectra didn't fit;  the planner predicts it:
+
+*  footprint(definition) - the bytes a spectrum takes in display memory:
+   the product of its axis bins (SpecTcl adds an underflow and overflow bin
+   to each axis;  Rustogramer's axis definitions already count them) times
+   the size of a channel of its chantype.  SpecTcl summary spectra have no
+   x axis;  they have a column of channels for each x parameter (with no
+   extra bins) so they take that many times their y axis.
+*  The spectrum pool is DisplayMegabytes from shmem_getvariables or, if
+   that's not known, shmem_getsize (which also counts the header so it's an
+   over estimate).
+*  Spectra already bound (sbind_list) occupy their footprints and need no new
+   space unless the bindings are being replaced.
+
+plan_bindings packs the requested spectra into the free space:  priority spectra
+first, in the order given, then the rest smallest first so that as many as
+possible fit.  The BindingPlan says which spectra will be bound and which
+won't fit so the caller can bind them all in one sbind_spectra request.
+
+Nothing here depends on Qt.
+'''
+
+import capabilities
+
+MEGABYTE = 1024*1024
+
+CHANNEL_BYTES = {
+    capabilities.ChannelTypes.Byte: 1,
+    capabilities.ChannelTypes.Short: 2,
+    capabilities.ChannelTypes.Long: 4,
+    capabilities.ChannelTypes.Double: 8
+}
+
+def extra_bins():
+    ''' Bins the server adds to each axis in display memory beyond the axis definition '''
+    if capabilities.get_program() == capabilities.Program.SpecTcl:
+        return 2
+    return 0
+
+def footprint(definition, extra=None):
+    '''
+    Bytes of display memory the spectrum 'definition' (as from spectrum_list) needs.
+    'extra' is the number of bins added to each axis (default extra_bins()).
+    Summary spectra without an x axis take a column per x parameter and
+    spectra with no axes take no memory.
+    '''
+    if extra is None:
+        extra = extra_bins()
+    xaxis = definition.get('xaxis')
+    yaxis = definition.get('yaxis')
+    if yaxis is not None and len(yaxis) == 0:
+        yaxis = None
+    if xaxis is None:
+        parameters = definition.get('xparameters')
+        if yaxis is None or not parameters:
+            return 0
+        channels = len(parameters)*(yaxis['bins'] + extra)
+    else:
+        channels = xaxis['bins'] + extra
+        if yaxis is not None:
+            channels *= yaxis['bins'] + extra
+    return channels*channel_bytes(definition.get('chantype'))
+
+def channel_bytes(chantype):
+    ''' Bytes per channel of a chantype string (the server's default if not known) '''
+    channel_type = capabilities.DataTypeStringsToChannelTypes.get(chantype)
+    if channel_type is None:
+        channel_type = capabilities.get_default_channelType()
+    return CHANNEL_BYTES[channel_type]
+
+def pool_size(client):
+    ''' Bytes in the server's display memory spectrum pool '''
+    try:
+        megabytes = client.shmem_getvariables()['detail']['DisplayMegabytes']
+        return int(float(megabytes)*MEGABYTE)
+    except (KeyError, TypeError, ValueError):
+        return int(client.shmem_getsize()['detail'])
+
+class BindingPlan:
+    '''
+    Result of plan_bindings.
+    Attributes:
+       bind     - Spectra to bind (in the order requested) - all of these fit.
+       bound    - Requested spectra that are already bound.
+       rejected - Spectra that won't fit.
+       unknown  - Requested spectra that don't exist.
+       sizes    - dict of spectrum name -> footprint in bytes.
+       available - bytes free before binding.
+       used     - bytes the spectra in 'bind' will take.
+    '''
+    def __init__(self):
+        self.bind = list()
+        self.bound = list()
+        self.rejected = list()
+        self.unknown = list()
+        self.sizes = dict()
+        self.available = 0
+        self.used = 0
+
+    def fits(self):
+        ''' True if every (existing) requested spectrum will be bound '''
+        return len(self.rejected) == 0
+
+    def needed(self):
+        ''' Bytes needed to bind everything requested that is not already bound '''
+        return self.used + sum([self.sizes[x] for x in self.rejected])
+
+    def summary(self):
+        return (
+            f'{len(self.bind)} spectra will be bound ({self.used/MEGABYTE:.1f} of '
+            f'{self.available/MEGABYTE:.1f} MB free), {len(self.rejected)} will not fit '
+            f'({self.needed()/MEGABYTE:.1f} MB needed)'
+        )
+
+    def details(self):
+        return '\n'.join([f'{x}: {self.sizes[x]/MEGABYTE:.2f} MB' for x in self.rejected])
+
+def plan_bindings(definitions, spectra, pool, bound=(), priority=(), extra=None):
+    '''
+    Plan the binding of 'spectra'.
+    *  definitions - dict of name -> spectrum definition (at least the requested
+                     and bound spectra).
+    *  spectra  - names of the spectra to bind.
+    *  pool     - bytes in the spectrum pool.
+    *  bound    - names of the spectra already bound (sbind_list).
+    *  priority - names of the spectra to fit first (in this order).
+    *  extra    - see footprint.
+    Returns a BindingPlan.
+    '''
+    plan = BindingPlan()
+    bound = set(bound)
+    occupied = sum([footprint(definitions[x], extra) for x in bound if x in definitions])
+    plan.available = max(0, pool - occupied)
+
+    candidates = list()
+    for name in dict.fromkeys(spectra):            # Duplicates removed, order kept.
+        if name not in definitions:
+            plan.unknown.append(name)
+        elif name in bound:
+            plan.bound.append(name)
+        else:
+            plan.sizes[name] = footprint(definitions[name], extra)
+            candidates.append(name)
+
+    first = [x for x in dict.fromkeys(priority) if x in plan.sizes]
+    chosen = set(first)
+    rest = sorted([x for x in candidates if x not in chosen], key=lambda x: plan.sizes[x])
+    free = plan.available
+    accepted = set()
+    for name in first + rest:
+        if plan.sizes[name] <= free:
+            free -= plan.sizes[name]
+            accepted.add(name)
+    plan.bind = [x for x in candidates if x in accepted]
+    plan.rejected = [x for x in candidates if x not in accepted]
+    plan.used = plan.available - free
+    return plan
+
+def plan(client, spectra, priority=(), replace=False):
+    '''
+    Plan binding 'spectra' in the server 'client' talks to.  If replace is True the
+    current bindings are assumed to be removed first (unbind_all) otherwise they
+    occupy their space.  Returns a BindingPlan.
+    '''
+    definitions = {x['name']: x for x in client.spectrum_list()['detail']}
+    bound = list()
+    if not replace:
+        bound = [x['name'] for x in client.sbind_list()['detail']]
+    return plan_bindings(definitions, spectra, pool_size(client), bound, priority)
@@ -10,12 +10,20 @@
   
   The model part of the MVC is loaded as internal data to the view from the underlying actual model:
   the server and spectrum sets held by the specstrumset.SpecTrumSet objects.
+  
+  If the controller tracks a traceservice.TraceService, spectrum creations and
+  deletions update the valid spectrum names as they happen and the spectrum sets
+  keep their own counts of invalid members, so showing the BindSets tab only
+  revalidates if some spectrum came or went.  Without one (or after a resync) the
+  spectrum list is reloaded.
 '''
 
-from spectrumset import UpdateValidNames, ValidNames, SpectrumSet
+from spectrumset import (
+  UpdateValidNames, AddValidNames, RemoveValidNames, ValidNames, Generation, SpectrumSet
+)
 from bindings import *
-from SpectrumList import SpectrumModel
 from bindingeditor import promptNewBindingList, editBindingList
+import bindingplanner
 
 from PyQt5.QtWidgets import QMessageBox
 
@@ -40,7 +48,9 @@ class BindingsController:
       self._view = view
       self._client = client
       self._bindinglists = list()  # list of SpectrumSet Each is a dict of name, desc, and spectrumset.
-      self._spectrumList = SpectrumModel()
+      self._tracking = False       # True if a TraceService keeps the names current.
+      self._stale = True           # Names need a full reload.
+      self._generation = None      # spectrumset.Generation() at the last validation.
       
       self._updateValidSpectra()
       
@@ -90,8 +100,24 @@ class BindingsController:
 
 
   def updateValidSpectra(self):
-
-    self._updateValidSpectra()
+    '''
+      Called e.g. when the bindings tab is shown.  If the valid names are being
+      tracked only changes since the last validation are looked at.
+    '''
+    if self._tracking and not self._stale:
+      if Generation() != self._generation:
+        self._revalidate()
+    else:
+      self._updateValidSpectra()
+    
+  def track(self, service):
+    '''
+      Keep the valid spectrum names current from the spectrum events of
+      a traceservice.TraceService.
+    '''
+    service.spectrum.connect(self._spectrumChanged)
+    service.resync.connect(self._resync)
+    self._tracking = True
     
   #  Private methods
 
@@ -102,10 +128,27 @@ class BindingsController:
     # fetch the names into the valid spectrum names of spectrumset
     
     
-    self._spectrumList.load_spectra(self._client)
-    UpdateValidNames(self._spectrumList.getNames())
+    UpdateValidNames([x['name'] for x in self._client.spectrum_list()['detail']])
+    self._stale = False
+    self._revalidate()
+    
+  def _revalidate(self):
     self._fixBindings()
     self._updateView()
+    self._generation = Generation()
+    
+  def _spectrumChanged(self, operation, name):
+    # Trace service spectrum event - only creation and deletion matter:
+    
+    if operation == 'add':
+      AddValidNames([name])
+    elif operation == 'delete':
+      RemoveValidNames([name])
+  
+  def _resync(self):
+    # Events may have been lost, the next update reloads.
+    
+    self._stale = True
     
   
     
@@ -114,7 +157,7 @@ class BindingsController:
     # a new binding.      
 
     
-    new = promptNewBindingList(self._view, self._spectrumList.getNames())
+    new = promptNewBindingList(self._view, list(ValidNames().keys()))
     if new is not None:
       # new is a bindings dict... add it to our bindings list and 
       # update the view:
@@ -138,24 +181,44 @@ class BindingsController:
       # Load the selected binding group into the server's spectrum memory,
       # first clearing the present bindings:
       
-      self._client.unbind_all()
-      self._addgroup()                   # Append selected bindings to nothing 
+      self._addgroup(replace=True)
       
-  def _addgroup(self):
+  def _addgroup(self, replace=False):
       # If possible adds the selected bindings to those in the server's shared 
-      # spectrum memory:
+      # spectrum memory.  The binding is planned first so that, if not everything
+      # fits, the user can choose to bind the spectra that do in one pass - either
+      # as many as possible or, giving the spectra priority in the order of the
+      # binding list, those that come first:
       
       sel = self._view.selectedBinding()
       if len(sel) == 1:
           sel = sel[0]
+          plan = bindingplanner.plan(self._client, sel['spectra'], replace=replace)
+          if not plan.fits():
+            dlg = QMessageBox(QMessageBox.Warning, 'Not enough display memory',
+              f'Not all spectra in {sel["name"]} fit in the display memory: {plan.summary()}. Bind those that fit?',
+              QMessageBox.Cancel, self._view
+            )
+            most = dlg.addButton('As many as possible', QMessageBox.AcceptRole)
+            ordered = dlg.addButton('In list order', QMessageBox.AcceptRole)
+            dlg.setDetailedText(plan.details())
+            dlg.exec()
+            if dlg.clickedButton() == ordered:
+              plan = bindingplanner.plan(
+                self._client, sel['spectra'], priority=sel['spectra'], replace=replace
+              )
+            elif dlg.clickedButton() != most:
+              return
           try :
-            self._client.sbind_spectra(sel['spectra'])
+            if replace:
+              self._client.unbind_all()
+            if len(plan.bind) > 0:
+              self._client.sbind_spectra(plan.bind)
             self._view.setLoaded(sel['name'], sel['description'])
-          except:
+          except Exception as e:
             QMessageBox.warning(
-              self._view, 
-              '''Unable to bind all of the spectra in the binding list. 
-  Might not be enough shared memory''')
+              self._view, 'Binding failed',
+              f'Unable to bind the spectra in the binding list: {e}')
 
   def _saveoncurrent(self):
     #  Save the currently loaded bindings over the selected bindset. 
@@ -242,16 +305,11 @@ class BindingsController:
     #  For now, removes binding sets that are invalid because
     #  their spectra have been yanked.
     #  TODO:  Instead, maybe(?) remove just the invalid spectra.
+    #  The sets keep their invalid counts current so this is cheap.
     
-    bad_indexes = list()            # list of invalid indices
-    i = 0
-    while i < len(self._bindinglists):
-      if len(self._bindinglists[i].validate()) > 0:
-        bad_indexes.append(i)
-      i += 1
-    bad_indexes.sort(reverse=True)
-    for i in bad_indexes:
-      self._bindiglists.pop(i)
+    self._bindinglists = [
+      x for x in self._bindinglists if x is not None and x.invalid_count() == 0
+    ]
       
       
       
@@ -0,0 +1,170 @@
+'''
+This module applies gates to, and removes gates from, many spectra at once.
+The GUI used to make one apply_gate request per spectrum (and then reload the
+whole spectrum list);  here the work is grouped into as few requests as the
+server allows:
+
+*  SpecTcl's apply command takes a gate and any number of spectra and many
+   commands can be bundled into one execute_tcl script (as spectrumcontents
+   does for channels), so each batch of spectra costs one request.
+*  Rustogramer's apply request takes one spectrum so those requests are
+   dispatched concurrently by a bounded pool of worker threads.
+*  Both servers' ungate requests take a list of spectrum names so ungating
+   is a single request.
+
+If a grouped request fails (e.g. one bad spectrum name stops a Tcl script) the
+spectra in it are retried one at a time so failures are reported per spectrum.
+Results are a BulkResult that tells the caller which spectra changed so only
+those rows of e.g. SpectrumList.SpectrumModel need updating.
+
+Nothing here depends on Qt.
+'''
+
+import concurrent.futures
+
+import capabilities
+import tclbatch
+
+APPLY_WORKERS = 8              # Concurrent requests when they can't be grouped.
+TCL_BATCH = 128                # Spectra per execute_tcl script.
+
+def ungated_gate():
+    '''
+    The gate an ungated spectrum shows in spectrum_list.  SpecTcl applies its
+    -TRUE- gate, Rustogramer shows no gate.
+    '''
+    if capabilities.get_program() == capabilities.Program.SpecTcl:
+        return '-TRUE-'
+    return ''
+
+def group_applications(applications):
+    '''
+    Turn an iterable of applications into a dict of gate -> list of spectra.
+    Applications can be (gate, spectrum) pairs or dicts as from apply_list
+    ('gate', 'spectrum') or DefinitionReader.read_applications ('condition',
+    'spectrum').  If a spectrum appears more than once the last application wins.
+    '''
+    gate_of = dict()
+    for application in applications:
+        if isinstance(application, dict):
+            gate = application.get('condition', application.get('gate'))
+            spectrum = application['spectrum']
+        else:
+            (gate, spectrum) = application
+        gate_of.pop(spectrum, None)           # So order follows the last application.
+        gate_of[spectrum] = gate
+    result = dict()
+    for (spectrum, gate) in gate_of.items():
+        result.setdefault(gate, list()).append(spectrum)
+    return result
+
+class BulkResult:
+    '''
+    Result of apply_gates/ungate.
+    Attributes:
+       gates   - dict of spectrum -> gate now applied for the spectra that succeeded
+                 (ungated_gate() for ungated spectra).
+       failures - dict of spectrum -> error message for the spectra that failed.
+       requests - Number of requests made.
+    '''
+    def __init__(self):
+        self.gates = dict()
+        self.failures = dict()
+        self.requests = 0
+
+    def ok(self):
+        return len(self.failures) == 0
+
+    def summary(self):
+        return f'{len(self.gates)} spectra updated, {len(self.failures)} failed'
+
+    def details(self):
+        return '\n'.join([f'{name}: {message}' for (name, message) in self.failures.items()])
+
+def apply_gates(client, mapping, workers=APPLY_WORKERS):
+    '''
+    Apply gates to spectra.
+    *  client - the REST client.
+    *  mapping - dict of gate -> list of spectra to apply it to (see group_applications).
+    *  workers - Maximum number of concurrent requests.
+    Returns a BulkResult.
+    '''
+    groups = request_groups(mapping)
+    if capabilities.get_program() == capabilities.Program.SpecTcl:
+        return _run(groups, lambda g: _apply_script(client, g), lambda gate, s: client.apply_gate(gate, s), workers)
+    return _run(groups, None, lambda gate, s: client.apply_gate(gate, s), workers)
+
+def request_groups(mapping):
+    '''
+    Split a gate -> spectra mapping into the (gate, spectra) groups apply_gates
+    makes one request for:  batches of up to TCL_BATCH spectra for SpecTcl, single
+    spectra otherwise.
+    '''
+    if capabilities.get_program() == capabilities.Program.SpecTcl:
+        return [
+            (gate, list(spectra[start:start+TCL_BATCH]))
+            for (gate, spectra) in mapping.items() for start in range(0, len(spectra), TCL_BATCH)
+        ]
+    return [(gate, [spectrum]) for (gate, spectra) in mapping.items() for spectrum in spectra]
+
+def ungate(client, spectra, workers=APPLY_WORKERS):
+    '''
+    Remove the gates from spectra (a list of names).  Returns a BulkResult.
+    '''
+    spectra = list(spectra)
+    if len(spectra) == 0:
+        return BulkResult()
+    gate = ungated_gate()
+    return _run(
+        [(gate, spectra)], lambda g: client.ungate_spectrum(g[1]),
+        lambda gate, s: client.ungate_spectrum([s]), workers
+    )
+
+# Private functions:
+
+def _apply_script(client, group):
+    # One SpecTcl apply command for a group of spectra.
+    (gate, spectra) = group
+    client.execute_tcl(tclbatch.apply_command(gate, spectra))
+
+def _run(groups, grouped, single, workers):
+    # Run the groups ((gate, spectra) pairs) concurrently.  grouped(group) does a whole
+    # group in one request (None if only single(gate, spectrum) requests can be made).
+    # A group whose grouped request fails is retried a spectrum at a time.
+
+    result = BulkResult()
+
+    def do_group(group):
+        (gate, spectra) = group
+        if grouped is not None:
+            try:
+                grouped(group)
+                return ([(s, gate, None) for s in spectra], 1)
+            except Exception:
+                if len(spectra) == 1:
+                    raise
+        outcomes = list()
+        for spectrum in spectra:
+            try:
+                single(gate, spectrum)
+                outcomes.append((spectrum, gate, None))
+            except Exception as e:
+                outcomes.append((spectrum, gate, str(e)))
+        return (outcomes, len(spectra) + (0 if grouped is None else 1))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(do_group, group): group for group in groups}
+        for future in concurrent.futures.as_completed(futures):
+            (gate, spectra) = futures[future]
+            try:
+                (outcomes, requests) = future.result()
+            except Exception as e:
+                outcomes = [(s, gate, str(e)) for s in spectra]
+                requests = 1
+            result.requests += requests
+            for (spectrum, applied, failure) in outcomes:
+                if failure is None:
+                    result.gates[spectrum] = applied
+                else:
+                    result.failures[spectrum] = failure
+    return result
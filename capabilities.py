@@ -313,7 +313,7 @@ def has_condition_name(name):
     if name not in ConditionTypeNamesToType.keys():  # supports stupid tests.
         return False
     type = ConditionTypeNamesToType[name]
-    return has_condition_type(tpe)
+    return has_condition_type(type)
 
 def get_supported_condition_types():
     global supported_condition_types
@@ -359,6 +359,10 @@ def can_rest_detach():
     # The /attach/detach rest request exists.
     
     return get_program() == Program.Rustogramer
+
+def has_traces():
+    ''' True if the server supports the trace/establish, fetch, done requests '''
+    return get_program() == Program.SpecTcl
         
 
 # Make capability adjusments for version:
@@ -0,0 +1,200 @@
+'''
+This module provides pre-flight checks for cluster file processing.  Before
+any event file is attached we:
+
+*  Stat all of the event files in parallel (on network filesystems this is
+   much faster than one at a time) recording their sizes.
+*  Extract run and segment numbers from NSCLDAQ style names (run-0023-01.evt).
+*  Check that the histogramer can read each file's format (see
+   capabilities.can_read_raw_events and capabilities.can_read_parfiles).
+*  Flag missing, empty and duplicate (same file listed twice, possibly by a different
+   path) files.
+*  Optionally sort the files (by run/segment, size or name) and remove duplicates.
+
+The Prefetcher class issues readahead hints (posix_fadvise) so that the next
+event file is being pulled from storage while the current one is analyzed.  Hints
+only help if the histogramer reads the files through the same host's page
+cache (e.g. the GUI and histogramer run on the same node).  Where posix_fadvise is
+not available the hints do nothing.
+
+Nothing here depends on Qt.
+'''
+
+import concurrent.futures
+import os
+import re
+
+import capabilities
+
+DEFAULT_WORKERS = 8
+_run_pattern = re.compile(r'run-?(\d+)(?:-(\d+))?', re.IGNORECASE)
+
+def run_number(filename):
+    '''
+    Returns (run, segment) parsed from an NSCLDAQ style event file name
+    (e.g. run-0023-01.evt gives (23, 1)).  Missing numbers are None.
+    '''
+    match = _run_pattern.search(os.path.basename(filename))
+    if match is None:
+        return (None, None)
+    segment = match.group(2)
+    return (int(match.group(1)), int(segment) if segment is not None else None)
+
+def file_format(filename):
+    ''' Returns 'evt' for raw event files, 'par' for parameter files else None '''
+    ext = os.path.splitext(filename)[1].lower()
+    return {'.evt': 'evt', '.par': 'par'}.get(ext)
+
+def format_readable(format):
+    '''
+    True if the histogramer can read files of 'format' (from file_format).
+    Files with unrecognized extensions are given the benefit of the doubt.
+    '''
+    if format == 'evt':
+        return capabilities.can_read_raw_events()
+    if format == 'par':
+        return capabilities.can_read_parfiles()
+    return True
+
+def stat_file(filename):
+    '''
+    Returns a dict describing an event file:
+    *  name - the filename.
+    *  exists - True if it exists and is a regular file.
+    *  size - size in bytes (0 if it does not exist).
+    *  identity - (device, inode) which identifies the file regardless of path.
+    *  run, segment - see run_number.
+    *  format - see file_format.
+    *  error - None or the reason the file can't be used.
+    '''
+    (run, segment) = run_number(filename)
+    info = {
+        'name': filename, 'exists': False, 'size': 0, 'identity': None,
+        'run': run, 'segment': segment, 'format': file_format(filename), 'error': None
+    }
+    try:
+        st = os.stat(filename)
+        if not os.path.isfile(filename):
+            info['error'] = 'not a regular file'
+        else:
+            info['exists'] = True
+            info['size'] = st.st_size
+            info['identity'] = (st.st_dev, st.st_ino)
+    except OSError as e:
+        info['error'] = e.strerror
+    return info
+
+class PreflightReport:
+    '''
+    Result of preflight.
+    Attributes:
+      files - list of stat_file dicts in processing order.
+      duplicates - list of stat_file dicts for files that duplicate an earlier one
+                   (removed from files if dedupe was requested).
+      errors - list of messages about files that can't be processed.
+      warnings - list of messages about files that are suspicious (e.g. empty).
+    '''
+    def __init__(self):
+        self.files = list()
+        self.duplicates = list()
+        self.errors = list()
+        self.warnings = list()
+
+    def ok(self):
+        return len(self.errors) == 0
+
+    def names(self):
+        return [f['name'] for f in self.files]
+
+    def sizes(self):
+        ''' (name, size) pairs e.g. for clustertelemetry.ThroughputEstimator '''
+        return [(f['name'], f['size']) for f in self.files]
+
+    def total_bytes(self):
+        return sum([f['size'] for f in self.files])
+
+    def summary(self):
+        text = f'{len(self.files)} files, {self.total_bytes()/(1024*1024):.1f} MB'
+        if len(self.duplicates) > 0:
+            text += f', {len(self.duplicates)} duplicates'
+        return text
+
+def preflight(event_files, sort=None, dedupe=False, workers=DEFAULT_WORKERS):
+    '''
+    Check a list of event files.
+    *  event_files - list of filenames (e.g. from clusterscheduler.read_cluster_file
+       with check=False).
+    *  sort - None to keep the order, 'run' to sort by run/segment number,
+       'size' for largest first (which usually balances fanned out processing best) or
+       'name'.
+    *  dedupe - If True files that duplicate an earlier file are removed.
+    *  workers - Number of concurrent stats.
+    Returns a PreflightReport.
+    '''
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        infos = list(pool.map(stat_file, event_files))
+
+    report = PreflightReport()
+    seen = dict()                    # identity -> name of first file.
+    for info in infos:
+        name = info['name']
+        if info['error'] is not None:
+            report.errors.append(f'{name}: {info["error"]}')
+        elif not format_readable(info['format']):
+            report.errors.append(f'{name}: the histogramer cannot read {info["format"]} files')
+        elif info['size'] == 0:
+            report.warnings.append(f'{name}: is empty')
+        key = info['identity'] if info['identity'] is not None else os.path.abspath(name)
+        if key in seen:
+            report.warnings.append(f'{name}: duplicates {seen[key]}')
+            report.duplicates.append(info)
+            if dedupe:
+                continue
+        else:
+            seen[key] = name
+        report.files.append(info)
+
+    if sort == 'run':
+        report.files.sort(key=lambda f: (
+            f['run'] is None, f['run'] if f['run'] is not None else 0,
+            f['segment'] if f['segment'] is not None else -1, f['name']
+        ))
+    elif sort == 'size':
+        report.files.sort(key=lambda f: -f['size'])
+    elif sort == 'name':
+        report.files.sort(key=lambda f: f['name'])
+    elif sort is not None:
+        raise ValueError(f'Unknown cluster file sort order: {sort}')
+    return report
+
+class Prefetcher:
+    '''
+    Issues readahead hints for event files.  prefetch(name) asks the kernel to
+    start reading the file into the page cache;  release(name) tells it the
+    file's pages are no longer needed so a long campaign doesn't push
+    everything else out of the cache.  Both quietly do nothing if hints are not
+    supported or fail.
+    '''
+    def __init__(self, enabled=True):
+        self._enabled = enabled and hasattr(os, 'posix_fadvise')
+
+    def enabled(self):
+        return self._enabled
+
+    def prefetch(self, filename):
+        if self._enabled:
+            self._advise(filename, os.POSIX_FADV_WILLNEED)
+
+    def release(self, filename):
+        if self._enabled:
+            self._advise(filename, os.POSIX_FADV_DONTNEED)
+
+    def _advise(self, filename, advice):
+        try:
+            fd = os.open(filename, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, advice)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
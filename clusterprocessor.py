@@ -5,72 +5,124 @@ This is done as follows:
 1. The specified file is sucked in and the existence of all files
 is validated (and assumed to be available to the server).
 2. Each file is set as a data source and data processing starts.
-3. A QTimer is sused to monitor file processing completion.
-and used to start the next file.
+3. A HIGH priority pollscheduler job is used to monitor file processing completion
+and used to start the next file.  It shares the shmem/variables request with any
+other jobs that need it.
+4. Each poll also feeds a clustertelemetry.ThroughputEstimator.  The estimates
+are emitted in the metrics signal and are used to adapt the poll interval so that
+we poll quickly when a file is about to finish and slowly otherwise.
+
+DistributedClusterProcessor does the same for a cluster file shared among several
+histogramers by a clusterscheduler.ClusterScheduler.  Pushing the definitions and
+merging the spectra are done on a worker thread and each histogramer is polled
+(and given its next file) by its own pollscheduler request so the GUI never waits
+on a server.
 
 '''
 
+import concurrent.futures
+import functools
 from os import path
+import time
 
-from PyQt5.QtCore import pyqtSignal, QTimer
+from PyQt5.QtCore import pyqtSignal, QObject
 
+import clusterpreflight
+import clusterscheduler
+import clustertelemetry
+import pollscheduler
+from clusterscheduler import read_cluster_file
 
+MIN_POLL = 100             # Fastest poll interval in ms.
 
-class ClusterProcessor(QTimer):
+class ClusterProcessor(QObject):
     '''
     Cluster file processor.
       Signals:
          done - cluster file processing is done.
          processing - started processing an event file (name is parameterized).
+         metrics - Throughput estimates after each poll (parameter is the dict
+                   from clustertelemetry.ThroughputEstimator.metrics).
+      The poll parameter is the slowest poll interval (ms), min_poll the fastest.
+      cluster_file is the name of a cluster file or a list of event files
+      (e.g. clusterpreflight.PreflightReport.names()).  If prefetch is true,
+      readahead hints for the next file are given while the current one is processed
+      (see clusterpreflight.Prefetcher).  scheduler is the pollscheduler.PollScheduler
+      (default the GUI's).
     '''
     done = pyqtSignal()
     processing = pyqtSignal(str)
-    def __init__(self, cluster_file, poll, client, *args):
+    metrics = pyqtSignal(dict)
+    def __init__(self, cluster_file, poll, client, *args, min_poll=MIN_POLL, prefetch=False,
+                 scheduler=None):
         super().__init__(*args)
     
         self._client = client
+        self._scheduler = scheduler if scheduler is not None else pollscheduler.get_scheduler()
+        self._job = None
         self._poll = poll
+        self._min_poll = min(min_poll, poll)
+        self._file_index = -1
+        self._current_file = None
+        self._prefetcher = clusterpreflight.Prefetcher(prefetch)
         self._state = 'active'   # Becomes done when done.
-        
-        # Connect the timer to the poller:
-        
-        self.timeout.connect(self._poll_active)
     
         # Get the event files from file and test their
         # existence:
         
     
-        self.event_files = []
-        with open(cluster_file, "r") as file:
-            for line in file:
-                # Check existence:
-                line = line.strip()   # has the newline char(s)
-                if not path.isfile(line):
-                    self._state = 'done'
-                    raise SystemError(f'No such event file {line} in cluster file {cluster_file}')
-                
-                #  Add to the list
-                self.event_files.append(line)
+        try:
+            if isinstance(cluster_file, str):
+                self.event_files = read_cluster_file(cluster_file)
+            else:
+                self.event_files = list(cluster_file)
+        except:
+            self._state = 'done'
+            raise
+        self._estimator = clustertelemetry.ThroughputEstimator(
+            [(name, path.getsize(name)) for name in self.event_files]
+        )
+        
+        # Poll with variables fetched after the poll is due so we never see the
+        # state from before a file was started:
+        
+        self._job = self._scheduler.register(
+            'cluster', self._poll_active, self._min_poll/1000, pollscheduler.HIGH,
+            max_staleness=0, requests=('shmem/variables',)
+        )
         if len(self.event_files) > 0:
-            self._current_file = self.event_files.pop(0)
-            self._start_event_file(self._current_file)
+            self._start_event_file(self.event_files.pop(0))
                 
     def abort(self):
         self._state = 'aborting'
+        self._job.run_now()
            
     def _start_event_file(self, name):
         # Start prodessing an event file
         # The client is used to attach the file and
         # start processing.
         # We then start polling for done with the _poll_active metdhod.
+        # The BuffersAnalyzed before the attach is the estimator's baseline.
+        
+        # While it runs, the next file can be read ahead.
         
+        self._file_index += 1
+        self._current_file = name
+        self._estimator.start_file(self._file_index, time.monotonic(), self._buffers_analyzed())
         self._client.attach_source('file', name)
         self._client.start_analysis()
+        if len(self.event_files) > 0:
+            self._prefetcher.prefetch(self.event_files[0])
         self.processing.emit(name)
-        self.start(self._poll)
+        self._job.set_period(self._min_poll/1000)
         
     
-    def _poll_active(self):
+    def _finish(self):
+        self._state = 'done'
+        self._job.cancel()
+        self.done.emit()
+    
+    def _poll_active(self, results):
         #  Periodic poll:
         #   If state = 'aborting' set the state to 'done' emit the done signal.
         #   Otherwise, check the RunState Variable:
@@ -85,19 +137,157 @@ class ClusterProcessor(QTimer):
                 pass   # Might be done with a file.
             self._client.detach_source()
             # Abort was requested.
-            self._state = 'done'
-            self.done.emit()
+            self._finish()
+            return
+        if self._current_file is None:
+            self._finish()                 # Empty cluster file.
             return
         
-        vars = self._client.shmem_getvariables()['detail']
+        vars = results['shmem/variables']['detail']
+        now = time.monotonic()
         if vars['RunState'] == 'Inactive':
             # Finished a file:
+            self._estimator.sample(vars.get('BuffersAnalyzed'), now)
+            self._estimator.finish_file(now)
+            self._prefetcher.release(self._current_file)
+            self.metrics.emit(self._estimator.metrics())
             if len(self.event_files) == 0:
-                self._state = 'done'
-                self.done.emit()
+                self._finish()
             else:
                 # Start the next file:
                 next_file = self.event_files.pop(0)
                 self._start_event_file(next_file)
         else:
-            self.start(self._poll)
\ No newline at end of file
+            self._estimator.sample(vars.get('BuffersAnalyzed'), now)
+            self.metrics.emit(self._estimator.metrics())
+            self._job.set_period(self._estimator.next_poll(self._min_poll, self._poll)/1000)
+    
+    def _buffers_analyzed(self):
+        # Current BuffersAnalyzed or None if we can't get it.
+        try:
+            return self._client.shmem_getvariables()['detail'].get('BuffersAnalyzed')
+        except:
+            return None
+
+
+class DistributedClusterProcessor(QObject):
+    '''
+    Distributed cluster file processor.
+      *  servers - list of (name, client) of the histogramers that share the work
+                   (see clusterscheduler.discover_servers).
+      *  event_files - the event files to process.
+      *  client  - client of our histogramer;  its definitions are pushed to the
+                   servers and it gets the merged spectra.
+      *  poll    - ms between polls of each server.
+      *  prefetch - see clusterscheduler.ClusterScheduler.
+      *  scheduler - the pollscheduler.PollScheduler (default the GUI's).
+      Signals:
+         pushed - definitions were pushed; the parameter is the dict of server name
+                  -> restorepipeline.RestoreReport.  Call process() to go on or
+                  abort() to stop.
+         progress - (stage, done, total) while definitions are pushed or spectra
+                  merged.
+         processing - the event files the servers are processing (server -> file).
+         done - all done, the parameter is an error message ('' on success).
+      push() starts the work.
+    '''
+    pushed = pyqtSignal(dict)
+    progress = pyqtSignal(str, int, int)
+    processing = pyqtSignal(dict)
+    done = pyqtSignal(str)
+    _finished = pyqtSignal(str, object, object)   # stage, result, exception from the worker.
+
+    def __init__(self, servers, event_files, client, poll, *args, prefetch=False, scheduler=None):
+        super().__init__(*args)
+        self._servers = list(servers)
+        self._client = client
+        self._poll = poll
+        self._scheduler = scheduler if scheduler is not None else pollscheduler.get_scheduler()
+        self._cluster = clusterscheduler.ClusterScheduler(self._servers, event_files, prefetch=prefetch)
+        self._worker = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._requests = [f'distributed cluster/{name}' for (name, client) in self._servers]
+        self._job = None
+        self._aborting = False
+        self._finished.connect(self._stage_done)
+
+    def push(self):
+        ''' Push our definitions to the servers (emits pushed when done) '''
+        self._run_stage('push', clusterscheduler.push_definitions, self._client, self._servers,
+            progress=self._reporter('Pushing definitions'))
+
+    def process(self):
+        ''' Start processing the event files once the definitions are pushed '''
+        if self._aborting:
+            self._finish('')
+            return
+        for (request, (name, client)) in zip(self._requests, self._servers):
+            self._scheduler.add_request(request, functools.partial(self._cluster.poll_server, name))
+        self._job = self._scheduler.register(
+            'distributed cluster', self._poll_active, self._poll/1000, pollscheduler.HIGH,
+            max_staleness=0, requests=self._requests, errback=self._poll_failed
+        )
+
+    def abort(self):
+        '''
+        Stop processing.  Analysis in the servers is stopped at the next poll.  A
+        push or merge in progress runs to completion.
+        '''
+        self._aborting = True
+        self._cluster.abort()
+        if self._job is not None:
+            self._job.run_now()
+
+    def completed(self):
+        ''' See clusterscheduler.ClusterScheduler.completed '''
+        return self._cluster.completed()
+
+    # Private methods:
+
+    def _reporter(self, stage):
+        # Progress callback for the worker that relays to the progress signal.
+        return lambda name, done, total: self.progress.emit(stage, done, total)
+
+    def _run_stage(self, stage, function, *args, **kwargs):
+        # Run function on the worker thread;  _stage_done gets the result.
+        def work():
+            try:
+                self._finished.emit(stage, function(*args, **kwargs), None)
+            except Exception as e:
+                self._finished.emit(stage, None, e)
+        self._worker.submit(work)
+
+    def _stage_done(self, stage, result, error):
+        # GUI thread: a push or merge finished.
+        if error is not None:
+            self._finish(f'{stage} failed: {error}')
+        elif stage == 'push':
+            self.pushed.emit(result)
+        else:
+            self._finish('')
+
+    def _poll_active(self, results):
+        # Every server has been polled (on worker threads).  When all files are
+        # processed, merge the spectra into our server:
+        files = {name: results[request] for (request, (name, client)) in zip(self._requests, self._servers)}
+        self.processing.emit({name: file for (name, file) in files.items() if file is not None})
+        if self._cluster.files_remaining() > 0:
+            return
+        self._stop_polling()
+        if self._cluster.aborted():
+            self._finish('')
+        else:
+            self._run_stage('merge', clusterscheduler.merge_spectra, self._servers, self._client,
+                progress=self._reporter('Merging spectra'))
+
+    def _poll_failed(self, exception):
+        self._stop_polling()
+        self._finish(f'poll failed: {exception}')
+
+    def _stop_polling(self):
+        self._job.cancel()
+        for request in self._requests:
+            self._scheduler.remove_request(request)
+
+    def _finish(self, message):
+        self._worker.shutdown(wait=False)
+        self.done.emit(message)
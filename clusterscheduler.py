@@ -0,0 +1,312 @@
+'''
+This module provides cluster file processing fanned out over several
+histogramers (SpecTcl or Rustogramer) rather than the single one
+clusterprocessor.ClusterProcessor uses.
+
+*  read_cluster_file reads and validates the event file list of a cluster file.
+*  discover_servers finds the histogramers advertised in a port manager whose
+   service names begin with a prefix.
+*  push_definitions gives each histogramer the same definitions.  The
+   definitions go through a DefinitionIO definition file and a
+   restorepipeline.RestorePipeline just as File->Load... would.
+*  ClusterScheduler deals the event files out to whichever histogramer is idle.
+   Its poll method does one scheduling step so it can be driven by its own run
+   loop in a non-graphical program.  poll_server does the step for one
+   histogramer and is thread safe so the GUI can poll each histogramer on a
+   worker thread (see clusterprocessor.DistributedClusterProcessor).
+*  merge_spectra fetches each spectrum from all histogramers, sums them with numpy and
+   puts the sum into a target histogramer.  SpecTcl targets get the sums as Tcl
+   scripts of channel -set commands;  Rustogramer has no bulk way to set channels so
+   a Rustogramer target gets one set_chan request per non-zero channel.  Merging
+   large, densely filled 2D spectra into Rustogramer can take longer than
+   processing the files on one histogramer.
+
+Nothing here depends on Qt.
+'''
+
+import concurrent.futures
+import os
+import tempfile
+import threading
+import time
+
+import clusterpreflight
+import DefinitionIO
+import PortManager
+import restorepipeline
+import saveset
+import spectrumcontents
+from rustogramer_client import rustogramer as RestClient
+
+DEFAULT_PMAN_PORT = 30000
+DEFAULT_POLL = 1.0                    # Seconds between polls for run.
+
+def read_cluster_file(cluster_file, check=True):
+    '''
+    Returns the list of event files in a cluster file (one per line).  If check
+    is true and any of the files does not exist, SystemError is raised.  If check is
+    false, blank lines are skipped and the files are not checked (see clusterpreflight
+    which checks them all in parallel).
+    '''
+    event_files = []
+    with open(cluster_file, "r") as file:
+        for line in file:
+            # Check existence:
+            line = line.strip()   # has the newline char(s)
+            if not check:
+                if line != '':
+                    event_files.append(line)
+                continue
+            if not os.path.isfile(line):
+                raise SystemError(f'No such event file {line} in cluster file {cluster_file}')
+            
+            #  Add to the list
+            event_files.append(line)
+    return event_files
+
+def discover_servers(host, beginswith, user=None, pmanport=DEFAULT_PMAN_PORT):
+    '''
+    Find histogramers advertised in the port manager on 'host' with service
+    names that begin with 'beginswith'.  If user is not None, only services
+    advertised by that user are returned.
+    Returns a list of (service name, client) pairs.
+    '''
+    manager = PortManager.PortManager(host, pmanport)
+    criteria = {'beginswith': beginswith}
+    if user is not None:
+        criteria['user'] = user
+    return [
+        (f'{s["service"]}@{host}', RestClient({'host': host, 'port': s['port']}))
+        for s in manager.find(**criteria)
+    ]
+
+def push_definitions(source, servers, workers=restorepipeline.DEFAULT_WORKERS, progress=None):
+    '''
+    Give each server the definitions of 'source'.
+    *  source - client of the histogramer with the definitions.
+    *  servers - list of (name, client) as from discover_servers.  Any that are the
+       same server as 'source' are skipped.
+    *  progress - If not None called as progress(name, done, total) as each server
+       is done.
+    The definitions (including SpecTcl tree variables) are written to a temporary
+    definition file and restored from it into the servers concurrently.  Spectra a
+    server had bound are bound again once they're replaced.
+    Returns a dict of server name -> restorepipeline.RestoreReport.
+    '''
+    snapshot = saveset.snapshot_definitions(source)
+    (fd, filename) = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    try:
+        saveset.write_snapshot(filename, snapshot)
+        reader = DefinitionIO.DefinitionReader(filename)
+        definitions = {
+            'parameters': reader.read_parameter_defs(),
+            'spectra': list(reader.read_spectrum_defs()),
+            'conditions': reader.read_condition_defs(),
+            'applications': reader.read_applications(),
+            'variables': reader.read_variables()
+        }
+        del reader
+    finally:
+        os.remove(filename)
+
+    targets = [(name, client) for (name, client) in servers if not _same_server(client, source)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(targets))) as pool:
+        futures = {
+            pool.submit(_restore_into, client, definitions, workers): name
+            for (name, client) in targets
+        }
+        reports = dict()
+        for future in concurrent.futures.as_completed(futures):
+            reports[futures[future]] = future.result()
+            if progress is not None:
+                progress(futures[future], len(reports), len(futures))
+        return reports
+
+def merge_spectra(servers, target, names=None, workers=spectrumcontents.FETCH_WORKERS, progress=None):
+    '''
+    Sum the contents of spectra over servers and put the sums in 'target'.
+    *  servers - list of (name, client) of the histogramers that have contents.
+       'target' may be one of these.
+    *  target - client of the histogramer that gets the sums.
+    *  names  - Names of the spectra to merge (None for all spectra in target).
+    *  progress - If not None called as progress(name, done, total) after each spectrum.
+    The spectra must have the same definitions in all servers.  Summary spectra are
+    merged over the channel axes spectrumcontents.channel_axes gives them.  Returns the
+    list of names of spectra merged.
+    NOTE: For a Rustogramer target each non-zero channel of a sum is one REST
+    request (see the module comments).
+    '''
+    definitions = target.spectrum_list()['detail']
+    if names is not None:
+        names = set(names)
+        definitions = [d for d in definitions if d['name'] in names]
+    definitions = [spectrumcontents.with_channel_axes(d) for d in definitions]
+    definitions = [d for d in definitions if d['xaxis'] is not None]
+    clients = [client for (name, client) in servers]
+    if not any([_same_server(client, target) for client in clients]):
+        clients.append(target)       # Its contents count too.
+
+    merged = list()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for definition in definitions:
+            name = definition['name']
+            xbins = definition['xaxis']['bins']
+            yaxis = definition['yaxis']
+            ybins = yaxis['bins'] if yaxis is not None else None
+            parts = pool.map(lambda c: spectrumcontents.fetch_contents(c, definition), clients)
+            total = None
+            for part in parts:
+                dense = spectrumcontents.to_dense(part, xbins, ybins)
+                total = dense if total is None else total + dense
+            target.spectrum_clear(_exact_pattern(name))
+            summed = spectrumcontents.from_dense(name, total)
+            twod = spectrumcontents.is_twod(definition)
+            list(pool.map(
+                lambda b: spectrumcontents.put_contents(target, b, twod),
+                spectrumcontents.batches(summed, twod)
+            ))
+            merged.append(name)
+            if progress is not None:
+                progress(name, len(merged), len(definitions))
+    return merged
+
+
+class ClusterScheduler:
+    '''
+    Deals the event files of a cluster file out to several histogramers.  Each
+    histogramer processes one file at a time; as soon as it's idle it gets the next
+    file.
+      *  servers - list of (name, client) pairs (see discover_servers).
+      *  cluster_file - The cluster file (one event file per line) or a list of
+                    event files (e.g. clusterpreflight.PreflightReport.names()).
+      *  progress - If not None, called as progress(server, event_file) when a
+                    server starts processing a file (from the thread that polled it).
+      *  prefetch - If true, readahead hints are given for the next files
+                    to be processed (see clusterpreflight.Prefetcher).
+    '''
+    def __init__(self, servers, cluster_file, progress=None, prefetch=False):
+        self._servers = list(servers)
+        self._clients = dict(self._servers)
+        self._lock = threading.Lock()        # poll_server may run in several threads.
+        if isinstance(cluster_file, str):
+            self._pending = read_cluster_file(cluster_file)
+        else:
+            self._pending = list(cluster_file)
+        self._prefetcher = clusterpreflight.Prefetcher(prefetch)
+        self._total = len(self._pending)
+        self._progress = progress
+        self._busy = dict()              # server name -> event file it's processing.
+        self._done = list()              # (server name, event file, seconds).
+        self._started = dict()           # server name -> start time of its file.
+        self._aborting = False
+
+    def files_remaining(self):
+        with self._lock:
+            return len(self._pending) + len(self._busy)
+
+    def completed(self):
+        ''' List of (server, event file, seconds) for the files processed so far '''
+        with self._lock:
+            return list(self._done)
+
+    def abort(self):
+        ''' No more files are started and running analyses are stopped at the next poll '''
+        self._aborting = True
+
+    def aborted(self):
+        return self._aborting
+
+    def poll(self):
+        '''
+        Do one scheduling step: note servers that finished their files and give
+        idle servers new files.  Returns True if there is still work to do (call poll
+        again later), False when all files are processed (or after an abort).
+        '''
+        for (name, client) in self._servers:
+            self.poll_server(name)
+        return self.files_remaining() > 0
+
+    def poll_server(self, name):
+        '''
+        Do the scheduling step for one server:  if it finished its file, note that and
+        if it's idle give it the next file.  After an abort, the server's analysis is
+        stopped.  Different servers can be polled concurrently but each server must
+        only be polled by one thread at a time.  Returns the event file the server is
+        processing (None if it is idle).
+        '''
+        client = self._clients[name]
+        if self._aborting:
+            with self._lock:
+                self._pending = list()
+                stopping = self._busy.pop(name, None)
+            if stopping is not None:
+                try:
+                    client.stop_analysis()
+                    client.detach_source()
+                except:
+                    pass
+            return None
+
+        if name in self._busy:
+            state = client.shmem_getvariables()['detail']['RunState']
+            if state != 'Inactive':
+                return self._busy[name]
+
+        # Swap the finished file for the next one in one step so files_remaining
+        # is right while other servers are being polled:
+
+        with self._lock:
+            finished = self._busy.pop(name, None)
+            if finished is not None:
+                self._done.append((name, finished, time.monotonic() - self._started[name]))
+            event_file = None
+            if len(self._pending) > 0:
+                event_file = self._pending.pop(0)
+                self._busy[name] = event_file
+                self._started[name] = time.monotonic()
+            upcoming = self._pending[:len(self._servers)]
+        if finished is not None:
+            self._prefetcher.release(finished)
+        if event_file is not None:
+            client.attach_source('file', event_file)
+            client.start_analysis()
+            if self._progress is not None:
+                self._progress(name, event_file)
+        
+        # Read ahead the files the next servers to go idle will get:
+        
+        for upcoming_file in upcoming:
+            self._prefetcher.prefetch(upcoming_file)
+        return event_file
+
+    def run(self, interval=DEFAULT_POLL):
+        ''' Poll every 'interval' seconds until all files are processed '''
+        while self.poll():
+            time.sleep(interval)
+
+# Private functions:
+
+def _exact_pattern(name):
+    # A glob pattern that only matches name: each glob character is put in
+    # brackets, which both SpecTcl's string match and Rustogramer's globs accept.
+    return ''.join(['[' + c + ']' if c in '*?[\\' else c for c in name])
+
+def _same_server(a, b):
+    return a.host == b.host and a.port == b.port
+
+def _restore_into(client, definitions, workers):
+    # Restore definitions read from a definition file into a client.
+    pipeline = restorepipeline.RestorePipeline(client, workers)
+    bound = set([b['name'] for b in client.sbind_list()['detail']])
+    pipeline.add_parameters(
+        definitions['parameters'], [p['name'] for p in client.parameter_list()['detail']]
+    )
+    created = pipeline.add_spectra(
+        definitions['spectra'], [s['name'] for s in client.spectrum_list()['detail']], True
+    )
+    pipeline.add_conditions(definitions['conditions'])
+    pipeline.add_applications(definitions['applications'])
+    pipeline.add_variables(definitions['variables'])     # Empty unless the source is SpecTcl.
+    pipeline.add_bindings([x for x in created if x in bound])
+    return pipeline.run()
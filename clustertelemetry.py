@@ -0,0 +1,224 @@
+'''
+This module provides throughput estimation for cluster file processing
+(see clusterprocessor).  It is kept separate from the processor (and free of Qt)
+so that the estimates can be used and tested on their own.
+
+The histogramer tells us little about the progress through a file.  SpecTcl
+maintains a BuffersAnalyzed counter in its shared memory variables; Rustogramer
+does not (the value is then not a number).  From that and the file sizes we estimate:
+
+*  The number of bytes in each buffer.  Initially this is the block size used
+   to attach the file.  Each time a file completes, the estimate is refined from
+   the file size and the number of buffers it took.
+*  Per file throughput: buffers/sec and bytes/sec, smoothed with an exponential
+   moving average.
+*  The fraction of the current file processed and its expected time to completion.
+*  The overall expected time to completion of the cluster, weighting the remaining files
+   by their sizes.
+
+If BuffersAnalyzed is not available, the byte rate measured over completed files
+is used instead and progress within a file is estimated from the elapsed time.
+The initial bytes per buffer may be far too big (e.g. if the counter counts ring
+items rather than blocks);  if the buffers counted say a file is done before it
+is, the buffer based estimates for that file are treated as unknown and the
+elapsed time estimate is used instead.  Estimates that run past the end of the
+file are unknown rather than 100%.
+
+The estimator also suggests the next poll interval: fast when a file is expected to
+complete soon, slow otherwise.
+'''
+
+DEFAULT_BUFFER_SIZE = 8192      # rustogramer_client.attach_source default size.
+SMOOTHING = 0.3                 # Weight of the newest rate sample.
+
+class ThroughputEstimator:
+    '''
+    Estimates cluster processing throughput.
+      *  files - list of (filename, size in bytes) in processing order.
+      *  buffer_size - initial bytes per buffer estimate.
+    Call start_file when each file starts processing, sample at each poll
+    with the BuffersAnalyzed value and time and finish_file when a file is done.
+    Times are in seconds (e.g. time.monotonic()).
+    '''
+    def __init__(self, files, buffer_size=DEFAULT_BUFFER_SIZE):
+        self._files = list(files)
+        self._buffer_size = float(buffer_size)
+        self._index = -1                 # Index of the current file.
+        self._file_start = None
+        self._base_buffers = None        # BuffersAnalyzed when the file started.
+        self._buffers = 0                # Buffers analyzed in this file.
+        self._last = None                # (time, buffers) of the previous sample.
+        self._buffer_rate = None         # Smoothed buffers/sec.
+        self._saturated = False          # Buffers counted overran the file size estimate.
+        self._done_bytes = 0             # Bytes in completed files.
+        self._done_seconds = 0.0         # Time spent on completed files.
+        self._now = None
+
+    def start_file(self, index, now, buffers_analyzed=None):
+        '''
+        File number 'index' started processing at time 'now'.  'buffers_analyzed'
+        is the value of BuffersAnalyzed just before the file was attached (if known).
+        '''
+        self._index = index
+        self._file_start = now
+        self._base_buffers = _number(buffers_analyzed)
+        self._buffers = 0
+        self._last = (now, 0)
+        self._saturated = False
+        self._now = now
+
+    def sample(self, buffers_analyzed, now):
+        '''
+        Record a poll of the histogramer.  'buffers_analyzed' is the BuffersAnalyzed
+        shared memory variable, anything that is not a number is treated as unavailable.
+        '''
+        self._now = now
+        buffers = _number(buffers_analyzed)
+        if buffers is None:
+            return
+        if self._base_buffers is None:
+            self._base_buffers = buffers      # No baseline, progress counts from here.
+        elif buffers < self._base_buffers:
+            self._base_buffers = 0            # Counter was reset by the attach.
+        self._buffers = buffers - self._base_buffers
+        size = self._current_size()
+        if size > 0 and self._buffers*self._buffer_size >= size:
+            self._saturated = True            # The buffer size estimate is too big.
+        (then, previous) = self._last
+        if now > then:
+            rate = (self._buffers - previous)/(now - then)
+            if self._buffer_rate is None:
+                self._buffer_rate = rate
+            else:
+                self._buffer_rate = SMOOTHING*rate + (1.0 - SMOOTHING)*self._buffer_rate
+        self._last = (now, self._buffers)
+
+    def finish_file(self, now):
+        ''' The current file completed at time 'now' '''
+        self._now = now
+        size = self._current_size()
+        if self._buffers > 0 and size > 0:
+            self._buffer_size = size/self._buffers
+        self._done_bytes += size
+        if self._file_start is not None:
+            self._done_seconds += now - self._file_start
+        self._file_start = None
+
+    def byte_rate(self):
+        ''' Current estimate of bytes/sec or None if we have no estimate yet '''
+        if not self._saturated and self._buffer_rate is not None and self._buffer_rate > 0:
+            return self._buffer_rate * self._buffer_size
+        if self._done_seconds > 0 and self._done_bytes > 0:
+            return self._done_bytes/self._done_seconds
+        return None
+
+    def file_fraction(self):
+        '''
+        Estimated fraction of the current file processed [0,1) or None if
+        unknown (including when the estimate says the file should be done but it isn't).
+        '''
+        size = self._current_size()
+        if size <= 0:
+            return None
+        if self._buffers > 0 and not self._saturated:
+            return self._buffers*self._buffer_size/size
+        rate = self.byte_rate()
+        if rate is None or self._file_start is None:
+            return None
+        fraction = (self._now - self._file_start)*rate/size
+        return fraction if fraction < 1.0 else None
+
+    def file_eta(self):
+        ''' Estimated seconds until the current file is done or None '''
+        fraction = self.file_fraction()
+        rate = self.byte_rate()
+        if fraction is None or rate is None:
+            return None
+        return (1.0 - fraction)*self._current_size()/rate
+
+    def remaining_bytes(self):
+        ''' Estimated bytes left to process in the whole cluster '''
+        remaining = sum([size for (name, size) in self._files[self._index+1:]])
+        fraction = self.file_fraction()
+        if fraction is None:
+            fraction = 0.0
+        return remaining + (1.0 - fraction)*self._current_size()
+
+    def overall_eta(self):
+        ''' Estimated seconds until the whole cluster is done or None '''
+        rate = self.byte_rate()
+        if rate is None:
+            return None
+        return self.remaining_bytes()/rate
+
+    def next_poll(self, minimum, maximum):
+        '''
+        Suggest the next poll interval (same units as minimum/maximum which are
+        assumed to be milliseconds):  If the current file is expected to be
+        done within the maximum interval we poll at about half the expected
+        time but never faster than minimum.
+        '''
+        eta = self.file_eta()
+        if eta is None:
+            return maximum
+        eta_ms = eta * 1000.0
+        if eta_ms >= maximum:
+            return maximum
+        return int(max(minimum, eta_ms/2))
+
+    def metrics(self):
+        '''
+        Returns a dict of the current estimates:
+        *  file - Name of the current file (None if none).
+        *  index - Index of the current file.
+        *  files - Number of files in the cluster.
+        *  buffers - Buffers analyzed in the current file.
+        *  buffer_rate - buffers/second (None if unknown).
+        *  byte_rate - bytes/second (None if unknown).
+        *  fraction - fraction of the current file done (None if unknown).
+        *  file_eta - seconds to finish the current file (None if unknown).
+        *  eta - seconds to finish the cluster (None if unknown).
+        *  total_bytes - Size of the cluster.
+        *  done_bytes  - Estimated bytes processed so far.
+        '''
+        total = sum([size for (name, size) in self._files])
+        return {
+            'file': self._files[self._index][0] if 0 <= self._index < len(self._files) else None,
+            'index': self._index,
+            'files': len(self._files),
+            'buffers': self._buffers,
+            'buffer_rate': self._buffer_rate,
+            'byte_rate': self.byte_rate(),
+            'fraction': self.file_fraction(),
+            'file_eta': self.file_eta(),
+            'eta': self.overall_eta(),
+            'total_bytes': total,
+            'done_bytes': total - self.remaining_bytes()
+        }
+
+    # Private methods:
+
+    def _current_size(self):
+        if 0 <= self._index < len(self._files):
+            return self._files[self._index][1]
+        return 0
+
+def format_metrics(metrics):
+    ''' Format a metrics dict as a one line progress string e.g. for a status bar '''
+    text = f'Cluster file {metrics["index"]+1}/{metrics["files"]}: {metrics["file"]}'
+    if metrics['fraction'] is not None:
+        text += f' {metrics["fraction"]*100:.0f}%'
+    if metrics['byte_rate'] is not None:
+        text += f' {metrics["byte_rate"]/(1024*1024):.1f} MB/s'
+    if metrics['eta'] is not None:
+        (minutes, seconds) = divmod(int(metrics['eta']), 60)
+        (hours, minutes) = divmod(minutes, 60)
+        text += f' ETA {hours}:{minutes:02d}:{seconds:02d}'
+    return text
+
+def _number(value):
+    # Return value as a float or None if it's not a number.
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
@@ -18,6 +18,8 @@ from capabilities import (
 from rustogramer_client import rustogramer as rc, RustogramerException 
 from spectrumeditor import error
 from gatelist import common_condition_model
+import gatepreview
+import spectrumcontents
 
 ''' This module provides a tabbed widget that is the gate editing part of
     the Gate tab.  As with the spectrum editor, each supported gate type.
@@ -45,12 +47,21 @@ class GateController:          # Base class
        Concrete subclasses must implement
        create(name) - to create the actual gate...all error handling and signalling is done by us.
        
+       If the view has preview and changed signals (and previewSpectrum/setPreviewResult
+       attributes) the condition can be previewed on a spectrum (see gatepreview).  The
+       spectrum's contents are fetched when preview is signalled and re-used for each change
+       so tuning a condition needs no server round trips.  Subclasses that support this
+       implement preview_condition() to return the condition as condition_list would.
     '''
     def __init__(self, view, client, editor):
         self._view = view
         self._client = client
         self._editor = editor
         self._view.commit.connect(self._create)            
+        self._preview = None             # (definition, contents) previewed on.
+        if hasattr(self._view, 'preview'):
+            self._view.preview.connect(self._fetch_preview)
+            self._view.changed.connect(self._update_preview)
     
     def _create(self):
         
@@ -74,6 +85,45 @@ class GateController:          # Base class
     def create(self, name):
         pass                                 # Derived classes must override.
     
+    def preview_condition(self):
+        return None                          # Derived classes that preview override.
+    
+    def _fetch_preview(self):
+        # Fetch the contents of the spectrum to preview on and preview.
+        
+        name = self._view.previewSpectrum()
+        self._preview = None
+        definitions = [d for d in self._client.spectrum_list(name)['detail'] if d['name'] == name]
+        if len(definitions) == 0:
+            self._view.setPreviewResult(f'No spectrum named {name}')
+            return
+        try:
+            contents = spectrumcontents.fetch_contents(self._client, definitions[0])
+        except RustogramerException as e:
+            self._view.setPreviewResult(f'Unable to get the contents of {name}: {e}')
+            return
+        self._preview = (definitions[0], contents)
+        self._update_preview()
+    
+    def _update_preview(self):
+        # Re-evaluate the condition on the already fetched contents.
+        
+        if self._preview is None or self._view.previewSpectrum() != self._preview[0]['name']:
+            return
+        try:
+            condition = self.preview_condition()
+            if condition is None:
+                self._view.setPreviewResult('')
+                return
+            result = gatepreview.preview(condition, *self._preview)
+        except (ValueError, IndexError) as e:
+            self._view.setPreviewResult(f'{e}')
+            return
+        percent = 100.0*result['counts']/result['total'] if result['total'] > 0 else 0.0
+        self._view.setPreviewResult(
+            f"{result['counts']:g} of {result['total']:g} counts ({percent:.1f}%) in {result['channels']} channels"
+        )
+    
 class VectorSliceGateController(GateController):
     '''
        Controller for both types of vector slice gates
@@ -181,6 +231,13 @@ class SliceGateController(GateController):
         self._client.condition_make_slice(
             name, self._view.parameter(), self._view.low(), self._view.high()
         )
+    def preview_condition(self):
+        if self._view.low() is None or self._view.high() is None:
+            return None
+        return {
+            'type': 's', 'parameters': [self._view.parameter()],
+            'low': self._view.low(), 'high': self._view.high()
+        }
         
     
 
@@ -192,6 +249,11 @@ class ContourController(GateController):
         self._client.condition_make_contour(
             name, self._view.xparam(), self._view.yparam(), self._view.points()
         )
+    def preview_condition(self):
+        return {
+            'type': 'c', 'parameters': [self._view.xparam(), self._view.yparam()],
+            'points': self._view.points()
+        }
         
     
 
@@ -203,6 +265,11 @@ class BandController(GateController):
         self._client.condition_make_band(
             name, self._view.xparam(), self._view.yparam(), self._view.points()
         )
+    def preview_condition(self):
+        return {
+            'type': 'b', 'parameters': [self._view.xparam(), self._view.yparam()],
+            'points': self._view.points()
+        }
         
     
 
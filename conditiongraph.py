@@ -0,0 +1,273 @@
+'''
+This module provides an index of the dependencies between conditions and of
+the spectra gated by them.  Compound conditions (*, +, -) depend on the
+conditions in their 'gates' list;  a spectrum depends on the condition applied
+to it (apply_list).
+
+ConditionGraph is built from condition_list/apply_list results and maintained
+incrementally (set_condition, remove_condition, set_application ...) e.g. from
+traceservice changes.  It answers:
+
+*  dependencies(name) / dependents(name) - the direct edges.
+*  all_dependents(name) - every condition that depends on name directly or
+   through other compound conditions.
+*  affected_spectra(name) - every spectrum whose gate is name or one of its
+   dependents.
+*  cycle() - a dependency cycle if there is one.
+*  order() - the conditions in dependency order (each after those it depends on).
+
+The transitive sets are computed on first use and cached until the graph
+changes so repeated queries (e.g. for every row of a gate table) are dictionary
+lookups.  Nothing here depends on Qt.
+
+common_condition_graph is the graph the GUI shares (like gatelist.common_condition_model).
+
+Note that deleting a condition in SpecTcl turns it into a False condition;
+compound conditions that depend on it keep their dependency.  remove_condition
+therefore only removes the condition's own dependencies - edges into it remain.
+'''
+
+class ConditionGraph:
+    '''
+    Condition dependency index.
+      *  conditions - initial condition definitions (condition_list()['detail']).
+      *  applications - initial gate applications (apply_list()['detail']).
+      *  key - key of the dependency names in a definition: 'gates' for
+               definitions from the server, 'dependencies' for definitions from
+               DefinitionIO.DefinitionReader.
+    '''
+    def __init__(self, conditions=(), applications=(), key='gates'):
+        self._key = key
+        self._dependencies = dict()       # name -> tuple of names it depends on.
+        self._dependents = dict()         # name -> set of names depending on it.
+        self._gate_of = dict()            # spectrum -> applied condition.
+        self._gated = dict()              # condition -> set of spectra it gates.
+        self._closure = dict()            # name -> frozenset of all dependents (cache).
+        self._spectra = dict()            # name -> frozenset of affected spectra (cache).
+        for condition in conditions:
+            self.set_condition(condition)
+        for application in applications:
+            self.set_application(application['spectrum'], application.get('gate'))
+
+    def load(self, client):
+        ''' Rebuild from the server's condition_list and apply_list '''
+        conditions = client.condition_list()['detail']
+        applications = client.apply_list()['detail']
+        self.clear()
+        for condition in conditions:
+            self.set_condition(condition)
+        for application in applications:
+            self.set_application(application['spectrum'], application.get('gate'))
+
+    def clear(self):
+        self._dependencies = dict()
+        self._dependents = dict()
+        self._gate_of = dict()
+        self._gated = dict()
+        self._invalidate()
+
+    # Incremental maintenance:
+
+    def set_condition(self, definition):
+        ''' Add or replace a condition given its definition '''
+        name = definition['name']
+        dependencies = tuple(definition.get(self._key) or ())
+        if self._dependencies.get(name) == dependencies:
+            return
+        self._unlink(name)
+        self._dependencies[name] = dependencies
+        for dependency in dependencies:
+            self._dependents.setdefault(dependency, set()).add(name)
+        self._invalidate()
+
+    def remove_condition(self, name):
+        ''' A condition was deleted - forget what it depends on (see module comments) '''
+        if name in self._dependencies:
+            self._unlink(name)
+            del self._dependencies[name]
+            self._invalidate()
+
+    def set_application(self, spectrum, condition):
+        ''' Condition 'condition' is applied to 'spectrum' (None if ungated) '''
+        previous = self._gate_of.pop(spectrum, None)
+        if previous is not None:
+            self._gated[previous].discard(spectrum)
+        if condition is not None and condition != '':
+            self._gate_of[spectrum] = condition
+            self._gated.setdefault(condition, set()).add(spectrum)
+        self._spectra = dict()
+
+    def remove_spectrum(self, spectrum):
+        self.set_application(spectrum, None)
+
+    # Queries:
+
+    def names(self):
+        return list(self._dependencies.keys())
+
+    def __contains__(self, name):
+        return name in self._dependencies
+
+    def dependencies(self, name):
+        return list(self._dependencies.get(name, ()))
+
+    def dependents(self, name):
+        return sorted(self._dependents.get(name, ()))
+
+    def gate(self, spectrum):
+        ''' The condition applied to a spectrum or None '''
+        return self._gate_of.get(spectrum)
+
+    def gated_spectra(self, name):
+        ''' Spectra the condition is directly applied to '''
+        return sorted(self._gated.get(name, ()))
+
+    def all_dependents(self, name):
+        ''' frozenset of every condition that depends on 'name' directly or indirectly '''
+        result = self._closure.get(name)
+        if result is None:
+            found = set()
+            pending = list(self._dependents.get(name, ()))
+            while len(pending) > 0:
+                dependent = pending.pop()
+                if dependent in found:
+                    continue
+                found.add(dependent)
+                cached = self._closure.get(dependent)
+                if cached is not None:
+                    found |= cached
+                else:
+                    pending.extend(self._dependents.get(dependent, ()))
+            found.discard(name)                      # Only if there's a cycle.
+            result = frozenset(found)
+            self._closure[name] = result
+        return result
+
+    def affected_spectra(self, name):
+        ''' frozenset of the spectra gated by 'name' or any of its dependents '''
+        result = self._spectra.get(name)
+        if result is None:
+            spectra = set(self._gated.get(name, ()))
+            for dependent in self.all_dependents(name):
+                spectra |= self._gated.get(dependent, set())
+            result = frozenset(spectra)
+            self._spectra[name] = result
+        return result
+
+    def cycle(self):
+        ''' A list of names that form a dependency cycle or None if there are none '''
+        state = dict()                        # name -> 1 on the path, 2 done.
+        for start in self._dependencies.keys():
+            if start in state:
+                continue
+            path = [start]
+            iterators = [iter(self._dependencies[start])]
+            state[start] = 1
+            while len(path) > 0:
+                dependency = next(iterators[-1], None)
+                if dependency is None:
+                    state[path.pop()] = 2
+                    iterators.pop()
+                elif state.get(dependency) == 1:
+                    return path[path.index(dependency):] + [dependency]
+                elif dependency not in state and dependency in self._dependencies:
+                    state[dependency] = 1
+                    path.append(dependency)
+                    iterators.append(iter(self._dependencies[dependency]))
+        return None
+
+    def order(self, names=None):
+        '''
+        The conditions (all or those in 'names') ordered so that each comes after
+        the conditions it depends on.  Dependencies outside the names are assumed
+        to exist already.  ValueError is raised if there's a cycle.
+        '''
+        names = list(self._dependencies.keys()) if names is None else list(names)
+        selected = set(names)
+        waiting = {
+            name: len([d for d in set(self._dependencies.get(name, ())) if d in selected])
+            for name in names
+        }
+        ready = [name for name in names if waiting[name] == 0]
+        result = list()
+        while len(ready) > 0:
+            name = ready.pop(0)
+            result.append(name)
+            for dependent in self._dependents.get(name, ()):
+                if dependent in waiting:
+                    waiting[dependent] -= 1
+                    if waiting[dependent] == 0:
+                        ready.append(dependent)
+        if len(result) < len(names):
+            cycle = self.cycle()
+            raise ValueError(
+                f'Conditions depend on themselves: {" -> ".join(cycle) if cycle else ", ".join(names)}'
+            )
+        return result
+
+    # Private methods:
+
+    def _unlink(self, name):
+        for dependency in self._dependencies.get(name, ()):
+            dependents = self._dependents.get(dependency)
+            if dependents is not None:
+                dependents.discard(name)
+
+    def _invalidate(self):
+        self._closure = dict()
+        self._spectra = dict()
+
+common_condition_graph = ConditionGraph()
+
+#----------------------------------------------------------------------
+#  Unit tests.
+#---------------------------------------------------------------------
+
+import unittest
+class TestConditionGraph(unittest.TestCase):
+    def setUp(self):
+        self.graph = ConditionGraph([
+            {'name': 'a', 'type': 's'},
+            {'name': 'b', 'type': 'c'},
+            {'name': 'ab', 'type': '*', 'gates': ['a', 'b']},
+            {'name': 'notab', 'type': '-', 'gates': ['ab']},
+            {'name': 'other', 'type': '+', 'gates': ['b']}
+        ], [
+            {'spectrum': 's1', 'gate': 'a'},
+            {'spectrum': 's2', 'gate': 'notab'},
+            {'spectrum': 's3', 'gate': None}
+        ])
+
+    def test_dependents(self):
+        self.assertEqual(['ab'], self.graph.dependents('a'))
+        self.assertEqual(frozenset(['ab', 'notab']), self.graph.all_dependents('a'))
+        self.assertEqual(frozenset(['ab', 'notab', 'other']), self.graph.all_dependents('b'))
+
+    def test_spectra(self):
+        self.assertEqual(frozenset(['s1', 's2']), self.graph.affected_spectra('a'))
+        self.assertEqual(frozenset(['s2']), self.graph.affected_spectra('b'))
+        self.graph.set_application('s3', 'other')
+        self.assertEqual(frozenset(['s2', 's3']), self.graph.affected_spectra('b'))
+
+    def test_incremental(self):
+        self.graph.set_condition({'name': 'ab', 'type': '+', 'gates': ['a']})
+        self.assertEqual(frozenset(['other']), self.graph.all_dependents('b'))
+        self.graph.remove_condition('notab')
+        self.assertEqual(frozenset(['ab']), self.graph.all_dependents('a'))
+
+    def test_order(self):
+        order = self.graph.order()
+        for name in self.graph.names():
+            for dependency in self.graph.dependencies(name):
+                self.assertLess(order.index(dependency), order.index(name))
+        self.assertEqual(['notab'], self.graph.order(['notab']))
+
+    def test_cycle(self):
+        self.assertIsNone(self.graph.cycle())
+        self.graph.set_condition({'name': 'a', 'type': '*', 'gates': ['notab']})
+        self.assertEqual(['a', 'notab', 'ab', 'a'], self.graph.cycle())
+        with self.assertRaises(ValueError):
+            self.graph.order()
+
+if __name__ == '__main__':
+    unittest.main()
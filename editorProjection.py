@@ -16,7 +16,8 @@
     | |  2d spectrum list |  +--------------------+ |
     | +-------------------+  |  contour list      | |
     |   [direction]          +--------------------| |
-    |                [  Create/replace ]            |
+    |  [ ] limit other axis  low [    ] high [    ] |
+    |      [  Create/replace ]  [ Show locally ]    |
     +-----------------------------------------------+
 
     Note:  The contour list is only usable if in contour is checked otherwise,
@@ -27,6 +28,9 @@
                Normally, the controller will load the contour list with the
                visible contours on that spectrum in response to this signal.
        *    commit - Create/replace was clicked.
+       *    showLocal - Show locally was clicked;  the projection should be
+               computed from the spectrum contents and shown without making a
+               spectrum in the server (see projection).
     Attributes:
         * name - spectrum name.
         * spectrum - selected spectrum
@@ -34,6 +38,7 @@
         * contour  - contour checkbutton state
         * contour_name - name of contour (valid only if contour() is True)  
         * direction - Projection direction
+        * limits - (low, high) of the axis projected away or None if not limited.
     Public methods:
         * setSpectra - provide the list of spectra for the spectrum combobox.
         * setContours - Provide a list of contours for the spectrum combobox.
@@ -46,6 +51,7 @@ from PyQt5.QtWidgets import (
     QApplication, QMainWindow
 )
 from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtGui import QDoubleValidator
 from PyQt5.Qt import *
 
 from direction import DirectionChooser
@@ -53,6 +59,7 @@ from direction import DirectionChooser
 class ProjectionEditor(QLabel):
     commit         = pyqtSignal()
     spectrumChosen = pyqtSignal(str)
+    showLocal      = pyqtSignal()
     def __init__(self, *args):
         super().__init__(*args)
 
@@ -99,6 +106,22 @@ class ProjectionEditor(QLabel):
         row2.addLayout(c_layout)
         
         layout.addLayout(row2)
+        
+        # Limits on the other axis:
+        
+        row3 = QHBoxLayout()
+        self._limit = QCheckBox('Limit other axis', self)
+        row3.addWidget(self._limit)
+        row3.addWidget(QLabel('low', self))
+        self._low = QLineEdit('0.0', self)
+        self._low.setValidator(QDoubleValidator())
+        row3.addWidget(self._low)
+        row3.addWidget(QLabel('high', self))
+        self._high = QLineEdit('0.0', self)
+        self._high.setValidator(QDoubleValidator())
+        row3.addWidget(self._high)
+        row3.addStretch(1)
+        layout.addLayout(row3)
 
         # Create replace button:
 
@@ -106,6 +129,8 @@ class ProjectionEditor(QLabel):
 
         self._commit = QPushButton('Create/Replace')
         commit.addWidget(self._commit)
+        self._show = QPushButton('Show locally')
+        commit.addWidget(self._show)
         commit.addStretch(1)
         
         layout.addLayout(commit)
@@ -121,6 +146,7 @@ class ProjectionEditor(QLabel):
         # Export commit -> commit
 
         self._commit.clicked.connect(self.commit)
+        self._show.clicked.connect(self.showLocal)
 
     #   Implement attribute getters/setters.
 
@@ -168,6 +194,21 @@ class ProjectionEditor(QLabel):
         return self._direction.selection()
     def setDirection(self, direction):
         self._direction.setSelection(direction)
+    
+    def limits(self):
+        if self._limit.checkState() != Qt.Checked:
+            return None
+        try:
+            return (float(self._low.text()), float(self._high.text()))
+        except ValueError:
+            return None
+    def setLimits(self, limits):
+        if limits is None:
+            self._limit.setCheckState(Qt.Unchecked)
+        else:
+            self._limit.setCheckState(Qt.Checked)
+            self._low.setText(f'{limits[0]}')
+            self._high.setText(f'{limits[1]}')
     #   Implement public methods.
 
     def setSpectra(self, spectrum_names):
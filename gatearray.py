@@ -0,0 +1,170 @@
+'''
+This module generates arrays of conditions for detector arrays.  Parameters of
+an array are named like det.00 ... det.127 (see spectrumeditor.gen_param_array
+which makes arrays of spectra from the same naming);  a gate array is a
+template expanded once per element of the array:
+
+*  name pattern      - e.g. 'strip.*'  - the '*' is replaced by the element
+                       (00 ... 127) to give each condition's name.
+*  parameter patterns - e.g. ['det.*'] for slices or ['det.*', 'time.*'] for
+                       contours and bands.  The elements are the suffixes
+                       of the existing parameters matching the first pattern
+                       for which all patterns name existing parameters.
+*  limits or points  - the same for every element or, from a table (see
+                       read_table), per element.
+
+Optionally the conditions can be OR-ed and/or AND-ed into aggregate conditions
+(e.g. 'any strip').
+
+Definitions are made in the form DefinitionIO.DefinitionReader.read_condition_defs
+gives so they are created by restorepipeline (create) - concurrently with a per
+condition failure report.
+
+Nothing here depends on Qt.
+'''
+import re
+
+import restorepipeline
+
+SLICE_TYPES = ('s',)
+TWOD_TYPES = ('c', 'b')
+SUPPORTED_TYPES = SLICE_TYPES + TWOD_TYPES
+
+def natural_key(name):
+    ''' Sort key so that e.g. det.2 sorts before det.10 '''
+    return [int(x) if x.isdigit() else x for x in re.split(r'(\d+)', name)]
+
+def elements(pattern, parameter_names):
+    '''
+    The elements of the array described by 'pattern' (a parameter name with one '*')
+    among parameter_names; that is the strings the '*' matches, in natural order.
+    '''
+    _check_pattern(pattern)
+    (prefix, suffix) = pattern.split('*')
+    matcher = re.compile(re.escape(prefix) + '(.+)' + re.escape(suffix) + '$')
+    result = list()
+    for name in parameter_names:
+        match = matcher.match(name)
+        if match is not None:
+            result.append(match.group(1))
+    return sorted(result, key=natural_key)
+
+def read_table(filename):
+    '''
+    Read a table of per element values.  Each non-blank line that does not start
+    with '#' is an element followed by its values (whitespace or comma separated):
+    *  For slices:  element low high
+    *  For contours and bands: element x1 y1 x2 y2 ...
+    Returns a dict of element -> list of floats.  ValueError is raised for lines
+    whose values are not numbers.
+    '''
+    result = dict()
+    with open(filename, 'r') as f:
+        for (number, line) in enumerate(f, start=1):
+            fields = line.replace(',', ' ').split()
+            if len(fields) == 0 or fields[0].startswith('#'):
+                continue
+            try:
+                result[fields[0]] = [float(x) for x in fields[1:]]
+            except ValueError:
+                raise ValueError(f'{filename} line {number}: values must be numbers: {line.strip()}')
+    return result
+
+def expand(ctype, name_pattern, parameter_patterns, parameter_names,
+           low=None, high=None, points=None, table=None):
+    '''
+    Expand a gate array template into condition definitions.
+    *  ctype - condition type 's', 'c' or 'b'.
+    *  name_pattern - condition name with a '*' for the element.
+    *  parameter_patterns - parameter names each with a '*' for the element
+                  (one for slices, x and y for contours and bands).
+    *  parameter_names - names of the existing parameters.
+    *  low, high - slice limits (slices).
+    *  points - list of (x, y) pairs (contours and bands).
+    *  table - If not None a dict as from read_table.  Elements in the table
+               take their limits/points from it, others use low/high/points.
+    Returns the list of definitions in element order.  ValueError is raised if the
+    template is not valid or leaves an element without limits/points.
+    '''
+    if ctype not in SUPPORTED_TYPES:
+        raise ValueError(f'Gate arrays of type {ctype} are not supported')
+    needed = 1 if ctype in SLICE_TYPES else 2
+    if len(parameter_patterns) != needed:
+        raise ValueError(f'Conditions of type {ctype} need {needed} parameter pattern(s)')
+    _check_pattern(name_pattern)
+    for pattern in parameter_patterns:
+        _check_pattern(pattern)
+    if table is None:
+        table = dict()
+
+    existing = set(parameter_names)
+    result = list()
+    for element in elements(parameter_patterns[0], parameter_names):
+        parameters = [p.replace('*', element) for p in parameter_patterns]
+        if not all([p in existing for p in parameters]):
+            continue
+        values = table.get(element)
+        if ctype in SLICE_TYPES:
+            element_points = _slice_points(element, values, low, high)
+        else:
+            element_points = _points(ctype, element, values, points)
+        result.append({
+            'name': name_pattern.replace('*', element),
+            'type': ctype,
+            'parameters': parameters,
+            'points': element_points,
+            'dependencies': [],
+            'mask': None
+        })
+    return result
+
+def aggregates(definitions, or_name=None, and_name=None):
+    '''
+    Definitions of the OR ('+') and/or AND ('*') of the conditions in definitions.
+    Names that are None or empty are not made.
+    '''
+    names = [d['name'] for d in definitions]
+    result = list()
+    for (name, ctype) in ((or_name, '+'), (and_name, '*')):
+        if name is not None and name != '':
+            result.append({
+                'name': name, 'type': ctype, 'parameters': [], 'points': [],
+                'dependencies': names, 'mask': None
+            })
+    return result
+
+def create(client, definitions, workers=restorepipeline.DEFAULT_WORKERS, progress=None):
+    '''
+    Create the conditions (elements and aggregates) in the server concurrently.
+    Returns the pipeline so the caller can run it (e.g. with a progress dialog)
+    or cancel it;  pipeline.run() gives a restorepipeline.RestoreReport.
+    '''
+    pipeline = restorepipeline.RestorePipeline(client, workers, progress)
+    pipeline.add_conditions(definitions)
+    return pipeline
+
+# Private functions:
+
+def _check_pattern(pattern):
+    if pattern.count('*') != 1:
+        raise ValueError(f"'{pattern}' must have exactly one '*' for the array element")
+
+def _slice_points(element, values, low, high):
+    if values is not None:
+        if len(values) != 2:
+            raise ValueError(f'Table entry for {element} must have a low and a high')
+        (low, high) = values
+    if low is None or high is None:
+        raise ValueError(f'No slice limits for {element}')
+    return [(float(low), 0.0), (float(high), 0.0)]
+
+def _points(ctype, element, values, points):
+    # Contours need at least 3 points, bands 2.
+    minimum = 3 if ctype == 'c' else 2
+    if values is not None:
+        if len(values) % 2 != 0:
+            raise ValueError(f'Table entry for {element} must be x y pairs')
+        points = list(zip(values[0::2], values[1::2]))
+    if points is None or len(points) < minimum:
+        raise ValueError(f'Not enough points for {element} ({minimum} are needed)')
+    return [(float(x), float(y)) for (x, y) in points]
@@ -34,6 +34,28 @@ class ConditionModel(QStandardItemModel):
         for condition in data:
             self._add_condition(condition)
         pass
+    def add(self, definition):
+        ''' Add a condition given its definition from condition_list '''
+        self._add_condition(definition)
+
+    def remove(self, name):
+        ''' Remove the condition 'name' if it's in the model '''
+        for item in self.findItems(name):
+            self.removeRow(item.row())
+
+    def replace(self, definition):
+        '''
+        Replace the row of the condition with this definition's name.  If there is
+        none, the condition is added.
+        '''
+        items = self.findItems(definition['name'])
+        if len(items) == 0:
+            self._add_condition(definition)
+            return
+        row = items[0].row()
+        for (column, value) in enumerate(self._row_values(definition)):
+            self.setItem(row, column, QStandardItem(value))
+
     def headerData(self, col, orient, role):
         if role == Qt.DisplayRole:
             if orient == Qt.Horizontal:
@@ -42,14 +64,14 @@ class ConditionModel(QStandardItemModel):
                 return None
 
     def _add_condition(self, c):
-        name = QStandardItem(c['name'])
-        type_string = QStandardItem(c['type'])
-        gates = QStandardItem(self._get_string_list(c, 'gates'))
-        parameters = QStandardItem(self._get_string_list(c, 'parameters'))
-        points     = QStandardItem(self._get_points(c))
-        limits     = QStandardItem(self._get_limits(c))
-        mask      = QStandardItem(self._get_mask(c))
-        self.appendRow([name, type_string, gates, parameters, points, limits, mask])
+        self.appendRow([QStandardItem(value) for value in self._row_values(c)])
+    def _row_values(self, c):
+        # The column values of a condition's row:
+        return [
+            c['name'], c['type'],
+            self._get_string_list(c, 'gates'), self._get_string_list(c, 'parameters'),
+            self._get_points(c), self._get_limits(c), self._get_mask(c)
+        ]
     def _get_field(self, item, key):
         #  If there is no field, None is returned, else the contents
         # of that field are returned...irregardless of type
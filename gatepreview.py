@@ -0,0 +1,180 @@
+'''
+This module evaluates conditions locally so that a contour, band or slice
+can be previewed against a spectrum's contents without making the condition
+in the server.  Conditions and spectrum definitions are dicts as from
+condition_list and spectrum_list;  contents are spectrumcontents dicts.
+
+The tests use the condition semantics documented in rustogramer_client:
+
+*  Contours (c, gc) - the odd crossing (ray casting) rule.
+*  Bands (b, gb) - below the polyline;  where segments overlap (sawtooth
+   bands) below the highest of them.  Points beyond the x extent of the
+   band are outside.
+*  Slices (s, gs) - low <= x < high.
+
+Everything is vectorized over arbitrary arrays of points:  the mask
+functions evaluate the tests at the bin centers of a spectrum's axes and
+give boolean arrays shaped like spectrumcontents.to_dense of the spectrum.
+Loops are only over the edges of the figure, never over channels.
+
+preview(condition, definition, contents) gives the counts inside the
+condition and the mask image.  Nothing here depends on Qt.
+'''
+import numpy as np
+
+CONTOUR_TYPES = ('c', 'gc')
+BAND_TYPES = ('b', 'gb')
+SLICE_TYPES = ('s', 'gs')
+GAMMA_TYPES = ('gc', 'gb', 'gs')
+
+def bin_centers(axis):
+    ''' Coordinates of the bin centers of an axis dict (low, high, bins) '''
+    width = (axis['high'] - axis['low'])/axis['bins']
+    return axis['low'] + (np.arange(axis['bins']) + 0.5)*width
+
+def inside_contour(x, y, points):
+    '''
+    Boolean array: True where (x, y) is inside the closed polygon 'points'
+    (list of {'x', 'y'} dicts) by the odd crossing rule.  x and y are arrays of
+    the same shape.
+    '''
+    (px, py) = _vertices(points)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    inside = np.zeros(np.broadcast(x, y).shape, dtype=bool)
+    if len(px) < 3:
+        return inside
+    # Cast a ray in +x from each point and count the edges it crosses.
+    for (x1, y1, x2, y2) in zip(px, py, np.roll(px, -1), np.roll(py, -1)):
+        if y1 == y2:
+            continue                              # Horizontal edges are never crossed.
+        straddles = (y1 > y) != (y2 > y)
+        crossing = x1 + (y - y1)*(x2 - x1)/(y2 - y1)
+        inside ^= straddles & (x < crossing)
+    return inside
+
+def below_band(x, y, points):
+    '''
+    Boolean array: True where (x, y) is at or below the polyline 'points'.  Where
+    several segments span x the highest one counts.
+    '''
+    (px, py) = _vertices(points)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    limit = np.full(np.broadcast(x, y).shape, -np.inf)
+    for (x1, y1, x2, y2) in zip(px[:-1], py[:-1], px[1:], py[1:]):
+        (left, right) = (min(x1, x2), max(x1, x2))
+        spans = (x >= left) & (x <= right)
+        if x1 == x2:
+            height = np.full(limit.shape, max(y1, y2))
+        else:
+            height = y1 + (x - x1)*(y2 - y1)/(x2 - x1)
+        limit = np.where(spans, np.maximum(limit, height), limit)
+    return y <= limit
+
+def in_slice(x, low, high):
+    ''' Boolean array: True where low <= x < high '''
+    x = np.asarray(x, dtype=np.float64)
+    return (x >= low) & (x < high)
+
+def contour_mask(points, xaxis, yaxis):
+    ''' (ybins, xbins) mask of the bins whose centers are inside a contour '''
+    (x, y) = np.meshgrid(bin_centers(xaxis), bin_centers(yaxis))
+    return inside_contour(x, y, points)
+
+def band_mask(points, xaxis, yaxis):
+    ''' (ybins, xbins) mask of the bins whose centers are below a band '''
+    (x, y) = np.meshgrid(bin_centers(xaxis), bin_centers(yaxis))
+    return below_band(x, y, points)
+
+def slice_mask(low, high, axis):
+    ''' (bins,) mask of the bins whose centers are in a slice '''
+    return in_slice(bin_centers(axis), low, high)
+
+def condition_mask(condition, definition):
+    '''
+    Mask of the channels of the spectrum 'definition' that are inside 'condition',
+    shaped like spectrumcontents.to_dense:  (ybins, xbins) for spectra with two axes
+    else (xbins,).
+    Raises ValueError if the condition can't be evaluated on the spectrum (wrong
+    type or its parameters aren't on the spectrum's axes).
+    '''
+    type_string = condition['type']
+    xaxis = definition['xaxis']
+    yaxis = definition.get('yaxis')
+    twod = yaxis is not None and len(yaxis) > 0
+    (xparams, yparams) = _axis_parameters(definition)
+    parameters = list(condition.get('parameters', []))
+
+    if type_string in SLICE_TYPES:
+        low = float(condition['low'])
+        high = float(condition['high'])
+        if type_string == 'gs' or _on(parameters[0], xparams):
+            mask = slice_mask(low, high, xaxis)
+            return np.broadcast_to(mask, (yaxis['bins'], xaxis['bins'])) if twod else mask
+        if twod and _on(parameters[0], yparams):
+            return np.broadcast_to(slice_mask(low, high, yaxis)[:, np.newaxis], (yaxis['bins'], xaxis['bins']))
+        raise ValueError(f"The slice parameter {parameters[0]} is not on an axis of {definition['name']}")
+
+    if type_string not in CONTOUR_TYPES + BAND_TYPES:
+        raise ValueError(f'Conditions of type {type_string} cannot be previewed')
+    if not twod:
+        raise ValueError(f"{definition['name']} has only one axis;  a 2d condition needs two")
+    points = condition['points']
+    if type_string not in GAMMA_TYPES:
+        if _on(parameters[0], yparams) and _on(parameters[1], xparams):
+            points = [{'x': p['y'], 'y': p['x']} for p in points]      # Axes swapped.
+        elif not (_on(parameters[0], xparams) and _on(parameters[1], yparams)):
+            raise ValueError(
+                f"{parameters[0]} vs {parameters[1]} are not the axes of {definition['name']}"
+            )
+    if type_string in CONTOUR_TYPES:
+        return contour_mask(points, xaxis, yaxis)
+    return band_mask(points, xaxis, yaxis)
+
+def preview(condition, definition, contents):
+    '''
+    Evaluate a condition on a spectrum's contents.  Returns a dict with:
+    *  counts - sum of the channels inside the condition.
+    *  total  - sum of all channels.
+    *  channels - number of non-zero channels inside the condition.
+    *  mask   - the condition_mask (the image of the condition).
+    Raises ValueError as condition_mask does.
+    '''
+    mask = condition_mask(condition, definition)
+    xbins = contents['xbins']
+    if mask.ndim == 1:
+        in_range = (xbins >= 0) & (xbins < mask.shape[0])
+        inside = mask[xbins[in_range]]
+    else:
+        ybins = contents['ybins']
+        in_range = (xbins >= 0) & (xbins < mask.shape[1]) & (ybins >= 0) & (ybins < mask.shape[0])
+        inside = mask[ybins[in_range], xbins[in_range]]
+    values = contents['values'][in_range]
+    return {
+        'counts': float(values[inside].sum()),
+        'total': float(contents['values'].sum()),
+        'channels': int(np.count_nonzero(inside & (values != 0))),
+        'mask': mask
+    }
+
+# Private functions:
+
+def _vertices(points):
+    # Points may come from editors as strings.
+    px = np.array([float(p['x']) for p in points], dtype=np.float64)
+    py = np.array([float(p['y']) for p in points], dtype=np.float64)
+    return (px, py)
+
+def _axis_parameters(definition):
+    # (x parameters, y parameters) of a spectrum definition.
+    xparams = definition.get('xparameters')
+    yparams = definition.get('yparameters')
+    if xparams is None:
+        xparams = definition.get('parameters', [])[:1]
+    if yparams is None:
+        yparams = definition.get('parameters', [])[1:2]
+    return (list(xparams), list(yparams))
+
+def _on(parameter, parameters):
+    return parameter in parameters
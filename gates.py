@@ -13,8 +13,9 @@ from PyQt5.QtCore import pyqtSignal, QObject
 
 import conditionEditor
 import filteredgates
-from spectrumeditor import error
+from spectrumeditor import error, confirm
 from gatelist import common_condition_model    # Condition model.
+from conditiongraph import common_condition_graph
 import ParameterChooser
 from rustogramer_client import RustogramerException
 class Gates(QWidget):
@@ -167,13 +168,13 @@ class  Controller:
         view.delete_selected.connect(self._delete_list)
         view.delete_displayed.connect(self._delete_list)
         
-        # For now, condition_removed and condition_added just update
-        # Later we may want a more targeted approach:
+        # condition_removed and condition_added only refresh the condition
+        # they name in the condition model and graph.
         
         # Need them both because deletion is possible with creation.
         
-        view.condition_removed.connect(self._update)
-        view.condition_added.connect(self._update)
+        view.condition_removed.connect(self._refresh_condition)
+        view.condition_added.connect(self._refresh_condition)
     # Slots   
     
     def _update(self):
@@ -182,6 +183,27 @@ class  Controller:
         mask = self._view.gatelist().filter()
         filteredgates.filtered_gate_model.setFilterWildcard(mask)
         common_condition_model.load(self._client)
+        common_condition_graph.load(self._client)
+    
+    def _refresh_condition(self, name):
+        # A condition was created, replaced or deleted.  Fetch just its definition
+        # (a deleted SpecTcl condition may still be listed as a False condition)
+        # and update the model and graph to match:
+        
+        pattern = name
+        if any([c in name for c in '*?[\\']):
+            pattern = '*'                     # Can't match the name exactly.
+        try:
+            definitions = [x for x in self._client.condition_list(pattern)['detail'] if x['name'] == name]
+        except RustogramerException as e:
+            error(f'Unable to get the definition of condition {name}: {e}')
+            return
+        if len(definitions) == 0:
+            common_condition_model.remove(name)
+            common_condition_graph.remove_condition(name)
+        else:
+            common_condition_model.replace(definitions[0])
+            common_condition_graph.set_condition(definitions[0])
         
     def _pupdate(self):
         #  Update the full parameter name model.
@@ -238,11 +260,37 @@ class  Controller:
         eview.setName(condition['name'])       # Success is assured at this oint.
         
     def _delete_list(self, names):
-        # Deletes a list of conditions by name:
+        # Deletes a list of conditions by name.  If other conditions or spectra
+        # depend on them, the user must confirm first.  Dependents are deleted before
+        # the conditions they depend on.
+        
+        names = list(names)
+        if len(common_condition_graph.names()) == 0:
+            common_condition_graph.load(self._client)
+        deleting = set(names)
+        dependents = set()
+        spectra = set()
+        for name in names:
+            dependents |= common_condition_graph.all_dependents(name)
+            spectra |= common_condition_graph.affected_spectra(name)
+        dependents -= deleting
+        if len(dependents) > 0 or len(spectra) > 0:
+            if not confirm(
+                f'Conditions {_summary(dependents)} and spectra {_summary(spectra)} depend on the conditions being deleted.  Delete anyway?',
+                self._view
+            ):
+                return
+        try:
+            known = [name for name in names if name in common_condition_graph]
+            ordered = common_condition_graph.order(known)
+            names = list(reversed(ordered)) + [name for name in names if name not in common_condition_graph]
+        except ValueError:
+            pass                              # Cycle - just delete in the order given.
         
         for condition in names:
             try:
                 self._client.condition_delete(condition)
+                common_condition_graph.remove_condition(condition)
                 self._view.editor().signal_removal(condition)
             except RustogramerException as e:
                 error(f'Unable to remove condition {condition} : {e} - prior conditions in the selected list were deleted')
@@ -250,6 +298,15 @@ class  Controller:
         
         
         
+def _summary(names, most=10):
+    # A readable list of at most 'most' names.
+    names = sorted(names)
+    if len(names) == 0:
+        return '(none)'
+    if len(names) > most:
+        return ', '.join(names[:most]) + f' and {len(names) - most} more'
+    return ', '.join(names)
+        
 #-----------------------------------------------------------------
 # Test code:
 
@@ -0,0 +1,1077 @@
+#!/usr/bin/env python
+'''
+mockserver - A stand-in SpecTcl/Rustogramer REST server.
+
+Exercising the GUI, the REST client or the performance work (restorepipeline,
+tclbatch, bulkapply, bindingplanner, traceservice...) otherwise needs a real
+histogramer with a real analysis.  This serves the /spectcl/* requests
+rustogramer_client makes from an in-memory model of the histogramer (MockState):
+
+*  parameters, raw parameters, vectors and tree variables.
+*  spectra (spectrum/*, channel/*, specstats) with their contents.
+*  conditions (gate/*) and their application to spectra (apply/*, ungate).
+*  display memory bindings (sbind/*, unbind/*, shmem/*) which fail, as the
+   servers do, when the spectra don't fit in DisplayMegabytes.
+*  traces (trace/*) of parameter, spectrum, condition and binding changes.
+*  waveforms (waveform/*).
+*  script - only the Tcl the GUI itself sends is understood:  the per command
+   batches tclbatch makes and the channel -set scripts of spectrumcontents
+   (which, as in SpecTcl, need an index per spectrum dimension).
+
+Replies have the shapes of the program being imitated (--program):  SpecTcl
+lists spectra with 'axes' and applies -TRUE- to ungated spectra, lists only the
+keys a condition type needs, sends contents as bin numbers and does not name
+itself in /version;  Rustogramer lists xaxis/yaxis and x/y parameters, has no
+gate on ungated spectra, sends contents as coordinates and rejects the SpecTcl
+only requests (script, treevariable, waveform).
+
+For benchmarks MockState.populate makes synthetic catalogs (det.00000 ... of
+parameters, spec.00000 ... of spectra etc.) that scale to 100k entries;  spectrum
+contents are generated (reproducibly, from --seed) when first requested.
+Latency can be injected for every request (--latency, --jitter) or for requests
+matching a glob pattern (--delay 'spectrum/*=0.05').
+
+Programs and tests can run a server in a background thread:
+
+    server = mockserver.start(state)          # state = mockserver.MockState(...)
+    client = rustogramer_client.rustogramer(server.connection())
+    ...
+    server.shutdown()
+
+Nothing here depends on Qt.
+
+Example:
+   mockserver --program Rustogramer --port 8000 --parameters 100000 \\
+        --spectra 100000 --counts 1000 --latency 0.002 --jitter 0.001
+'''
+import argparse
+import fnmatch
+import heapq
+import http.server
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+import bindingplanner
+import capabilities
+import tclbatch
+
+PROGRAMS = ('SpecTcl', 'Rustogramer')
+DEFAULT_PORT = 8000
+DEFAULT_DISPLAY_MEGABYTES = 256
+SHMEM_HEADER = 8192            # Bytes shmem/size adds to the spectrum pool.
+
+VERSIONS = {
+    'SpecTcl': {'major': 7, 'minor': 0, 'editlevel': 5},        # No program_name like older SpecTcls.
+    'Rustogramer': {'major': 1, 'minor': 1, 'editlevel': 6, 'program_name': 'Rustogramer'}
+}
+SPECTCL_ONLY = ('script', 'treevariable/*', 'waveform/*')
+
+_DEFAULT_CHANTYPE = {'SpecTcl': 'long', 'Rustogramer': 'f64'}
+_TWOD_TYPES = ('2', 'g2', 'gd', 'm2')
+_BATCH_CALL = '::_pyGuiBatch '
+_LIST_COMMAND = re.compile(r'\[list ([^\]]*)\]')
+_REQUIRED = object()
+
+class MockError(Exception):
+    ''' A request failed;  status and detail are given in the reply '''
+    def __init__(self, status, detail=''):
+        super().__init__(f'{status}: {detail}')
+        self.status = status
+        self.detail = detail
+
+class Query:
+    ''' The query parameters of a request (as from urllib.parse.parse_qs) '''
+    def __init__(self, params):
+        self._params = params
+
+    def one(self, key, default=_REQUIRED):
+        values = self._params.get(key)
+        if values is None or len(values) == 0:
+            if default is _REQUIRED:
+                raise MockError('Missing parameter', f'The {key} query parameter is required')
+            return default
+        return values[0]
+
+    def many(self, key):
+        return list(self._params.get(key, list()))
+
+    def number(self, key, default=_REQUIRED, kind=float):
+        value = self.one(key, default)
+        if value is None:
+            return None
+        try:
+            return kind(float(value)) if kind is int else kind(value)
+        except ValueError:
+            raise MockError('Invalid parameter', f'{key} must be a number not {value}')
+
+class MockState:
+    '''
+    In-memory model of a histogramer.
+      *  program - 'SpecTcl' or 'Rustogramer', the program whose replies are imitated.
+      *  display_megabytes - size of the display memory spectrum pool.
+      *  seed - seed of the generated spectrum contents.
+      *  event_rate - if not zero, events per second the 'analysis' reports in
+                      shmem/variables (it is then 'Active').
+    The handle method does a request;  populate makes synthetic catalogs.
+    All requests are serialized by a lock.
+    '''
+    def __init__(self, program='SpecTcl', display_megabytes=DEFAULT_DISPLAY_MEGABYTES, seed=0, event_rate=0.0):
+        if program not in PROGRAMS:
+            raise ValueError(f'program must be one of {PROGRAMS} not {program}')
+        self.program = program
+        self.display_megabytes = display_megabytes
+        self.seed = seed
+        self.event_rate = event_rate
+        self._lock = threading.RLock()
+        self._start = time.monotonic()
+
+        self.parameters = dict()        # name -> parameter list entry.
+        self.vectors = dict()           # name -> vector list entry.
+        self.variables = dict()         # name -> tree variable list entry.
+        self.spectra = dict()           # name -> definition (see _create_spectrum).
+        self.gates = dict()             # spectrum -> applied gate (absent if ungated).
+        self.channels = dict()          # spectrum -> {(x, y): value}.
+        self.conditions = dict()        # name -> definition (see _set_condition).
+        self.bindings = dict()          # spectrum -> binding slot.
+        self.waveforms = dict()         # name -> {'samples', 'metadata', 'fits'}.
+        self.update_period = 1
+
+        self._counts = dict()           # spectrum -> counts to generate if contents are requested.
+        self._next_parameter = 1
+        self._next_spectrum = 1
+        self._next_binding = 0
+        self._free_bindings = list()    # Heap of slots freed by unbinding.
+        self._bound_bytes = 0
+        self._traces = dict()           # token -> {'retention', 'touched', 'events'}.
+        self._next_token = 1
+
+        self._requests = {
+            'version': lambda q: dict(VERSIONS[self.program]),
+            'parameter/list': self._parameter_list,
+            'parameter/create': self._parameter_create,
+            'parameter/edit': self._parameter_edit,
+            'parameter/promote': self._parameter_edit,
+            'parameter/check': lambda q: self._parameter_flag(q, True),
+            'parameter/uncheck': lambda q: self._parameter_flag(q, False),
+            'parameter/version': lambda q: '2.1',
+            'rawparameter/new': self._rawparameter_new,
+            'rawparameter/list': self._rawparameter_list,
+            'spectrum/list': self._spectrum_list,
+            'spectrum/create': self._spectrum_create,
+            'spectrum/delete': self._spectrum_delete,
+            'spectrum/contents': self._spectrum_contents,
+            'spectrum/zero': self._spectrum_zero,
+            'channel/get': self._channel_get,
+            'channel/set': self._channel_set,
+            'specstats': self._specstats,
+            'gate/list': self._gate_list,
+            'gate/edit': self._gate_edit,
+            'gate/delete': self._gate_delete,
+            'apply/apply': self._apply_apply,
+            'apply/list': self._apply_list,
+            'ungate': self._ungate,
+            'sbind/all': lambda q: self._bind(list(self.spectra.keys())),
+            'sbind/sbind': lambda q: self._bind(q.many('spectrum')),
+            'sbind/list': self._sbind_list,
+            'sbind/set_update': self._sbind_set_update,
+            'sbind/get_update': lambda q: self.update_period,
+            'unbind/byname': lambda q: self._unbind(q.many('name')),
+            'unbind/byid': self._unbind_byid,
+            'unbind/all': lambda q: self._unbind(list(self.bindings.keys())),
+            'shmem/key': lambda q: 'MOCK' if self.program == 'SpecTcl' else 'file:/dev/shm/mockserver',
+            'shmem/size': lambda q: self._pool() + SHMEM_HEADER,
+            'shmem/variables': self._shmem_variables,
+            'trace/establish': self._trace_establish,
+            'trace/fetch': self._trace_fetch,
+            'trace/done': self._trace_done,
+            'treevariable/list': lambda q: list(self.variables.values()),
+            'treevariable/set': self._treevariable_set,
+            'treevariable/check': lambda q: 0,
+            'treevariable/setchanged': lambda q: '',
+            'treevariable/firetraces': lambda q: '',
+            'waveform/create': self._waveform_create,
+            'waveform/list': self._waveform_list,
+            'waveform/get': self._waveform_get,
+            'waveform/getall': self._waveform_getall,
+            'waveform/metadata/get': self._waveform_metadata_get,
+            'waveform/metadata/set': self._waveform_metadata_set,
+            'waveform/resize': self._waveform_resize,
+            'waveform/fits': self._waveform_fits,
+            'vector/list': self._vector_list,
+            'vector/setlow': lambda q: self._vector_set(q, 'low', float),
+            'vector/sethigh': lambda q: self._vector_set(q, 'high', float),
+            'vector/setbins': lambda q: self._vector_set(q, 'bins', int),
+            'vector/setunits': lambda q: self._vector_set(q, 'units', str),
+            'script': self._script
+        }
+
+    def handle(self, request, params):
+        '''
+        Do a request ('spectrum/list' etc.) with the query parameters 'params'
+        (dict of name -> list of values).  Returns the reply dict or None if the
+        request is not known.
+        '''
+        handler = self._requests.get(request)
+        if handler is None:
+            return None
+        if self.program != 'SpecTcl' and any([fnmatch.fnmatchcase(request, x) for x in SPECTCL_ONLY]):
+            return {'status': 'Unsupported operation', 'detail': f'{request} is not supported by Rustogramer'}
+        try:
+            with self._lock:
+                detail = handler(Query(params))
+            return {'status': 'OK', 'detail': detail}
+        except MockError as e:
+            return {'status': e.status, 'detail': e.detail}
+
+    def populate(self, parameters=0, spectra=0, conditions=0, variables=0, vectors=0, waveforms=0, counts=0):
+        '''
+        Add synthetic catalogs:
+        *  parameters - det.00000 ...  (0-4096 in 4096 bins).
+        *  spectra    - spec.00000 ... 1d spectra of 1024 bins on successive
+                        parameters;  every tenth is a 256x256 2d spectrum of two
+                        neighbouring parameters.  Needs parameters.
+        *  conditions - slice.00000 ... slices on successive parameters.
+        *  variables  - var.00000 ... tree variables.
+        *  vectors    - vec.00000 ... vector parameters.
+        *  waveforms  - wf.00000 ... waveforms of 256 samples.
+        *  counts     - counts each spectrum is filled with when its contents are
+                        first requested (0 for empty spectra).
+        No traces are made.
+        '''
+        with self._lock:
+            names = [self._add_parameter(x, 0.0, 4096.0, 4096, 'channels', 'Synthetic parameter')['name']
+                     for x in _synthetic_names('det', parameters)]
+            if spectra > 0 and len(names) == 0:
+                raise ValueError('Synthetic spectra need synthetic parameters')
+            for (i, name) in enumerate(_synthetic_names('spec', spectra)):
+                x = names[i % len(names)]
+                if i % 10 == 9:
+                    y = names[(i + 1) % len(names)]
+                    spectrum = self._add_spectrum(
+                        name, '2', [x, y], [x], [y], [_axis(0, 4096, 256), _axis(0, 4096, 256)], None
+                    )
+                else:
+                    spectrum = self._add_spectrum(name, '1', [x], [x], [], [_axis(0, 4096, 1024)], None)
+                if counts > 0:
+                    self._counts[spectrum['name']] = counts
+            for (i, name) in enumerate(_synthetic_names('slice', conditions)):
+                self.conditions[name] = _condition(
+                    name, 's', parameters=[names[i % len(names)]] if len(names) > 0 else [],
+                    low=1000.0, high=2000.0
+                )
+            for name in _synthetic_names('var', variables):
+                self.variables[name] = {'name': name, 'value': 1.0, 'units': 'ns'}
+            for name in _synthetic_names('vec', vectors):
+                self.vectors[name] = {'name': name, 'low': 0.0, 'high': 4096.0, 'bins': 4096, 'units': 'channels'}
+            for name in _synthetic_names('wf', waveforms):
+                self.waveforms[name] = {'samples': [0]*256, 'metadata': dict(), 'fits': dict()}
+
+    # Parameters:
+
+    def _parameter_list(self, q):
+        return [self._parameter_entry(self.parameters[x]) for x in _match(self.parameters, q.one('filter', '*'))]
+
+    def _parameter_create(self, q):
+        name = q.one('name')
+        if name in self.parameters:
+            raise MockError('Duplicate parameter', f'{name} already exists')
+        self._add_parameter(
+            name, q.number('low', None), q.number('high', None), q.number('bins', None, int),
+            q.one('units', ''), q.one('description', ''), q.number('number', None, int)
+        )
+        self._trace('parameter', 'add', name)
+        return ''
+
+    def _parameter_edit(self, q):
+        parameter = self._parameter(q.one('name'))
+        for (key, field, kind) in (('low', 'low', float), ('high', 'hi', float), ('bins', 'bins', int)):
+            if q.one(key, None) is not None:
+                parameter[field] = q.number(key, kind=kind)
+        for key in ('units', 'description'):
+            if q.one(key, None) is not None:
+                parameter[key] = q.one(key)
+        self._trace('parameter', 'changed', parameter['name'])
+        return ''
+
+    def _parameter_flag(self, q, value):
+        self._parameter(q.one('name'))['checked'] = value
+        return ''
+
+    def _rawparameter_new(self, q):
+        name = q.one('name')
+        if name in self.parameters:
+            raise MockError('Duplicate parameter', f'{name} already exists')
+        self._add_parameter(
+            name, q.number('low', None), q.number('high', None), q.number('bins', None, int),
+            q.one('units', ''), q.one('description', ''), q.number('number', None, int)
+        )
+        self._trace('parameter', 'add', name)
+        return ''
+
+    def _rawparameter_list(self, q):
+        if q.one('id', None) is not None:
+            id = q.number('id', kind=int)
+            names = [x['name'] for x in self.parameters.values() if x['id'] == id]
+        else:
+            names = _match(self.parameters, q.one('pattern', '*'))
+        return [self._parameter_entry(self.parameters[x]) for x in names]
+
+    def _add_parameter(self, name, low, high, bins, units, description, id=None):
+        if id is None:
+            id = self._next_parameter
+        self._next_parameter = max(self._next_parameter, id + 1)
+        parameter = {
+            'name': name, 'id': id, 'low': low, 'hi': high, 'bins': bins,
+            'units': units, 'description': description, 'checked': False
+        }
+        self.parameters[name] = parameter
+        return parameter
+
+    def _parameter(self, name):
+        parameter = self.parameters.get(name)
+        if parameter is None:
+            raise MockError('No such parameter', name)
+        return parameter
+
+    def _parameter_entry(self, parameter):
+        entry = {x: parameter[x] for x in ('name', 'id', 'bins', 'low', 'hi', 'units')}
+        if self.program == 'Rustogramer':
+            entry['description'] = parameter['description']
+        return entry
+
+    # Spectra:
+
+    def _spectrum_list(self, q):
+        return [self._spectrum_entry(self.spectra[x]) for x in _match(self.spectra, q.one('filter', '*'))]
+
+    def _spectrum_create(self, q):
+        self._create_spectrum(
+            q.one('name'), q.one('type'), q.one('parameters'), q.one('axes'), q.one('chantype', None)
+        )
+        return ''
+
+    def _spectrum_delete(self, q):
+        for name in q.many('name'):
+            self._delete_spectrum(name)
+        return ''
+
+    def _spectrum_contents(self, q):
+        spectrum = self._spectrum(q.one('name'))
+        (xaxis, yaxis) = _dimensions(spectrum)
+        xrange = _bin_range(xaxis, q.number('xlow', None), q.number('xhigh', None))
+        yrange = _bin_range(yaxis, q.number('ylow', None), q.number('yhigh', None)) if yaxis is not None else (0, 0)
+        channels = [
+            (x, y, v) for ((x, y), v) in self._contents(spectrum['name']).items()
+            if xrange[0] <= x <= xrange[1] and yrange[0] <= y <= yrange[1] and v != 0
+        ]
+        if self.program == 'SpecTcl':
+            return {
+                'statistics': {'xunderflow': 0, 'xoverflow': 0, 'yunderflow': 0, 'yoverflow': 0},
+                'channels': [{'x': x, 'y': y, 'v': v} for (x, y, v) in channels]
+            }
+        xwidth = (xaxis['high'] - xaxis['low'])/xaxis['bins']
+        ywidth = (yaxis['high'] - yaxis['low'])/yaxis['bins'] if yaxis is not None else 0.0
+        ylow = yaxis['low'] if yaxis is not None else 0.0
+        return {'channels': [
+            {
+                'x': xaxis['low'] + x*xwidth, 'y': ylow + y*ywidth, 'bin': x + y*xaxis['bins'],
+                'chan_type': 'Bin', 'value': v
+            } for (x, y, v) in channels
+        ]}
+
+    def _spectrum_zero(self, q):
+        for name in _match(self.spectra, q.one('pattern', '*')):
+            self.channels[name] = dict()
+            self._counts.pop(name, None)
+        return ''
+
+    def _channel_get(self, q):
+        spectrum = self._spectrum(q.one('spectrum'))
+        key = (q.number('xchannel', kind=int), q.number('ychannel', 0, int))
+        return self._contents(spectrum['name']).get(key, 0)
+
+    def _channel_set(self, q):
+        self._set_channel(
+            q.one('spectrum'), q.number('xchannel', kind=int), q.number('ychannel', 0, int), q.number('value')
+        )
+        return ''
+
+    def _specstats(self, q):
+        result = list()
+        for pattern in q.many('pattern') or ['*']:
+            for name in _match(self.spectra, pattern):
+                zeros = [0, 0] if _dimensions(self.spectra[name])[1] is not None else [0]
+                result.append({'name': name, 'underflows': zeros, 'overflows': list(zeros)})
+        return result
+
+    def _create_spectrum(self, name, stype, parameters, axes, chantype=None):
+        # parameters and axes are the Tcl lists spectrum/create (and spectrum -new) take.
+        if name in self.spectra:
+            raise MockError('Duplicate spectrum', f'{name} already exists')
+        if stype == 'S' and self.program != 'SpecTcl':
+            raise MockError('Unsupported spectrum type', 'Strip chart spectra are only supported by SpecTcl')
+        try:
+            words = tclbatch.parse_list(parameters)
+            axes = [tclbatch.parse_list(x) for x in tclbatch.parse_list(axes)]
+            axes = [_axis(float(x[0]), float(x[1]), int(float(x[2]))) for x in axes]
+            listed = words
+            if stype == 'gd':
+                (xparameters, yparameters) = (tclbatch.parse_list(words[0]), tclbatch.parse_list(words[1]))
+                listed = [' '.join(xparameters), ' '.join(yparameters)]
+            elif stype == 'gs':
+                xparameters = [p for group in words for p in tclbatch.parse_list(group)]
+                yparameters = list()
+            elif stype in ('2', 'S'):
+                (xparameters, yparameters) = (words[:1], words[1:2])
+            elif stype == 'm2':
+                (xparameters, yparameters) = (words[0::2], words[1::2])
+            else:
+                (xparameters, yparameters) = (words, list())
+        except (ValueError, IndexError) as e:
+            raise MockError('Invalid spectrum definition', f'{name}: {e}')
+        if len(axes) < (2 if stype in _TWOD_TYPES else 1):
+            raise MockError('Invalid spectrum definition', f'{name}: not enough axes for a {stype} spectrum')
+        unknown = [x for x in xparameters + yparameters if x not in self.parameters and x not in self.vectors]
+        if len(xparameters) == 0 or len(unknown) > 0:
+            raise MockError('Invalid spectrum definition', f'{name}: no such parameter(s) {" ".join(unknown)}')
+        self._add_spectrum(name, stype, listed, xparameters, yparameters, axes, chantype)
+        self._trace('spectrum', 'add', name)
+        return name
+
+    def _add_spectrum(self, name, stype, parameters, xparameters, yparameters, axes, chantype):
+        if chantype is None or chantype not in capabilities.DataTypeStringsToChannelTypes:
+            chantype = _DEFAULT_CHANTYPE[self.program]
+        spectrum = {
+            'name': name, 'id': self._next_spectrum, 'type': stype, 'parameters': parameters,
+            'xparameters': xparameters, 'yparameters': yparameters, 'axes': axes, 'chantype': chantype
+        }
+        self._next_spectrum += 1
+        self.spectra[name] = spectrum
+        return spectrum
+
+    def _delete_spectrum(self, name):
+        self._spectrum(name)
+        if name in self.bindings:
+            self._unbind([name])
+        del self.spectra[name]
+        self.gates.pop(name, None)
+        self.channels.pop(name, None)
+        self._counts.pop(name, None)
+        self._trace('spectrum', 'delete', name)
+
+    def _spectrum(self, name):
+        spectrum = self.spectra.get(name)
+        if spectrum is None:
+            raise MockError('No such spectrum', name)
+        return spectrum
+
+    def _spectrum_entry(self, spectrum):
+        gate = self.gates.get(spectrum['name'])
+        if self.program == 'SpecTcl':
+            return {
+                'name': spectrum['name'], 'type': spectrum['type'], 'parameters': spectrum['parameters'],
+                'axes': [dict(x) for x in spectrum['axes']], 'chantype': spectrum['chantype'],
+                'gate': gate if gate is not None else '-TRUE-'
+            }
+        (xaxis, yaxis) = _dimensions(spectrum)
+        return {
+            'name': spectrum['name'], 'type': spectrum['type'],
+            'parameters': spectrum['xparameters'] + spectrum['yparameters'],
+            'xparameters': spectrum['xparameters'], 'yparameters': spectrum['yparameters'],
+            'xaxis': xaxis, 'yaxis': yaxis, 'chantype': spectrum['chantype'], 'gate': gate
+        }
+
+    def _contents(self, name):
+        # Channels of a spectrum, generated if it's a populated spectrum that's not been filled.
+        channels = self.channels.get(name)
+        if channels is None:
+            channels = dict()
+            counts = self._counts.pop(name, 0)
+            if counts > 0:
+                channels = self._generate(self.spectra[name], counts)
+            self.channels[name] = channels
+        return channels
+
+    def _generate(self, spectrum, counts):
+        # A gaussian peak in the middle of the spectrum.
+        rng = np.random.default_rng([self.seed, spectrum['id']])
+        (xaxis, yaxis) = _dimensions(spectrum)
+        columns = [np.clip(rng.normal(xaxis['bins']/2, xaxis['bins']/10, counts), 0, xaxis['bins'] - 1)]
+        if yaxis is not None:
+            columns.append(np.clip(rng.normal(yaxis['bins']/2, yaxis['bins']/10, counts), 0, yaxis['bins'] - 1))
+        else:
+            columns.append(np.zeros(counts))
+        (bins, values) = np.unique(np.column_stack(columns).astype(np.int64), axis=0, return_counts=True)
+        return {(int(x), int(y)): int(v) for ((x, y), v) in zip(bins.tolist(), values.tolist())}
+
+    def _set_channel(self, name, x, y, value):
+        spectrum = self._spectrum(name)
+        (xaxis, yaxis) = _dimensions(spectrum)
+        if not (0 <= x < xaxis['bins']) or (yaxis is not None and not (0 <= y < yaxis['bins'])):
+            raise MockError('Invalid channel', f'{name}: channel ({x}, {y}) is out of range')
+        self._contents(name)[(x, y)] = value
+
+    # Conditions and applications:
+
+    def _gate_list(self, q):
+        return [self._condition_entry(self.conditions[x]) for x in _match(self.conditions, q.one('pattern', '*'))]
+
+    def _gate_edit(self, q):
+        name = q.one('name')
+        ctype = q.one('type')
+        if ctype in ('T', 'F'):
+            self._set_condition(name, ctype)
+        elif ctype == '-':
+            self._set_condition(name, ctype, gates=q.many('gate')[:1])
+        elif ctype in ('*', '+'):
+            self._set_condition(name, ctype, gates=q.many('gate'))
+        elif ctype in ('s', 'gs', 'vs*', 'vs+'):
+            self._set_condition(
+                name, ctype, parameters=q.many('parameter'), low=q.number('low'), high=q.number('high')
+            )
+        elif ctype in ('c', 'b', 'gc', 'gb'):
+            if ctype in ('c', 'b'):
+                parameters = [q.one('xparameter'), q.one('yparameter')]
+            else:
+                parameters = q.many('parameter')
+            try:
+                points = [(float(x), float(y)) for (x, y) in zip(q.many('xcoord'), q.many('ycoord'))]
+            except ValueError as e:
+                raise MockError('Invalid condition', f'{name}: {e}')
+            self._set_condition(name, ctype, parameters=parameters, points=points)
+        elif ctype in ('em', 'am', 'nm'):
+            self._set_condition(name, ctype, parameters=q.many('parameter')[:1], value=q.number('value', kind=int))
+        else:
+            raise MockError('Invalid condition', f'{name}: unknown condition type {ctype}')
+        return ''
+
+    def _gate_delete(self, q):
+        name = q.one('name')
+        if name not in self.conditions:
+            raise MockError('No such condition', name)
+        if self.program == 'SpecTcl':
+            self.conditions[name] = _condition(name, 'F')     # SpecTcl's deleted gates become False gates.
+        else:
+            del self.conditions[name]
+        self._trace('gate', 'delete', name)
+        return ''
+
+    def _apply_apply(self, q):
+        gate = q.one('gate')
+        for spectrum in q.many('spectrum'):
+            self._apply(gate, spectrum)
+        return ''
+
+    def _apply_list(self, q):
+        result = list()
+        for name in _match(self.spectra, q.one('pattern', '*')):
+            gate = self.gates.get(name)
+            if gate is None and self.program == 'SpecTcl':
+                gate = '-TRUE-'
+            result.append({'spectrum': name, 'gate': gate})
+        return result
+
+    def _ungate(self, q):
+        for name in q.many('name'):
+            self._spectrum(name)
+            self.gates.pop(name, None)
+        return ''
+
+    def _set_condition(self, name, ctype, parameters=(), points=(), gates=(), low=None, high=None, value=None):
+        unknown = [x for x in parameters if x not in self.parameters and x not in self.vectors]
+        unknown += [x for x in gates if x not in self.conditions and x != name]
+        if len(unknown) > 0:
+            raise MockError('Invalid condition', f'{name}: no such parameter(s)/condition(s) {" ".join(unknown)}')
+        operation = 'changed' if name in self.conditions else 'add'
+        self.conditions[name] = _condition(name, ctype, parameters, points, gates, low, high, value)
+        self._trace('gate', operation, name)
+
+    def _condition_entry(self, condition):
+        if self.program != 'SpecTcl':
+            return dict(condition)
+        # SpecTcl only gives the keys the condition type uses:
+        ctype = condition['type']
+        if ctype in ('-', '*', '+'):
+            keys = ('gates',)
+        elif ctype in ('s', 'gs', 'vs*', 'vs+'):
+            keys = ('parameters', 'low', 'high')
+        elif ctype in ('c', 'b', 'gc', 'gb'):
+            keys = ('parameters', 'points')
+        elif ctype in ('em', 'am', 'nm'):
+            keys = ('parameters', 'value')
+        else:
+            keys = ()
+        entry = {'name': condition['name'], 'type': ctype}
+        entry.update({x: condition[x] for x in keys})
+        return entry
+
+    def _apply(self, gate, spectrum):
+        self._spectrum(spectrum)
+        if gate not in self.conditions and not (self.program == 'SpecTcl' and gate == '-TRUE-'):
+            raise MockError('No such condition', gate)
+        if gate == '-TRUE-':
+            self.gates.pop(spectrum, None)
+        else:
+            self.gates[spectrum] = gate
+
+    # Bindings and shared memory:
+
+    def _sbind_list(self, q):
+        return [
+            {'spectrumid': self.spectra[x]['id'], 'name': x, 'binding': self.bindings[x]}
+            for x in _match(self.bindings, q.one('pattern', '*'))
+        ]
+
+    def _sbind_set_update(self, q):
+        self.update_period = q.number('seconds', kind=int)
+        return ''
+
+    def _unbind_byid(self, q):
+        ids = set([int(x) for x in q.many('id') if x.isdigit()])
+        return self._unbind([x for x in self.bindings if self.spectra[x]['id'] in ids])
+
+    def _shmem_variables(self, q):
+        analyzed = int((time.monotonic() - self._start)*self.event_rate)
+        return {
+            'DisplayMegabytes': self.display_megabytes, 'OnlineState': 'false', 'EventListSize': 1,
+            'ParameterCount': len(self.parameters), 'SpecTclHome': '/usr/opt/mockserver',
+            'LastSequence': analyzed, 'RunNumber': 0, 'RunState': 'Active' if self.event_rate > 0 else 'Inactive',
+            'DisplayType': 'None', 'BuffersAnalyzed': analyzed, 'RunTitle': 'Mock server run'
+        }
+
+    def _bind(self, names):
+        # Like the servers, bind all or (if they don't all fit) none of the spectra.
+        for name in names:
+            self._spectrum(name)
+        names = [x for x in dict.fromkeys(names) if x not in self.bindings]
+        needed = sum([self._footprint(x) for x in names])
+        free = self._pool() - self._bound_bytes
+        if needed > free:
+            raise MockError(
+                'Unable to bind spectra',
+                f'Insufficient display memory: {needed} bytes are needed and only {free} are free'
+            )
+        for name in names:
+            if len(self._free_bindings) > 0:
+                self.bindings[name] = heapq.heappop(self._free_bindings)
+            else:
+                self.bindings[name] = self._next_binding
+                self._next_binding += 1
+            self._trace('binding', 'add', name)
+        self._bound_bytes += needed
+        return ''
+
+    def _unbind(self, names):
+        for name in names:
+            slot = self.bindings.pop(name, None)
+            if slot is not None:
+                heapq.heappush(self._free_bindings, slot)
+                self._bound_bytes -= self._footprint(name)
+                self._trace('binding', 'delete', name)
+        return ''
+
+    def _footprint(self, name):
+        spectrum = self.spectra[name]
+        (xaxis, yaxis) = _dimensions(spectrum)
+        definition = {'xaxis': xaxis, 'yaxis': yaxis, 'chantype': spectrum['chantype']}
+        if spectrum['type'] in ('s', 'gs'):
+            definition.update({'xaxis': None, 'xparameters': spectrum['parameters']})
+        return bindingplanner.footprint(definition, 2 if self.program == 'SpecTcl' else 0)
+
+    def _pool(self):
+        return int(self.display_megabytes*bindingplanner.MEGABYTE)
+
+    # Traces:
+
+    def _trace_establish(self, q):
+        self._expire_traces()
+        token = self._next_token
+        self._next_token += 1
+        self._traces[token] = {
+            'retention': q.number('retention', 10.0), 'touched': time.monotonic(),
+            'events': {x: list() for x in ('parameter', 'spectrum', 'gate', 'binding')}
+        }
+        return token
+
+    def _trace_fetch(self, q):
+        self._expire_traces()
+        trace = self._traces.get(q.number('token', kind=int))
+        if trace is None:
+            raise MockError('No such trace token', q.one('token'))
+        trace['touched'] = time.monotonic()
+        events = trace['events']
+        trace['events'] = {x: list() for x in events}
+        return events
+
+    def _trace_done(self, q):
+        if self._traces.pop(q.number('token', kind=int), None) is None:
+            raise MockError('No such trace token', q.one('token'))
+        return ''
+
+    def _trace(self, kind, operation, name):
+        for trace in self._traces.values():
+            trace['events'][kind].append(f'{operation} {name}')
+
+    def _expire_traces(self):
+        # Drop traces that have not been fetched within their retention time.
+        now = time.monotonic()
+        for token in [t for (t, x) in self._traces.items() if now - x['touched'] > x['retention']]:
+            del self._traces[token]
+
+    # Tree variables, vectors and waveforms:
+
+    def _treevariable_set(self, q):
+        self._set_variable(q.one('name'), q.number('value'), q.one('units', None))
+        return ''
+
+    def _set_variable(self, name, value, units=None):
+        variable = self.variables.get(name)
+        if variable is None:
+            raise MockError('No such tree variable', name)
+        variable['value'] = value
+        if units is not None:
+            variable['units'] = units
+
+    def _vector_list(self, q):
+        return [dict(self.vectors[x]) for x in _match(self.vectors, q.one('pattern', '*'))]
+
+    def _vector_set(self, q, key, kind):
+        name = q.one('name')
+        if name not in self.vectors:
+            raise MockError('No such vector', name)
+        self.vectors[name][key] = q.one(key) if kind is str else q.number(key, kind=kind)
+        return ''
+
+    def _waveform_create(self, q):
+        name = q.one('name')
+        if name in self.waveforms:
+            raise MockError('Duplicate waveform', f'{name} already exists')
+        self.waveforms[name] = {'samples': [0]*q.number('samples', kind=int), 'metadata': dict(), 'fits': dict()}
+        return name
+
+    def _waveform_list(self, q):
+        return [
+            {
+                'name': x, 'samples': len(self.waveforms[x]['samples']),
+                'metadata': _name_values(self.waveforms[x]['metadata'])
+            } for x in _match(self.waveforms, q.one('pattern', '*'))
+        ]
+
+    def _waveform_get(self, q):
+        name = q.one('name')
+        return [[name, list(self._waveform(name)['samples'])]]
+
+    def _waveform_getall(self, q):
+        name = q.one('name')
+        waveform = self._waveform(name)
+        return {
+            'name': name,
+            'waveform': {'name': name, 'samples': list(waveform['samples']), 'rank': 0},
+            'fits': [{'name': x, 'points': list(p)} for (x, p) in waveform['fits'].items()]
+        }
+
+    def _waveform_metadata_get(self, q):
+        metadata = self._waveform(q.one('name'))['metadata']
+        key = q.one('key', None)
+        if key is not None:
+            if key not in metadata:
+                raise MockError('No such metadata', key)
+            metadata = {key: metadata[key]}
+        if len(metadata) == 0:
+            raise MockError('No metadata', q.one('name'))
+        return _name_values(metadata)
+
+    def _waveform_metadata_set(self, q):
+        metadata = self._waveform(q.one('name'))['metadata']
+        metadata.update(zip(q.many('key'), q.many('value')))
+        return ''
+
+    def _waveform_resize(self, q):
+        waveform = self._waveform(q.one('name'))
+        length = q.number('samples', kind=int)
+        waveform['samples'] = (waveform['samples'] + [0]*length)[:length]
+        return ''
+
+    def _waveform_fits(self, q):
+        fits = self._waveform(q.one('name'))['fits']
+        return [{'name': x, 'points': list(fits[x])} for x in _match(fits, q.one('pattern', '*'))]
+
+    def _waveform(self, name):
+        waveform = self.waveforms.get(name)
+        if waveform is None:
+            raise MockError('No such waveform', name)
+        return waveform
+
+    # Tcl scripts:
+
+    def _script(self, q):
+        script = q.one('command')
+        if _BATCH_CALL not in script:
+            return self._tcl(script)
+        try:
+            commands = tclbatch.parse_list(tclbatch.parse_list(script[script.rindex(_BATCH_CALL) + len(_BATCH_CALL):])[0])
+        except (ValueError, IndexError) as e:
+            raise MockError('Tcl error', f'Malformed command batch: {e}')
+        statuses = list()
+        for command in commands:
+            try:
+                statuses.append(tclbatch.tcl_list(['0', self._tcl(command)]))
+            except MockError as e:
+                statuses.append(tclbatch.tcl_list(['1', str(e)]))
+        return tclbatch.tcl_list(statuses)
+
+    def _tcl(self, script):
+        # Run the commands (one per line) the GUI sends;  returns the last one's result.
+        result = ''
+        for line in script.split('\n'):
+            line = _LIST_COMMAND.sub(lambda m: '{' + m.group(1) + '}', line)
+            if line.strip() == '':
+                continue
+            try:
+                result = self._tcl_command(tclbatch.parse_list(line))
+            except (ValueError, IndexError) as e:
+                raise MockError('Tcl error', f'{line}: {e}')
+        return result
+
+    def _tcl_command(self, words):
+        (command, arguments) = (words[0], words[1:])
+        if command == 'spectrum' and arguments[0] == '-new':
+            return self._create_spectrum(*arguments[1:6])
+        elif command == 'spectrum' and arguments[0] == '-delete':
+            for name in arguments[1:]:
+                self._delete_spectrum(name)
+        elif command == 'gate' and arguments[0] == '-new':
+            self._tcl_condition(arguments[1], arguments[2], tclbatch.parse_list(arguments[3]))
+            return arguments[1]
+        elif command == 'apply':
+            for spectrum in arguments[1:]:
+                self._apply(arguments[0], spectrum)
+        elif command == 'ungate':
+            for spectrum in arguments:
+                self._spectrum(spectrum)
+                self.gates.pop(spectrum, None)
+        elif command == 'sbind':
+            self._bind(arguments)
+        elif command == 'treevariable' and arguments[0] == '-set':
+            self._set_variable(arguments[1], float(arguments[2]), arguments[3] if len(arguments) > 3 else None)
+        elif command == 'channel' and arguments[0] == '-set':
+            # Like SpecTcl, there must be an index for each of the spectrum's dimensions.
+            indices = tclbatch.parse_list(arguments[2])
+            dimensions = 1 if _dimensions(self._spectrum(arguments[1]))[1] is None else 2
+            if len(indices) != dimensions:
+                raise MockError(
+                    'Tcl error',
+                    f'{arguments[1]} has {dimensions} dimension(s) but {len(indices)} channel indices were given'
+                )
+            (x, y) = (indices + ['0'])[:2]
+            self._set_channel(arguments[1], int(x), int(y), float(arguments[3]))
+        else:
+            raise MockError('Tcl error', f'invalid command name "{" ".join(words[:2])}"')
+        return ''
+
+    def _tcl_condition(self, name, ctype, description):
+        # gate -new:  description is the parsed condition description.
+        d = description
+        if ctype in ('T', 'F'):
+            self._set_condition(name, ctype)
+        elif ctype in ('-', '*', '+'):
+            self._set_condition(name, ctype, gates=d[:1] if ctype == '-' else d)
+        elif ctype == 's':
+            (low, high) = tclbatch.parse_list(d[1])
+            self._set_condition(name, ctype, parameters=d[:1], low=float(low), high=float(high))
+        elif ctype == 'gs':
+            (low, high) = tclbatch.parse_list(d[0])
+            self._set_condition(name, ctype, parameters=tclbatch.parse_list(d[1]), low=float(low), high=float(high))
+        elif ctype in ('c', 'b', 'gc', 'gb'):
+            (parameters, points) = (d[0], d[1]) if ctype in ('c', 'b') else (d[1], d[0])
+            points = [tuple([float(v) for v in tclbatch.parse_list(p)]) for p in tclbatch.parse_list(points)]
+            self._set_condition(name, ctype, parameters=tclbatch.parse_list(parameters), points=points)
+        elif ctype in ('em', 'am', 'nm'):
+            self._set_condition(name, ctype, parameters=d[:1], value=int(d[1], 0))
+        else:
+            raise MockError('Tcl error', f'{name}: unknown condition type {ctype}')
+
+class MockServer(http.server.ThreadingHTTPServer):
+    '''
+    HTTP server of a MockState.
+      *  address - (host, port) to listen on (port 0 picks a free port).
+      *  state   - the MockState.
+      *  latency - seconds every request is delayed.
+      *  jitter  - up to this many more seconds are added at random.
+      *  delays  - list of (glob pattern, seconds) overriding latency for matching
+                   requests (e.g. ('spectrum/*', 0.05)), the first match is used.
+      *  verbose - log each request to stderr.
+    '''
+    daemon_threads = True
+
+    def __init__(self, address, state, latency=0.0, jitter=0.0, delays=(), verbose=False):
+        super().__init__(address, _Handler)
+        self.state = state
+        self.latency = latency
+        self.jitter = jitter
+        self.delays = list(delays)
+        self.verbose = verbose
+
+    def connection(self):
+        ''' Connection dict for rustogramer_client.rustogramer '''
+        (host, port) = self.server_address[:2]
+        return {'host': host, 'port': port}
+
+    def delay(self, request):
+        ''' Seconds to delay 'request' '''
+        latency = self.latency
+        for (pattern, seconds) in self.delays:
+            if fnmatch.fnmatchcase(request, pattern):
+                latency = seconds
+                break
+        if self.jitter > 0:
+            latency += random.uniform(0, self.jitter)
+        return latency
+
+def start(state, host='localhost', port=0, **options):
+    '''
+    Start a MockServer for 'state' in a daemon thread.  options are those of
+    MockServer.  Returns the server;  server.shutdown() stops it.
+    '''
+    server = MockServer((host, port), state, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Private functions and classes:
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        parts = [x for x in url.path.split('/') if x != '']
+        reply = None
+        if len(parts) > 1 and parts[0] == 'spectcl':
+            request = '/'.join(parts[1:])
+            seconds = self.server.delay(request)
+            if seconds > 0:
+                time.sleep(seconds)
+            reply = self.server.state.handle(request, urllib.parse.parse_qs(url.query, keep_blank_values=True))
+        if reply is None:
+            self.send_error(404, f'No such request: {url.path}')
+            return
+        body = json.dumps(reply).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+def _axis(low, high, bins):
+    return {'low': float(low), 'high': float(high), 'bins': int(bins)}
+
+def _condition(name, ctype, parameters=(), points=(), gates=(), low=None, high=None, value=None):
+    return {
+        'name': name, 'type': ctype, 'gates': list(gates), 'parameters': list(parameters),
+        'points': [{'x': x, 'y': y} for (x, y) in points], 'low': low, 'high': high, 'value': value
+    }
+
+def _dimensions(spectrum):
+    # (xaxis, yaxis) of the spectrum's channels, yaxis is None for 1d spectra.
+    # Summary spectra have a channel per parameter on x.
+    axes = spectrum['axes']
+    if spectrum['type'] in ('s', 'gs'):
+        count = len(spectrum['parameters'])
+        return (_axis(0, count, count), axes[0])
+    if spectrum['type'] in _TWOD_TYPES:
+        return (axes[0], axes[1])
+    return (axes[0], None)
+
+def _bin_range(axis, low, high):
+    # Inclusive range of bins on axis from low to high (coordinates, None for the axis limits).
+    width = (axis['high'] - axis['low'])/axis['bins']
+    first = 0 if low is None else int(np.floor((low - axis['low'])/width + 1.0e-6))
+    last = axis['bins'] - 1 if high is None else int(np.floor((high - axis['low'])/width + 1.0e-6))
+    return (max(first, 0), min(last, axis['bins'] - 1))
+
+def _match(names, pattern):
+    # Names (keys of a dict) matching a glob pattern in their order.
+    if not any([c in pattern for c in '*?[']):
+        return [pattern] if pattern in names else []
+    matcher = re.compile(fnmatch.translate(pattern))
+    return [x for x in names if matcher.match(x)]
+
+def _name_values(metadata):
+    return [{'name': x, 'value': v} for (x, v) in metadata.items()]
+
+def _synthetic_names(prefix, count):
+    digits = max(5, len(str(count - 1)))
+    return [f'{prefix}.{i:0{digits}d}' for i in range(count)]
+
+def _delay(text):
+    # --delay PATTERN=SECONDS
+    (pattern, _, seconds) = text.rpartition('=')
+    if pattern == '':
+        raise argparse.ArgumentTypeError(f'{text} must be PATTERN=SECONDS')
+    try:
+        return (pattern, float(seconds))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{text}: {seconds} is not a number of seconds')
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='mockserver',
+        description='Stand-in SpecTcl/Rustogramer REST server for testing and benchmarking',
+        epilog='Clients connect to --host/--port directly;  the service is not advertised to the port manager.'
+    )
+    parser.add_argument('-H', '--host', default='localhost', help='Host/interface to listen on')
+    parser.add_argument('-p', '--port', default=DEFAULT_PORT, type=int,
+        help=f'Port to listen on, defaults to {DEFAULT_PORT} (0 picks a free port)')
+    parser.add_argument('--program', default='SpecTcl', choices=PROGRAMS, help='Program whose replies are imitated')
+    parser.add_argument('--parameters', default=0, type=int, help='Synthetic parameters to make')
+    parser.add_argument('--spectra', default=0, type=int, help='Synthetic spectra to make')
+    parser.add_argument('--conditions', default=0, type=int, help='Synthetic slice conditions to make')
+    parser.add_argument('--variables', default=0, type=int, help='Synthetic tree variables to make')
+    parser.add_argument('--vectors', default=0, type=int, help='Synthetic vector parameters to make')
+    parser.add_argument('--waveforms', default=0, type=int, help='Synthetic waveforms to make')
+    parser.add_argument('--counts', default=0, type=int, help='Counts in each synthetic spectrum')
+    parser.add_argument('--display-megabytes', default=DEFAULT_DISPLAY_MEGABYTES, type=float,
+        help=f'Size of the display memory spectrum pool, defaults to {DEFAULT_DISPLAY_MEGABYTES}')
+    parser.add_argument('--event-rate', default=0.0, type=float, help='Events per second the analysis reports')
+    parser.add_argument('--seed', default=0, type=int, help='Seed of the synthetic spectrum contents')
+    parser.add_argument('--latency', default=0.0, type=float, help='Seconds every request is delayed')
+    parser.add_argument('--jitter', default=0.0, type=float, help='Up to this many more seconds are added at random')
+    parser.add_argument('--delay', default=[], type=_delay, action='append', metavar='PATTERN=SECONDS',
+        help='Delay requests matching a glob pattern (e.g. "spectrum/*=0.05") instead of --latency')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Log each request to stderr')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    state = MockState(args.program, args.display_megabytes, args.seed, args.event_rate)
+    start_time = time.monotonic()
+    state.populate(
+        args.parameters, args.spectra, args.conditions, args.variables, args.vectors, args.waveforms, args.counts
+    )
+    server = MockServer((args.host, args.port), state, args.latency, args.jitter, args.delay, args.verbose)
+    print(
+        f'Mock {args.program} listening on {args.host}:{server.server_address[1]} '
+        f'({len(state.parameters)} parameters, {len(state.spectra)} spectra made in '
+        f'{time.monotonic() - start_time:.1f} seconds)', file=sys.stderr, flush=True
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
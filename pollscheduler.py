@@ -0,0 +1,277 @@
+'''
+This module provides the one scheduler for periodic server work in the GUI.
+Rather than each component running its own QTimer and making its own requests,
+components register jobs with a PollScheduler:
+
+    job = scheduler.register('rates', callback, period=1.0, priority=LOW,
+                             requests=['shmem/variables', 'specstats'])
+
+*  Requests are named REST fetches (add_request).  The fetches are made on worker
+   threads and the results are cached.  If several jobs need the same request,
+   one fetch feeds them all:  a job is satisfied by a cached result that is no older
+   than its max_staleness (default half its period) and a fetch already in flight
+   is never repeated.  A result's age counts from when its fetch started so a job
+   with max_staleness 0 only sees data fetched after it became due.  The callback
+   is called in the GUI thread with a dict of request name -> result.
+*  Jobs without requests just have callback() called in the GUI thread.
+*  Backpressure: at most max_in_flight fetches are outstanding; when that many
+   are, only HIGH priority jobs can start more.  The period of each job is also
+   stretched so that it is at least LOAD_FACTOR times the measured latency of its
+   requests - a slow server gets polled less.
+*  While the main window is hidden or minimized (see WindowWatcher) LOW
+   priority jobs are paused.
+
+get_scheduler returns the GUI's scheduler (see set_scheduler).
+'''
+import concurrent.futures
+import time
+import traceback
+
+from PyQt5.QtCore import QObject, QTimer, QEvent, pyqtSignal
+
+import capabilities
+
+HIGH = 0                 # Never paused (e.g. cluster processing).
+NORMAL = 1
+LOW = 2                  # Paused when the GUI is not visible (e.g. displays).
+
+TICK = 100               # ms between scheduling passes.
+MAX_IN_FLIGHT = 2        # Outstanding fetches before backpressure applies.
+LOAD_FACTOR = 4          # Poll no more often than this times the request latency.
+SMOOTHING = 0.3          # Weight of the newest latency in its moving average.
+
+_scheduler = None
+
+def set_scheduler(scheduler):
+    global _scheduler
+    _scheduler = scheduler
+
+def get_scheduler():
+    ''' The GUI's scheduler, created on first use for capabilities.get_client() '''
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = PollScheduler(capabilities.get_client())
+    return _scheduler
+
+class Job:
+    '''
+    A registered job (returned by PollScheduler.register).
+    Methods:
+       set_period - change the period (seconds).
+       run_now    - make the job due at the next scheduling pass.
+       pause, resume - stop/restart running the job.
+       cancel     - remove the job from the scheduler.
+    '''
+    def __init__(self, scheduler, name, callback, period, priority, max_staleness, requests, errback):
+        self.name = name
+        self.callback = callback
+        self.errback = errback
+        self.priority = priority
+        self.requests = tuple(requests)
+        self.period = period
+        self._staleness = max_staleness
+        self.due = 0.0                 # Run at the first pass.
+        self.requested = None          # When we started waiting for requests.
+        self.paused = False
+        self._scheduler = scheduler
+
+    def max_staleness(self):
+        return self._staleness if self._staleness is not None else self.period/2
+
+    def set_period(self, seconds):
+        if self.requested is None:
+            self.due = self.due - self.period + seconds
+        self.period = seconds
+
+    def run_now(self):
+        if self.requested is None:
+            self.due = 0.0
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def cancel(self):
+        self._scheduler.unregister(self)
+
+class PollScheduler(QObject):
+    '''
+    Runs registered jobs (see module comments).
+      *  client - REST client; if not None, the requests 'shmem/variables'
+                  (shmem_getvariables) and 'specstats' (get_statistics) are added.
+      *  tick   - ms between scheduling passes.
+      *  max_in_flight - see module comments.
+    '''
+    _fetched = pyqtSignal(str, object, object, float, float)  # name, result, exception, start, latency.
+
+    def __init__(self, client=None, tick=TICK, max_in_flight=MAX_IN_FLIGHT, *args):
+        super().__init__(*args)
+        self._fetches = dict()            # request name -> callable.
+        self._cache = dict()              # request name -> (time, result, exception).
+        self._latency = dict()            # request name -> smoothed seconds.
+        self._in_flight = set()
+        self._max_in_flight = max(1, max_in_flight)
+        self._jobs = list()
+        self._visible = True
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self._max_in_flight + 1)
+        self._fetched.connect(self._completed)
+        if client is not None:
+            self.add_request('shmem/variables', client.shmem_getvariables)
+            self.add_request('specstats', client.get_statistics)
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self._run)
+        self._timer.start(tick)
+
+    def add_request(self, name, fetch):
+        ''' Register a shared request; fetch() is called on a worker thread. '''
+        self._fetches[name] = fetch
+
+    def has_request(self, name):
+        return name in self._fetches
+
+    def remove_request(self, name):
+        ''' Remove a request (no registered job may still need it). '''
+        self._fetches.pop(name, None)
+        self._cache.pop(name, None)
+        self._latency.pop(name, None)
+
+    def register(self, name, callback, period, priority=NORMAL, max_staleness=None,
+                 requests=(), errback=None, delay=0.0):
+        '''
+        Register a periodic job.
+        *  name - for diagnostics.
+        *  callback - callback(results) if there are requests, else callback().
+        *  period - seconds between runs.
+        *  priority - HIGH, NORMAL or LOW.
+        *  max_staleness - seconds old a cached result can be and still be used
+                           (default period/2).
+        *  requests - names of the requests the job needs.
+        *  errback - If not None called with the exception if a request or
+                     the callback fails.  Otherwise the traceback is printed.
+        *  delay - seconds until the first run.
+        Returns the Job.
+        '''
+        for request in requests:
+            if request not in self._fetches:
+                raise KeyError(f'No request named {request} has been added to the scheduler')
+        job = Job(self, name, callback, period, priority, max_staleness, requests, errback)
+        job.due = time.monotonic() + delay
+        self._jobs.append(job)
+        self._jobs.sort(key=lambda j: j.priority)
+        return job
+
+    def unregister(self, job):
+        if job in self._jobs:
+            self._jobs.remove(job)
+
+    def set_visible(self, visible):
+        ''' LOW priority jobs run only while visible '''
+        self._visible = visible
+
+    def latency(self, request):
+        ''' Smoothed latency of a request (seconds) or None if never fetched '''
+        return self._latency.get(request)
+
+    def stop(self):
+        self._timer.stop()
+        self._pool.shutdown(wait=False)
+
+    # Private methods:
+
+    def _period(self, job):
+        # The job's period stretched for slow requests.
+        latencies = [self._latency.get(r, 0.0) for r in job.requests]
+        return max([job.period] + [LOAD_FACTOR * l for l in latencies])
+
+    def _runnable(self, job):
+        return not job.paused and (self._visible or job.priority != LOW)
+
+    def _run(self):
+        # A scheduling pass: start due jobs, fetching what they need.
+        now = time.monotonic()
+        for job in list(self._jobs):
+            if not self._runnable(job):
+                continue
+            if job.requested is None:
+                if now < job.due:
+                    continue
+                job.requested = now
+            missing = [r for r in job.requests if not self._fresh(r, job)]
+            if len(missing) == 0:
+                self._deliver(job, now)
+            else:
+                for request in missing:
+                    self._fetch(request, job.priority)
+
+    def _fresh(self, request, job):
+        entry = self._cache.get(request)
+        return entry is not None and entry[0] >= job.requested - job.max_staleness()
+
+    def _fetch(self, request, priority):
+        if request in self._in_flight:
+            return                                  # Coalesce.
+        if len(self._in_flight) >= self._max_in_flight and priority != HIGH:
+            return                                  # Backpressure - try again next pass.
+        self._in_flight.add(request)
+        self._pool.submit(self._do_fetch, request)
+
+    def _do_fetch(self, request):
+        # Worker thread:
+        start = time.monotonic()
+        try:
+            result = self._fetches[request]()
+            error = None
+        except Exception as e:
+            result = None
+            error = e
+        self._fetched.emit(request, result, error, start, time.monotonic() - start)
+
+    def _completed(self, request, result, error, start, latency):
+        # GUI thread: cache the result and run the jobs it completes.
+        # The result is as old as the time the fetch started.
+        self._in_flight.discard(request)
+        if request not in self._fetches:
+            return                                  # Removed while in flight.
+        before = self._latency.get(request)
+        self._latency[request] = latency if before is None else SMOOTHING*latency + (1.0 - SMOOTHING)*before
+        now = time.monotonic()
+        self._cache[request] = (start, result, error)
+        for job in list(self._jobs):
+            if job.requested is not None and request in job.requests and self._runnable(job):
+                if all([self._fresh(r, job) for r in job.requests]):
+                    self._deliver(job, now)
+
+    def _deliver(self, job, now):
+        job.requested = None
+        job.due = now + self._period(job)
+        try:
+            if len(job.requests) == 0:
+                job.callback()
+                return
+            errors = [self._cache[r][2] for r in job.requests if self._cache[r][2] is not None]
+            if len(errors) > 0:
+                raise errors[0]
+            job.callback({r: self._cache[r][1] for r in job.requests})
+        except Exception as e:
+            if job.errback is not None:
+                job.errback(e)
+            else:
+                traceback.print_exc()
+
+class WindowWatcher(QObject):
+    '''
+    Event filter that tells a scheduler whether a window is visible:
+       watcher = WindowWatcher(main, scheduler)
+    '''
+    def __init__(self, window, scheduler):
+        super().__init__(window)
+        self._window = window
+        self._scheduler = scheduler
+        window.installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if event.type() in (QEvent.Show, QEvent.Hide, QEvent.WindowStateChange):
+            self._scheduler.set_visible(self._window.isVisible() and not self._window.isMinimized())
+        return False
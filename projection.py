@@ -0,0 +1,107 @@
+'''
+This module projects 2D spectra locally.  rustogramer_client.project makes a
+new spectrum in the server (which then has to be bound to be seen);  here the
+projection is computed from contents already in hand - fetched with
+spectrumcontents or a dense array e.g. memory mapped by spectrumreader - so an
+X or Y profile can be looked at (and exported, see spectrumwriter.write_local)
+without creating anything in the server.
+
+Projections can be restricted:
+
+*  contour - to the channels inside a condition (as from condition_list) that
+   gatepreview can evaluate on the spectrum (contours, bands, slices).
+*  limits  - to a (low, high) range of the axis projected away (a band
+   limited projection e.g. a Y profile of an X peak).
+
+The result is a 1D spectrum definition and its contents so it can be treated
+like any other spectrum.  Nothing here depends on Qt.
+'''
+import numpy as np
+
+import gatepreview
+import spectrumcontents
+
+def project(array, xaxis, yaxis, direction, mask=None, limits=None):
+    '''
+    Project a dense (ybins, xbins) array.
+    *  direction - 'x' (onto the x axis, summing the y bins) or 'y'.
+    *  mask  - If not None a boolean (ybins, xbins) array of the channels to include.
+    *  limits - If not None (low, high) of the axis summed over;  only bins with centers
+                in [low, high] are included.
+    Returns (values, axis) where axis is the axis dict of the projection.
+    '''
+    array = np.asarray(array, dtype=np.float64)
+    if mask is not None:
+        array = np.where(mask, array, 0.0)
+    if direction == 'x':
+        (summed_axis, result_axis, sum_over) = (yaxis, xaxis, 0)
+    elif direction == 'y':
+        (summed_axis, result_axis, sum_over) = (xaxis, yaxis, 1)
+    else:
+        raise ValueError(f"Projection direction must be 'x' or 'y' not {direction}")
+    if limits is not None:
+        (low, high) = limits
+        centers = gatepreview.bin_centers(summed_axis)
+        keep = (centers >= low) & (centers <= high)
+        array = array[keep, :] if sum_over == 0 else array[:, keep]
+    return (array.sum(axis=sum_over), dict(result_axis))
+
+def projection_definition(definition, name, direction):
+    '''
+    The definition of the 1D spectrum that is the projection of 'definition' in
+    'direction'.  Its parameters are those of the projected axis.
+    '''
+    if direction == 'x':
+        axis = definition['xaxis']
+        parameters = definition.get('xparameters', definition.get('parameters', [])[:1])
+    else:
+        axis = definition['yaxis']
+        parameters = definition.get('yparameters', definition.get('parameters', [])[1:2])
+    return {
+        'name': name, 'type': '1', 'parameters': list(parameters),
+        'xparameters': list(parameters), 'yparameters': [],
+        'xaxis': dict(axis), 'yaxis': None, 'chantype': 'f64', 'gate': None
+    }
+
+def project_spectrum(definition, contents, direction, name=None, contour=None, limits=None):
+    '''
+    Project a 2D spectrum's contents.
+    *  definition, contents - the spectrum (contents as from spectrumcontents).
+    *  direction - 'x' or 'y'.
+    *  name - Name of the projection, default <spectrum>_px or <spectrum>_py.
+    *  contour - If not None, a condition (condition_list entry) restricting the projection.
+    *  limits - see project.
+    Returns (definition, contents) of the projection.  ValueError is raised if the
+    spectrum isn't 2D or the condition can't be evaluated on it.
+    '''
+    xaxis = definition['xaxis']
+    yaxis = definition.get('yaxis')
+    if xaxis is None or yaxis is None or len(yaxis) == 0:
+        raise ValueError(f"{definition['name']} is not a 2D spectrum")
+    if name is None:
+        name = f"{definition['name']}_p{direction}"
+    dense = spectrumcontents.to_dense(contents, xaxis['bins'], yaxis['bins'])
+    mask = None
+    if contour is not None:
+        mask = gatepreview.condition_mask(contour, definition)
+    (values, _) = project(dense, xaxis, yaxis, direction, mask, limits)
+    return (
+        projection_definition(definition, name, direction),
+        spectrumcontents.from_dense(name, values)
+    )
+
+def fetch_projection(client, spectrum, direction, name=None, contour=None, limits=None):
+    '''
+    Fetch a spectrum (and the contour condition if a name is given) and project it.
+    Returns (definition, contents) as project_spectrum.
+    '''
+    definitions = [d for d in client.spectrum_list(spectrum)['detail'] if d['name'] == spectrum]
+    if len(definitions) == 0:
+        raise ValueError(f'No spectrum named {spectrum}')
+    if isinstance(contour, str):
+        conditions = [c for c in client.condition_list(contour)['detail'] if c['name'] == contour]
+        if len(conditions) == 0:
+            raise ValueError(f'No condition named {contour}')
+        contour = conditions[0]
+    contents = spectrumcontents.fetch_contents(client, definitions[0])
+    return project_spectrum(definitions[0], contents, direction, name, contour, limits)
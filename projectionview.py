@@ -0,0 +1,76 @@
+'''
+This module provides a dialog that shows a locally computed projection (see
+projection) and lets it be exported to a file (see spectrumwriter.write_local)
+without the projection ever being made in the server.
+
+    +-----------------------------------------------+
+    |  plot of the projection                       |
+    |                                               |
+    |  Format: [ascii v]  [Export...]      [Close]  |
+    +-----------------------------------------------+
+'''
+import os
+
+from PyQt5.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QPushButton, QFileDialog,
+    QMessageBox
+)
+
+import matplotlib
+matplotlib.use('Qt5Agg')
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+from matplotlib.figure import Figure
+
+import gatepreview
+import spectrumcontents
+import spectrumwriter
+
+class ProjectionDialog(QDialog):
+    '''
+    Shows a projection.
+      *  definition, contents - the projection as from projection.project_spectrum.
+    '''
+    def __init__(self, definition, contents, *args):
+        super().__init__(*args)
+        self._definition = definition
+        self._contents = contents
+        self.setWindowTitle(definition['name'])
+
+        layout = QVBoxLayout()
+        figure = Figure()
+        self._canvas = FigureCanvasQTAgg(figure)
+        layout.addWidget(self._canvas)
+        axis = definition['xaxis']
+        values = spectrumcontents.to_dense(contents, axis['bins'])
+        plot = figure.add_subplot(111)
+        plot.step(gatepreview.bin_centers(axis), values, where='mid')
+        plot.set_xlabel(', '.join(definition['parameters']))
+        plot.set_title(f"{definition['name']}: {values.sum():g} counts")
+
+        controls = QHBoxLayout()
+        controls.addWidget(QLabel('Format:', self))
+        self._format = QComboBox(self)
+        self._format.addItems(spectrumwriter.supported_formats())
+        controls.addWidget(self._format)
+        self._export = QPushButton('Export...', self)
+        controls.addWidget(self._export)
+        controls.addStretch(1)
+        self._close = QPushButton('Close', self)
+        controls.addWidget(self._close)
+        layout.addLayout(controls)
+        self.setLayout(layout)
+
+        self._export.clicked.connect(self._write)
+        self._close.clicked.connect(self.accept)
+
+    def _write(self):
+        format = self._format.currentText()
+        filename = QFileDialog.getSaveFileName(
+            self, 'Export projection', os.getcwd(), spectrumwriter.file_filter(format)
+        )[0]
+        if filename == '':
+            return
+        try:
+            spectrumwriter.write_local(filename, format, [(self._definition, self._contents)])
+        except Exception as e:
+            QMessageBox.warning(self, 'Export failed', f'Unable to write {filename}: {e}')
@@ -0,0 +1,177 @@
+'''
+This module provides the sampling side of the Rates tab (see rateview).
+The histogramer is polled for:
+
+*  shmem_getvariables - BuffersAnalyzed (items analyzed so far), LastSequence
+   (sequence number of the most recent item seen) and RunState.  For SpecTcl,
+   BuffersAnalyzed/LastSequence is the fraction of the data analyzed online.
+   Rustogramer reports '-undefined-' for most of these; they are then NaN.
+*  get_statistics - per spectrum overflow and underflow counters.  Their
+   increments give per spectrum rates.
+
+Samples are stored in fixed size RingBuffer objects so the cost of a sample
+(and the memory used) does not depend on how long the monitor has been
+running.  Nothing here depends on Qt.
+'''
+import math
+import time
+
+import numpy as np
+
+DEFAULT_CAPACITY = 600           # Samples kept (e.g. 10 minutes at 1/sec).
+
+class RingBuffer:
+    '''
+    Fixed capacity history of samples.  Each sample is a row of 'columns'
+    values.  Appending overwrites the oldest row once the buffer is full.
+    '''
+    def __init__(self, capacity=DEFAULT_CAPACITY, columns=1, dtype=np.float64):
+        self._data = np.full((capacity, columns), np.nan, dtype=dtype)
+        self._next = 0
+        self._count = 0
+
+    def capacity(self):
+        return self._data.shape[0]
+
+    def __len__(self):
+        return self._count
+
+    def append(self, row):
+        self._data[self._next] = row
+        self._next = (self._next + 1) % self._data.shape[0]
+        self._count = min(self._count + 1, self._data.shape[0])
+
+    def last(self):
+        ''' The most recent row or None if empty '''
+        if self._count == 0:
+            return None
+        return self._data[self._next - 1]
+
+    def values(self):
+        '''
+        Returns the samples oldest first as a (len, columns) array.  If the buffer
+        has not wrapped this is a view, otherwise a copy.
+        '''
+        if self._count < self._data.shape[0]:
+            return self._data[:self._count]
+        return np.concatenate((self._data[self._next:], self._data[:self._next]))
+
+    def clear(self):
+        self._data[:] = np.nan
+        self._next = 0
+        self._count = 0
+
+class RateSampler:
+    '''
+    Samples the histogramer's counters and computes rates.
+      *  client   - REST client.
+      *  capacity - Number of samples kept.
+      *  spectra  - glob pattern of spectra whose statistics are sampled; None
+                    to skip the per spectrum rates (one less request per sample).
+    The history (see history()) has the columns named by COLUMNS.
+    '''
+    COLUMNS = ('time', 'analyzed', 'sequence', 'event_rate', 'online_fraction', 'spectrum_rate')
+
+    def __init__(self, client, capacity=DEFAULT_CAPACITY, spectra='*'):
+        self._client = client
+        self._spectra = spectra
+        self._history = RingBuffer(capacity, len(self.COLUMNS))
+        self._previous = None             # (time, analyzed) of the last sample.
+        self._counts = dict()             # spectrum -> last statistics total.
+        self._spectrum_rates = dict()     # spectrum -> last increment rate.
+        self._run_state = None
+
+    def sample(self, now=None, variables=None, statistics=None):
+        '''
+        Poll the histogramer once and append a row to the history.
+        variables and statistics are the responses of shmem_getvariables and
+        get_statistics if they were already fetched (e.g. by pollscheduler),
+        otherwise they are fetched here.
+        Returns the row as a dict keyed by COLUMNS.
+        '''
+        if now is None:
+            now = time.monotonic()
+        if variables is None:
+            variables = self._client.shmem_getvariables()
+        variables = variables['detail']
+        analyzed = _number(variables.get('BuffersAnalyzed'))
+        sequence = _number(variables.get('LastSequence'))
+        self._run_state = variables.get('RunState')
+
+        event_rate = math.nan
+        if self._previous is not None and now > self._previous[0]:
+            (then, before) = self._previous
+            if analyzed >= before:        # Otherwise counters were reset by an attach.
+                event_rate = (analyzed - before)/(now - then)
+        online = analyzed/sequence if sequence > 0 else math.nan
+
+        spectrum_rate = math.nan
+        if self._spectra is not None:
+            spectrum_rate = self._sample_spectra(now, statistics)
+        self._previous = (now, analyzed)
+
+        row = (now, analyzed, sequence, event_rate, online, spectrum_rate)
+        self._history.append(row)
+        return dict(zip(self.COLUMNS, row))
+
+    def history(self):
+        ''' Returns the (samples, len(COLUMNS)) array of samples oldest first '''
+        return self._history.values()
+
+    def column(self, name):
+        ''' Returns one column of the history by name (see COLUMNS) '''
+        return self.history()[:, self.COLUMNS.index(name)]
+
+    def spectrum_rates(self):
+        ''' dict of spectrum name -> increments/sec at the last sample (NaN if unknown) '''
+        return dict(self._spectrum_rates)
+
+    def run_state(self):
+        return self._run_state
+
+    def reset(self):
+        ''' Forget the history e.g. when a new data source is attached '''
+        self._history.clear()
+        self._previous = None
+        self._counts = dict()
+        self._spectrum_rates = dict()
+
+    # Private methods:
+
+    def _sample_spectra(self, now, statistics):
+        # Update the per spectrum rates from the statistics and return their sum.
+        if statistics is None:
+            statistics = self._client.get_statistics(self._spectra)
+        statistics = statistics['detail']
+        dt = now - self._previous[0] if self._previous is not None else 0.0
+        counts = dict()
+        rates = dict()
+        for s in statistics:
+            name = s['name']
+            total = _total(s.get('overflows')) + _total(s.get('underflows'))
+            counts[name] = total
+            before = self._counts.get(name)
+            if before is None or dt <= 0 or total < before:
+                rates[name] = math.nan
+            else:
+                rates[name] = (total - before)/dt
+        self._counts = counts
+        self._spectrum_rates = rates
+        known = [r for r in rates.values() if not math.isnan(r)]
+        return sum(known) if len(known) > 0 else math.nan
+
+def _number(value):
+    # Value as a float, NaN if it's not a number (e.g. '-undefined-').
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+def _total(counters):
+    # Statistics counters are a number or a list (one per axis).
+    if counters is None:
+        return 0
+    if isinstance(counters, (list, tuple)):
+        return sum([_total(c) for c in counters])
+    value = _number(counters)
+    return 0 if math.isnan(value) else value
@@ -0,0 +1,193 @@
+'''
+This module provides the Rates tab.  It shows the history of the event
+rate and of the fraction of the data analyzed online along with a table of
+per spectrum increment rates.  The sampling is done by ratemonitor.RateSampler.
+
+*  RatesTab is the view.
+*  RatesController samples with a pollscheduler job.  The REST requests are
+   shared with other jobs that need them and are made on the scheduler's
+   worker threads so a slow server does not stall the GUI.
+
+The plot lines are created once and only their data are replaced on each
+sample so plotting cost is bounded by the ring buffer capacity.
+'''
+import math
+
+import numpy as np
+from PyQt5.QtWidgets import (
+    QWidget, QVBoxLayout, QHBoxLayout, QLabel, QSpinBox, QCheckBox,
+    QTableWidget, QTableWidgetItem
+)
+from PyQt5.QtCore import QObject, pyqtSignal
+
+import matplotlib
+matplotlib.use('Qt5Agg')
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+from matplotlib.figure import Figure
+
+import pollscheduler
+import ratemonitor
+
+DEFAULT_INTERVAL = 1             # Seconds between samples.
+
+class RatePlot(FigureCanvasQTAgg):
+    '''
+    Two stacked plots vs. time: event rate and fraction analyzed online.
+    Methods:
+       update_history - replace the plotted data.
+    '''
+    def __init__(self, parent=None):
+        self._fig = Figure()
+        super().__init__(self._fig)
+        self.setParent(parent)
+        self._rate_axis = self._fig.add_subplot(211)
+        self._rate_axis.set_ylabel('Events/s')
+        self._fraction_axis = self._fig.add_subplot(212, sharex=self._rate_axis)
+        self._fraction_axis.set_ylabel('Online fraction')
+        self._fraction_axis.set_xlabel('Seconds')
+        self._fraction_axis.set_ylim(0, 1.05)
+        (self._rate_line,) = self._rate_axis.plot([], [])
+        (self._fraction_line,) = self._fraction_axis.plot([], [])
+
+    def update_history(self, times, rates, fractions):
+        '''
+        times - sample times (seconds), plotted relative to the most recent.
+        rates, fractions - the values at those times (NaN values leave gaps).
+        '''
+        if len(times) == 0:
+            return
+        t = times - times[-1]
+        self._rate_line.set_data(t, rates)
+        self._fraction_line.set_data(t, fractions)
+        self._rate_axis.set_xlim(min(t[0], -1), 0)
+        finite = rates[~np.isnan(rates)]
+        top = finite.max() if len(finite) > 0 else 0
+        self._rate_axis.set_ylim(0, top*1.1 if top > 0 else 1)
+        self.draw_idle()
+
+class RatesTab(QWidget):
+    '''
+    The rates tab.
+    Methods:
+       set_status  - Set the text of the status line (latest values).
+       update_history - Update the plots (see RatePlot.update_history).
+       set_spectrum_rates - Load the per spectrum rate table.
+       interval, enabled - The sampling settings.
+    Signals:
+       settings_changed - The sampling interval or enable was changed.
+    '''
+    settings_changed = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        layout = QVBoxLayout()
+
+        controls = QHBoxLayout()
+        self._enable = QCheckBox('Sample', self)
+        self._enable.setChecked(True)
+        controls.addWidget(self._enable)
+        controls.addWidget(QLabel('every', self))
+        self._interval = QSpinBox(self)
+        self._interval.setRange(1, 3600)
+        self._interval.setValue(DEFAULT_INTERVAL)
+        self._interval.setSuffix(' s')
+        controls.addWidget(self._interval)
+        self._status = QLabel('', self)
+        controls.addWidget(self._status, 1)
+        layout.addLayout(controls)
+
+        self._plot = RatePlot(self)
+        layout.addWidget(self._plot, 2)
+
+        self._table = QTableWidget(0, 2, self)
+        self._table.setHorizontalHeaderLabels(['Spectrum', 'Over/underflows/s'])
+        self._table.setSortingEnabled(True)
+        layout.addWidget(self._table, 1)
+
+        self.setLayout(layout)
+
+        self._enable.stateChanged.connect(self.settings_changed)
+        self._interval.valueChanged.connect(self.settings_changed)
+
+    def interval(self):
+        return self._interval.value()
+
+    def enabled(self):
+        return self._enable.isChecked()
+
+    def set_status(self, text):
+        self._status.setText(text)
+
+    def update_history(self, times, rates, fractions):
+        self._plot.update_history(times, rates, fractions)
+
+    def set_spectrum_rates(self, rates):
+        ''' rates - dict of spectrum name -> rate '''
+        self._table.setSortingEnabled(False)
+        self._table.setRowCount(len(rates))
+        for (row, name) in enumerate(sorted(rates.keys())):
+            self._table.setItem(row, 0, QTableWidgetItem(name))
+            value = QTableWidgetItem()
+            rate = rates[name]
+            value.setData(0, 0.0 if math.isnan(rate) else float(rate))   # Qt.DisplayRole sorts numerically.
+            self._table.setItem(row, 1, value)
+        self._table.setSortingEnabled(True)
+
+class RatesController(QObject):
+    '''
+    Samples the histogramer into a ratemonitor.RateSampler and updates the view.
+      *  view   - RatesTab.
+      *  client - REST client.
+      *  scheduler - pollscheduler.PollScheduler (default the GUI's).
+    Sampling is a LOW priority scheduler job.  It only runs while enabled in the
+    view and (via set_visible) while the tab is visible.
+    '''
+    def __init__(self, view, client, capacity=ratemonitor.DEFAULT_CAPACITY, scheduler=None):
+        super().__init__()
+        self._view = view
+        self._sampler = ratemonitor.RateSampler(client, capacity)
+        if scheduler is None:
+            scheduler = pollscheduler.get_scheduler()
+        self._visible = True
+        self._job = scheduler.register(
+            'rates', self._show, self._view.interval(), pollscheduler.LOW,
+            requests=('shmem/variables', 'specstats'), errback=self._failed
+        )
+        self._view.settings_changed.connect(self._configure)
+        self._configure()
+
+    def set_visible(self, visible):
+        ''' Stop sampling while the tab is not shown '''
+        self._visible = visible
+        self._configure()
+
+    # Private methods:
+
+    def _configure(self):
+        self._job.set_period(self._view.interval())
+        if self._view.enabled() and self._visible:
+            self._job.resume()
+        else:
+            self._job.pause()
+
+    def _show(self, results):
+        latest = self._sampler.sample(
+            variables=results['shmem/variables'], statistics=results['specstats']
+        )
+        self._view.set_status(_format(latest, self._sampler.run_state()))
+        self._view.update_history(
+            self._sampler.column('time'), self._sampler.column('event_rate'),
+            self._sampler.column('online_fraction')
+        )
+        self._view.set_spectrum_rates(self._sampler.spectrum_rates())
+
+    def _failed(self, e):
+        self._view.set_status(f'Sampling failed: {e}')
+
+def _format(latest, state):
+    text = f'Run state: {state}'
+    if not math.isnan(latest['event_rate']):
+        text += f'  {latest["event_rate"]:.1f} events/s'
+    if not math.isnan(latest['online_fraction']):
+        text += f'  {latest["online_fraction"]*100:.1f}% analyzed online'
+    return text
@@ -0,0 +1,613 @@
+'''
+This module provides a dependency aware, parallel, engine for restoring
+definitions (e.g. those read by DefinitionIO.DefinitionReader) into a server.
+
+Restoration is described as a set of steps.  Each step is a single
+(usually one REST request) operation on a single named item; e.g. create
+the spectrum 'george'.  Steps are organized into levels that reflect the
+dependencies between definitions:
+
+*  Preparation (e.g. ungate or delete existing spectra).
+*  Parameters (spectra and conditions need these).
+*  Spectra and conditions that depend on no other condition.
+*  Spectrum channel contents (if saved).
+*  Conditions that depend on the conditions in the prior level (repeated as
+   needed see DefinitionIO.condition_levels).
+*  Gate applications (these need both spectra and conditions).
+*  Tree variable values and shared memory bindings (if added).
+
+All of the steps in a level are run concurrently by a bounded pool of
+worker threads.  A level does not start until all steps in the prior level
+are done.  A step that fails does not stop the restore; its failure is
+recorded in the RestoreReport that run returns.  This gives a per item
+failure report rather than a single generic error.
+
+Nothing here depends on Qt so this can be used by non-graphical programs.
+A progress callback can be supplied to, e.g., update a progress dialog.
+
+The create_spectrum and create_condition functions turn a definition, as
+read from a definition file, into the appropriate client request.
+
+Large restores into SpecTcl are batched (see tclbatch):  steps that have a Tcl
+equivalent are run in chunks, each a single execute_tcl request, and the per
+command statuses it gives back are recorded in the report step by step just as
+if each step had been its own request.
+'''
+import functools
+
+import concurrent.futures
+import time
+
+import bulkapply
+import capabilities
+import DefinitionIO
+import spectrumcontents
+import tclbatch
+
+DEFAULT_WORKERS = 8            # Size of the worker pool.
+PROGRESS_INTERVAL = 0.1        # Seconds between progress callbacks.
+
+def channel_type(definition):
+    '''
+    The channel type string to make a spectrum definition with.  If interchanging
+    spectra between SpecTcl <--> Rustogramer the data type saved may not be
+    supported by the server;  the server's default is used then.
+    '''
+    dtype = definition['datatype']
+    if capabilities.DataTypeStringsToChannelTypes[dtype] not in \
+        capabilities.get_supported_channelTypes():
+        dtype = capabilities.ChannelTypesToDataTypeStrings[
+            capabilities.get_default_channelType()]
+    return dtype
+
+def create_spectrum(client, definition):
+    '''
+    Create a spectrum from its definition as read by
+    DefinitionIO.DefinitionReader.read_spectrum_defs.  If the spectrum type
+    is not supported by the server, ValueError is raised.  Errors from the
+    server are passed through as RustogramerException.
+    '''
+    name = definition['name']
+    stype = definition['type']
+    xaxis = definition['xaxis']
+    yaxis = definition['yaxis']
+
+    # If interchanging spectra between SpecTcl <--> Rustogramer we may need to
+    # massage the data type:
+
+    dtype = channel_type(definition)
+
+    if stype == '1' and capabilities.has_1d():
+        client.spectrum_create1d(
+            name, definition['xparameters'][0],
+            xaxis['low'], xaxis['high'], xaxis['bins'], dtype
+        )
+    elif stype == '2' and capabilities.has_2d():
+        client.spectrum_create2d(
+            name, definition['xparameters'][0], definition['yparameters'][0],
+            xaxis['low'], xaxis['high'], xaxis['bins'],
+            yaxis['low'], yaxis['high'], yaxis['bins'], dtype
+        )
+    elif stype == 'g1' and capabilities.has_gamma1d():
+        client.spectrum_createg1(
+            name, definition['parameters'],
+            xaxis['low'], xaxis['high'], xaxis['bins'], dtype
+        )
+    elif stype == 'g2' and capabilities.has_gamma2d():
+        client.spectrum_createg2(
+            name, definition['parameters'],
+            xaxis['low'], xaxis['high'], xaxis['bins'],
+            yaxis['low'], yaxis['high'], yaxis['bins'], dtype
+        )
+    elif stype == 'gd' and capabilities.has_pgamma():
+        client.spectrum_creategd(
+            name, definition['xparameters'], definition['yparameters'],
+            xaxis['low'], xaxis['high'], xaxis['bins'],
+            yaxis['low'], yaxis['high'], yaxis['bins'], dtype
+        )
+    elif stype == 's' and capabilities.has_summary():
+        # Axis definition...if there's a y axis we use it otherwise the X
+        # That may be a SpecTcl Rustogramer difference:
+        if yaxis is not None and len(yaxis) != 0:
+            axis = yaxis
+        else:
+            axis = xaxis
+        client.spectrum_createsummary(
+            name, definition['parameters'], axis['low'], axis['high'], axis['bins'], dtype
+        )
+    elif stype == 'm2' and capabilities.has_twod_sum():
+        # If there's no y parameters, then every other parameter in x/y is
+        # x,y
+        if definition['yparameters'] is None or len(definition['yparameters']) == 0:
+            xparams = definition['parameters'][::2]
+            yparams = definition['parameters'][1::2]
+        else:
+            xparams = definition['xparameters']
+            yparams = definition['yparameters']
+        client.spectrum_create2dsum(
+            name, xparams, yparams,
+            xaxis['low'], xaxis['high'], xaxis['bins'],
+            yaxis['low'], yaxis['high'], yaxis['bins'], dtype
+        )
+    elif stype == 'S' and capabilities.has_stripchart():
+        client.spectrum_createstripchart(
+            name, definition['xparameters'][0], definition['yparameters'][0],
+            xaxis['low'], xaxis['high'], xaxis['bins'], dtype
+        )
+    elif stype == 'b' and capabilities.has_bitmask():
+        client.spectrum_createbitmask(
+            name, definition['xparameters'][0], xaxis['bins'], dtype
+        )
+    else:
+        # Includes gs which we can't recover as the per channel parameter
+        # lists are not saved.
+        raise ValueError(f'Spectrum type {stype} is not supported by the server')
+
+def create_condition(client, cond):
+    '''
+    Create a condition from its definition as read by
+    DefinitionIO.DefinitionReader.read_condition_defs. If the condition type
+    is not supported by the server, ValueError is raised. Errors from the
+    server are passed through as RustogramerException.
+    '''
+    cname = cond['name']
+    ctype = cond['type']
+
+    if not capabilities.has_condition_name(ctype):
+        raise ValueError(f'Condition type {ctype} is not supported by the server')
+
+    if ctype == 'T':
+        client.condition_make_true(cname)
+    elif ctype == 'F':
+        client.condition_make_false(cname)
+    elif ctype == '-':
+        client.condition_make_not(cname, cond['dependencies'][0])
+    elif ctype == '*':
+        client.condition_make_and(cname, cond['dependencies'])
+    elif ctype == '+':
+        client.condition_make_or(cname, cond['dependencies'])
+    elif ctype == 's':
+        client.condition_make_slice(
+            cname, cond['parameters'][0],
+            cond['points'][0][0], cond['points'][1][0]
+        )
+    elif ctype== 'c':
+        client.condition_make_contour(
+            cname, cond['parameters'][0], cond['parameters'][1],
+            [{'x': x[0], 'y': x[1]} for x in cond['points']]
+        )
+    elif ctype== 'b':
+        client.condition_make_band(
+            cname, cond['parameters'][0], cond['parameters'][1],
+            [{'x': x[0], 'y': x[1]} for x in cond['points']]
+        )
+    elif ctype =='gs':
+        client.condition_make_gamma_slice(
+            cname, cond['parameters'],
+            cond['points'][0][0], cond['points'][1][0]
+        )
+    elif ctype == 'gc':
+        client.condition_make_gamma_contour(
+            cname, cond['parameters'],
+            [{'x': x[0], 'y': x[1]} for x in cond['points']]
+        )
+    elif ctype == 'gb':
+        client.condition_make_gamma_band(
+            cname, cond['parameters'],
+            [{'x': x[0], 'y': x[1]} for x in cond['points']]
+        )
+    elif ctype == 'em':
+        client.condition_make_mask_equal(
+            cname, cond['parameters'][0], cond['mask']
+        )
+    elif ctype == 'am':
+        client.condition_make_mask_and(
+            cname, cond['parameters'][0], cond['mask']
+        )
+    elif ctype =='nm':
+        client.condition_make_mask_nand(
+            cname, cond['parameters'][0], cond['mask']
+        )
+    else:
+        raise ValueError(f'Gate type {ctype} is not supported.')
+
+def update_parameter(client, definition, exists):
+    '''
+    Make a parameter match its definition as read by
+    DefinitionIO.DefinitionReader.read_parameter_defs.  If 'exists' is false, the
+    parameter is created first.  Only the non null metadata are modified.
+    '''
+    name = definition['name']
+    if not exists:
+        client.parameter_create(name, {})
+    mods = dict()
+    for key in ('low', 'high', 'bins', 'units'):
+        if definition.get(key) is not None:
+            mods[key] = definition[key]
+    if mods:
+        # Dicts are true if non-empty:
+        client.parameter_modify(name, mods)
+
+
+class RestoreStep:
+    '''
+    A single restore operation.
+    Attributes:
+       stage  - Human readable name of the stage e.g. 'spectrum'.
+       name   - Name of the item restored (e.g. the spectrum name).
+       action - Callable with no parameters that does the work. Exceptions
+                it raises are failures.
+       tcl    - The equivalent SpecTcl command (see tclbatch) or None if
+                there is none;  used when the restore is batched.
+    '''
+    def __init__(self, stage, name, action, tcl=None):
+        self.stage = stage
+        self.name = name
+        self.action = action
+        self.tcl = tcl
+
+class RestoreReport:
+    '''
+    Result of RestorePipeline.run:
+    Attributes:
+       total   - number of steps.
+       succeeded - number of steps that succeeded.
+       failures  - list of (stage, name, message) for steps that failed.
+       skipped   - Number of steps not run because the restore was cancelled.
+       elapsed   - Seconds the restore took.
+       stage_times - dict of stage name -> seconds spent on that stage:  for each
+                 level, the time from its start until the last step of the stage
+                 in it finished (stages sharing a level run concurrently).
+    '''
+    def __init__(self):
+        self.total = 0
+        self.succeeded = 0
+        self.failures = list()
+        self.skipped = 0
+        self.elapsed = 0.0
+        self.stage_times = dict()
+
+    def ok(self):
+        return len(self.failures) == 0 and self.skipped == 0
+
+    def rate(self):
+        ''' Steps per second overall '''
+        if self.elapsed > 0:
+            return (self.succeeded + len(self.failures)) / self.elapsed
+        return 0.0
+
+    def summary(self):
+        ''' Single line human readable summary: '''
+        return (f'{self.succeeded} of {self.total} items restored in {self.elapsed:.2f} seconds '
+                f'({self.rate():.1f} items/sec), {len(self.failures)} failed, {self.skipped} skipped')
+
+    def details(self):
+        ''' One line per failure: '''
+        return '\n'.join([f'{stage} {name}: {msg}' for (stage, name, msg) in self.failures])
+
+
+class RestorePipeline:
+    '''
+    Collects restore steps and runs them level by level.  The add_* methods
+    know the dependencies between definition types and place the steps in the
+    right level.
+
+    Typical use:
+        pipeline = RestorePipeline(client)
+        pipeline.add_parameters(reader.read_parameter_defs(), existing_parameter_names)
+        pipeline.add_spectra(reader.read_spectrum_defs(), existing_spectrum_names, True)
+        pipeline.add_conditions(reader.read_condition_defs())
+        pipeline.add_applications(reader.read_applications())
+        report = pipeline.run()
+    '''
+    def __init__(self, client, workers=DEFAULT_WORKERS, progress=None, batch=None):
+        '''
+        *  client - the REST client.
+        *  workers - Maximum number of concurrent requests.
+        *  progress - If not None, called as progress(stage, done, total, rate)
+           periodically from the thread that called run. 'stage' is a
+           description of the level being run, 'done' and 'total' count
+           steps and 'rate' is the overall step rate in steps/second.
+        *  batch - True to run steps with Tcl equivalents as execute_tcl scripts,
+           False not to, None (default) to decide with tclbatch.use_batches.
+        '''
+        self._client = client
+        self._workers = max(1, int(workers))
+        self._progress = progress
+        self._batch = batch
+        self._cancelled = False
+
+        self._prepare = list()
+        self._parameters = list()
+        self._spectra = list()
+        self._contents = list()
+        self._conditions = list()        # List of levels.
+        self._applications = list()
+        self._variables = list()
+        self._bindings = list()
+
+    def set_progress(self, progress):
+        ''' Replace the progress callback (see __init__). '''
+        self._progress = progress
+
+    # Adding steps:
+
+    def add_step(self, level, step):
+        '''
+        Add an arbitrary step.  'level' is one of 'prepare', 'parameters',
+        'spectra', 'contents', 'applications', 'variables' or 'bindings'.
+        '''
+        {
+            'prepare': self._prepare,
+            'parameters': self._parameters,
+            'spectra': self._spectra,
+            'contents': self._contents,
+            'applications': self._applications,
+            'variables': self._variables,
+            'bindings': self._bindings
+        }[level].append(step)
+
+    def add_ungate(self, names):
+        ''' Ungate the named spectra before anything else is done '''
+        if len(names) > 0:
+            self._prepare.append(RestoreStep(
+                'ungate', f'{len(names)} spectra',
+                lambda: self._client.ungate_spectrum(names), tclbatch.ungate_command(names)
+            ))
+
+    def add_spectrum_deletions(self, names):
+        ''' Delete the named spectra before any spectra are created '''
+        for name in names:
+            self._prepare.append(RestoreStep(
+                'delete', name, lambda n=name: self._client.spectrum_delete(n),
+                tclbatch.spectrum_delete_command(name)
+            ))
+
+    def add_parameters(self, definitions, existing):
+        '''
+        *  definitions - parameter definitions from DefinitionReader.read_parameter_defs.
+        *  existing - names of the parameters that already exist.
+        '''
+        existing = set(existing)
+        for p in definitions:
+            self._parameters.append(RestoreStep(
+                'parameter', p['name'],
+                lambda p=p, e=(p['name'] in existing): update_parameter(self._client, p, e)
+            ))
+
+    def add_spectra(self, definitions, existing, replace):
+        '''
+        *  definitions - spectrum definitions from DefinitionReader.read_spectrum_defs
+        *  existing - names of spectra that exist (and won't be deleted in preparation).
+        *  replace  - If true existing spectra are replaced by the definition, if false
+                      they are left alone.
+        Returns the names of the spectra that will be created.
+        '''
+        existing = set(existing)
+        created = list()
+        for spectrum in definitions:
+            name = spectrum['name']
+            tcl = tclbatch.spectrum_command(spectrum, channel_type(spectrum))
+            if name in existing:
+                if not replace:
+                    continue
+                if tcl is not None:
+                    tcl = tclbatch.spectrum_delete_command(name) + '\n' + tcl
+                self._spectra.append(RestoreStep(
+                    'spectrum', name, lambda s=spectrum: self._replace_spectrum(s), tcl
+                ))
+            else:
+                self._spectra.append(RestoreStep(
+                    'spectrum', name, lambda s=spectrum: create_spectrum(self._client, s), tcl
+                ))
+            created.append(name)
+        return created
+
+    def add_contents(self, contents, definitions):
+        '''
+        Restore spectrum channel contents once the spectra have been created.
+        *  contents - iterable of contents dicts as from
+           DefinitionIO.DefinitionReader.read_spectrum_contents.
+        *  definitions - the definitions of the spectra (as given to add_spectra);
+           they say if channels need one or two indices.
+        Each spectrum's channels are restored in batches (see spectrumcontents.batches)
+        so large spectra are filled concurrently.  Contents of spectra with no
+        definition are reported as failures.
+        '''
+        definitions = {d['name']: d for d in definitions}
+        for spectrum in contents:
+            name = spectrum['name']
+            if name not in definitions:
+                self._contents.append(RestoreStep('contents', name, functools.partial(_no_definition, name)))
+                continue
+            twod = spectrumcontents.is_twod(definitions[name])
+            for batch in spectrumcontents.batches(spectrum, twod):
+                self._contents.append(RestoreStep(
+                    'contents', name,
+                    lambda b=batch, t=twod: spectrumcontents.put_contents(self._client, b, t)
+                ))
+
+    def add_conditions(self, definitions):
+        '''
+        *  definitions -condition definitions from DefinitionReader.read_condition_defs
+        '''
+        levels = DefinitionIO.condition_levels(definitions, 'dependencies')
+        while len(self._conditions) < len(levels):
+            self._conditions.append(list())
+        for (i, level) in enumerate(levels):
+            for cond in level:
+                self._conditions[i].append(RestoreStep(
+                    'condition', cond['name'], lambda c=cond: create_condition(self._client, c),
+                    tclbatch.condition_command(cond)
+                ))
+
+    def add_applications(self, applications):
+        '''
+        *  applications - gate applications from DefinitionReader.read_applications.
+        Applications of the same gate are grouped into as few requests as the
+        server allows (see bulkapply).
+        '''
+        mapping = bulkapply.group_applications(applications)
+        for group in bulkapply.request_groups(mapping):
+            (gate, spectra) = group
+            name = f'{gate} -> {spectra[0]}' if len(spectra) == 1 else f'{gate} -> {len(spectra)} spectra'
+            self._applications.append(RestoreStep(
+                'application', name, lambda g=group: self._apply(g),
+                tclbatch.apply_command(gate, spectra)
+            ))
+
+    def add_variables(self, definitions):
+        '''
+        *  definitions - tree variables (name, value, units) as from treevariable_list.
+        '''
+        for var in definitions:
+            self._variables.append(RestoreStep(
+                'variable', var['name'],
+                lambda v=var: self._client.treevariable_set(v['name'], v['value'], v.get('units')),
+                tclbatch.treevariable_command(var['name'], var['value'], var.get('units'))
+            ))
+
+    def add_bindings(self, names):
+        '''
+        Bind the named spectra into shared memory once everything else is done.
+        '''
+        for name in names:
+            self._bindings.append(RestoreStep(
+                'binding', name, lambda n=name: self._client.sbind_spectra([n]),
+                tclbatch.sbind_command([name])
+            ))
+
+    # Running:
+
+    def levels(self):
+        '''
+        Return the list of (description, steps) levels in the order they will be run.
+        Empty levels are omitted.
+        '''
+        levels = [
+            ('Preparing', self._prepare),
+            ('Restoring parameters', self._parameters)
+        ]
+        first_conditions = list()
+        if len(self._conditions) > 0:
+            first_conditions = self._conditions[0]
+        levels.append(('Restoring spectra and conditions', self._spectra + first_conditions))
+        levels.append(('Restoring spectrum contents', self._contents))
+        for (i, level) in enumerate(self._conditions[1:]):
+            levels.append((f'Restoring compound conditions (level {i+1})', level))
+        levels.append(('Restoring gate applications', self._applications))
+        levels.append(('Restoring tree variables', self._variables))
+        levels.append(('Binding spectra', self._bindings))
+        return [x for x in levels if len(x[1]) > 0]
+
+    def cancel(self):
+        ''' Steps that have not yet started won't be run. '''
+        self._cancelled = True
+
+    def run(self):
+        '''
+        Run the steps level by level.  Returns a RestoreReport.
+        '''
+        report = RestoreReport()
+        levels = self.levels()
+        report.total = sum([len(x[1]) for x in levels])
+        batch = self._batch
+        if batch is None:
+            batch = tclbatch.use_batches(report.total)
+        start = time.monotonic()
+        done = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._workers) as pool:
+            for (description, steps) in levels:
+                if self._cancelled:
+                    report.skipped += len(steps)
+                    continue
+                level_start = time.monotonic()
+                finished = dict()
+                done = self._run_level(pool, description, steps, report, start, done, batch, finished)
+                for (stage, when) in finished.items():
+                    report.stage_times[stage] = report.stage_times.get(stage, 0.0) + when - level_start
+        report.elapsed = time.monotonic() - start
+        return report
+
+    # Private methods:
+
+    def _apply(self, group):
+        (gate, spectra) = group
+        result = bulkapply.apply_gates(self._client, {gate: spectra}, workers=1)
+        if not result.ok():
+            raise RuntimeError(f'{result.summary()}: {"; ".join(result.details().splitlines())}')
+
+    def _replace_spectrum(self, definition):
+        self._client.spectrum_delete(definition['name'])
+        create_spectrum(self._client, definition)
+
+    def _run_level(self, pool, description, steps, report, start, done, batch=False, finished=None):
+        # Run the steps in a level, returns the updated done count.
+        # If finished is not None it's a dict that gets stage -> time its last step finished.
+        # Work is fed to the pool no more than 2*workers units at a time so cancel
+        # is prompt and we don't queue thousands of futures.  A unit is a single
+        # step or, if batching, a chunk of steps with Tcl equivalents.
+
+        pending = dict()                  # future -> list of steps.
+        remaining = iter(self._units(steps, batch))
+        exhausted = False
+        total = report.total
+        while True:
+            while not exhausted and not self._cancelled and len(pending) < 2*self._workers:
+                unit = next(remaining, None)
+                if unit is None:
+                    exhausted = True
+                else:
+                    (unit_steps, action) = unit
+                    pending[pool.submit(action)] = unit_steps
+            if len(pending) == 0:
+                break
+            completed, _ = concurrent.futures.wait(
+                pending.keys(), timeout=PROGRESS_INTERVAL,
+                return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            now = time.monotonic()
+            for future in completed:
+                unit_steps = pending.pop(future)
+                done += len(unit_steps)
+                if finished is not None:
+                    for step in unit_steps:
+                        finished[step.stage] = now
+                try:
+                    results = future.result()
+                except Exception as e:
+                    for step in unit_steps:
+                        report.failures.append((step.stage, step.name, str(e)))
+                    continue
+                for (step, result) in zip(unit_steps, results):
+                    try:
+                        tclbatch.check(result)
+                        report.succeeded += 1
+                    except Exception as e:
+                        report.failures.append((step.stage, step.name, str(e)))
+            if self._progress is not None:
+                elapsed = time.monotonic() - start
+                rate = done/elapsed if elapsed > 0 else 0.0
+                self._progress(description, done, total, rate)
+        if self._cancelled and not exhausted:
+            report.skipped += sum([len(x[0]) for x in remaining])
+        return done
+
+    def _units(self, steps, batch):
+        # Generator of (steps, action) units of work;  action() returns one
+        # reply dict per step (see tclbatch.run_commands).
+
+        if batch:
+            scripted = [x for x in steps if x.tcl is not None]
+            steps = [x for x in steps if x.tcl is None]
+            for chunk in tclbatch.chunks(scripted, lambda x: x.tcl):
+                yield (chunk, functools.partial(tclbatch.run_commands, self._client, [x.tcl for x in chunk]))
+        for step in steps:
+            yield ([step], functools.partial(_run_step, step))
+
+def _no_definition(name):
+    raise ValueError(f'There is no definition of spectrum {name} for its contents')
+
+def _run_step(step):
+    step.action()
+    return [{'status': 'OK', 'detail': ''}]
@@ -0,0 +1,78 @@
+'''
+This module provides functions to take a snapshot of the definitions held by a
+histogramer and write it to a definition file (save set) with DefinitionIO.
+They are used by File->Save..., the autosave service, the cluster scheduler and
+the batch runner.  Nothing here depends on Qt.
+'''
+
+import hashlib
+import json
+import os
+
+import capabilities
+import DefinitionIO
+
+
+def snapshot_definitions(client, bindsets=None):
+    '''
+    Fetch the definitions that make up a save set from the server.
+
+    Parameters:
+    *  client - the REST client.
+    *  bindsets - Iterable of binding set dicts (see
+       bindingscontroller.BindingsController.fetchGroups) or None if there are none.
+
+    Returns a dict with the keys:
+    *  parameters - parameter_list()['detail']
+    *  spectra    - spectrum_list()['detail']
+    *  conditions - condition_list()['detail']
+    *  applications - apply_list()['detail']
+    *  variables  - treevariable_list()['detail'] (empty list if not SpecTcl).
+    *  bindsets   - the bindsets parameter (empty list if None).
+    '''
+    snapshot = {
+        'parameters': client.parameter_list()['detail'],
+        'spectra': client.spectrum_list()['detail'],
+        'conditions': client.condition_list()['detail'],
+        'applications': client.apply_list()['detail'],
+        'variables': list(),
+        'bindsets': list()
+    }
+    if capabilities.get_program() == capabilities.Program.SpecTcl:
+        snapshot['variables'] = client.treevariable_list()['detail']
+    if bindsets is not None:
+        snapshot['bindsets'] = list(bindsets)
+    return snapshot
+
+def snapshot_digest(snapshot):
+    '''
+    Returns a digest string of a snapshot from snapshot_definitions.  Two
+    snapshots with the same digest have the same definitions.
+    '''
+    text = json.dumps(snapshot, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def write_snapshot(filename, snapshot, contents=None):
+    '''
+    Write a snapshot from snapshot_definitions to a new definition file.
+    Any existing 'filename' is deleted first.  Exceptions from DefinitionIO are
+    passed on to the caller.
+    If not None, 'contents' is an iterable of spectrum contents to save as well
+    (see DefinitionIO.DefinitionWriter.save_spectrum_contents).
+    '''
+    try:
+        os.remove(filename)
+    except:
+        pass
+    saver = DefinitionIO.DefinitionWriter(filename)
+    try:
+        saver.save_parameter_definitions(snapshot['parameters'])
+        saver.save_spectrum_definitions(snapshot['spectra'])
+        saver.save_condition_definitions(snapshot['conditions'])
+        saver.save_gates(snapshot['applications'])
+        saver.save_variables(snapshot['variables'])
+        saver.save_binding_sets(snapshot['bindsets'])
+        if contents is not None:
+            saver.save_spectrum_contents(contents)
+    finally:
+        saver.close()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+'''
+spectcl-batch - Run SpecTcl/Rustogramer analyses without the GUI.
+
+This is intended for unattended (e.g. cron driven) replays on compute nodes.
+In order, and each step being optional, it:
+
+1.  Loads a definition file (as written by File->Save... or the autosave service)
+    into the histogramer.
+2.  Processes the event files in a cluster file.  With --fanout, the files are
+    dealt out to all histogramers advertised with a service name prefix and the
+    results are summed back into the histogramer named by --host/--port/--service.
+3.  Writes spectra to a local file (see spectrumwriter for the formats).
+
+When done, a JSON timing report is written to stdout (or --report) and the
+exit status is 0 if all went well, 1 if some definitions could not be
+restored and 2 if the run failed.
+
+The waiting is done by an event loop object with a run(step, interval) method
+that calls step() every interval seconds until it returns False.  SleepLoop
+and AsyncioLoop are provided (--loop); programs that embed BatchRunner can
+supply their own.  Nothing here depends on Qt.
+
+Example:
+   spectcl-batch -H node01 -s SpecTcl --definitions defs.sqlite \\
+        --cluster run23.clu --output run23.npz --format npz
+'''
+import argparse
+import asyncio
+import fnmatch
+import json
+import sys
+import time
+
+import capabilities
+import clusterpreflight
+import clusterscheduler
+import DefinitionIO
+import OsServices
+import restorepipeline
+import spectrumwriter
+from rustogramer_client import rustogramer as RestClient
+
+PORTMAN_PORT = 30000
+
+class SleepLoop:
+    ''' Event loop that just sleeps between steps '''
+    def run(self, step, interval):
+        while step():
+            time.sleep(interval)
+
+class AsyncioLoop:
+    ''' Event loop that runs the steps in an asyncio event loop '''
+    def run(self, step, interval):
+        async def _steps():
+            while step():
+                await asyncio.sleep(interval)
+        asyncio.run(_steps())
+
+loops = {'sleep': SleepLoop, 'asyncio': AsyncioLoop}
+
+class BatchRunner:
+    '''
+    Does the work of spectcl-batch.  Each method does one step and records its
+    timing in the report (see report()).
+      *  client - REST client of the histogramer.
+      *  loop   - Event loop object (see SleepLoop), defaults to SleepLoop().
+      *  log    - If not None, callable that's given progress messages.
+    '''
+    def __init__(self, client, loop=None, log=None):
+        self._client = client
+        self._loop = loop if loop is not None else SleepLoop()
+        self._log = log if log is not None else (lambda msg: None)
+        self._start = time.time()
+        self._phases = dict()
+        self._ok = True
+
+    def load_definitions(self, filename, replace=True, workers=restorepipeline.DEFAULT_WORKERS):
+        '''
+        Restore the definitions (and any saved spectrum contents) in a definition file.
+        If replace is False, spectra that already exist are left alone.  Saved tree
+        variables are restored into SpecTcl and replaced spectra that were bound are
+        bound again.
+        '''
+        start = time.monotonic()
+        reader = DefinitionIO.DefinitionReader(filename)
+        bound = set([b['name'] for b in self._client.sbind_list()['detail']])
+        pipeline = restorepipeline.RestorePipeline(self._client, workers)
+        pipeline.add_parameters(
+            reader.read_parameter_defs(), [p['name'] for p in self._client.parameter_list()['detail']]
+        )
+        spectra = reader.read_spectrum_defs()
+        created = pipeline.add_spectra(
+            spectra, [s['name'] for s in self._client.spectrum_list()['detail']], replace
+        )
+        if len(created) > 0 and reader.has_spectrum_contents():
+            pipeline.add_contents(reader.read_spectrum_contents(created), spectra)
+        pipeline.add_conditions(reader.read_condition_defs())
+        pipeline.add_applications(reader.read_applications())
+        variables = list()
+        if capabilities.get_program() == capabilities.Program.SpecTcl:
+            variables = reader.read_variables()
+            pipeline.add_variables(variables)
+        pipeline.add_bindings([x for x in created if x in bound])
+        self._log(f'Restoring definitions from {filename}')
+        report = pipeline.run()
+        if not report.ok():
+            self._ok = False
+        self._phases['definitions'] = {
+            'file': filename,
+            'seconds': time.monotonic() - start,
+            'items': report.total,
+            'restored': report.succeeded,
+            'variables': len(variables),
+            'rate': report.rate(),
+            'stage_seconds': report.stage_times,
+            'failures': [
+                {'stage': stage, 'name': name, 'error': msg} for (stage, name, msg) in report.failures
+            ]
+        }
+
+    def process_cluster(self, cluster_file, servers=None, interval=clusterscheduler.DEFAULT_POLL,
+            sort=None, dedupe=False, prefetch=False):
+        '''
+        Process the event files in cluster_file.  If servers is None our histogramer
+        does all the work.  Otherwise servers is a list of (name, client) (see
+        clusterscheduler.discover_servers); our definitions are pushed to them, the
+        files are shared out among them and the spectra are merged into our histogramer.
+        The files are first checked with clusterpreflight.preflight (sort and dedupe
+        are passed to it); if any can't be processed, RuntimeError is raised before
+        anything is started.  prefetch enables readahead of upcoming files.
+        '''
+        start = time.monotonic()
+        phase = {'file': cluster_file}
+        checks = clusterpreflight.preflight(
+            clusterscheduler.read_cluster_file(cluster_file, check=False), sort, dedupe
+        )
+        phase['preflight'] = {
+            'seconds': time.monotonic() - start,
+            'files': len(checks.files), 'bytes': checks.total_bytes(),
+            'duplicates': [f['name'] for f in checks.duplicates],
+            'errors': checks.errors, 'warnings': checks.warnings
+        }
+        self._phases['cluster'] = phase
+        if not checks.ok():
+            raise RuntimeError(f'{len(checks.errors)} event files in {cluster_file} cannot be processed')
+        sizes = dict(checks.sizes())
+        if servers is None:
+            servers = [(f'{self._client.host}:{self._client.port}', self._client)]
+            merge = False
+        else:
+            self._log(f'Pushing definitions to {len(servers)} histogramers')
+            reports = clusterscheduler.push_definitions(self._client, servers)
+            phase['push_seconds'] = time.monotonic() - start
+            phase['push_failures'] = {
+                name: report.details() for (name, report) in reports.items() if not report.ok()
+            }
+            if len(phase['push_failures']) > 0:
+                self._ok = False
+            merge = True
+
+        scheduler = clusterscheduler.ClusterScheduler(
+            servers, checks.names(), lambda server, file: self._log(f'{server} processing {file}'),
+            prefetch
+        )
+        self._loop.run(scheduler.poll, interval)
+        phase['files'] = [
+            {'server': server, 'file': file, 'bytes': sizes[file], 'seconds': seconds}
+            for (server, file, seconds) in scheduler.completed()
+        ]
+        total_bytes = sum([f['bytes'] for f in phase['files']])
+        if merge:
+            merge_start = time.monotonic()
+            self._log('Merging spectra')
+            phase['merged'] = len(clusterscheduler.merge_spectra(servers, self._client))
+            phase['merge_seconds'] = time.monotonic() - merge_start
+        phase['seconds'] = time.monotonic() - start
+        phase['bytes'] = total_bytes
+        phase['bytes_per_second'] = total_bytes/phase['seconds'] if phase['seconds'] > 0 else 0.0
+        self._phases['cluster'] = phase
+
+    def write_spectra(self, filename, format, patterns=('*',)):
+        '''
+        Write the spectra whose names match any of the glob 'patterns' to filename in 'format'.
+        '''
+        start = time.monotonic()
+        definitions = [
+            d for d in self._client.spectrum_list()['detail']
+            if any([fnmatch.fnmatchcase(d['name'], p) for p in patterns])
+        ]
+        self._log(f'Writing {len(definitions)} spectra to {filename}')
+        skipped = list()
+        written = spectrumwriter.write_spectra(self._client, filename, format, definitions, skipped=skipped)
+        self._phases['write'] = {
+            'file': filename, 'format': format, 'spectra': written, 'skipped': skipped,
+            'seconds': time.monotonic() - start
+        }
+
+    def failed(self, message):
+        ''' Record that the run failed '''
+        self._ok = False
+        self._phases['error'] = message
+
+    def report(self):
+        ''' Returns the run report as a dict that can be serialized to JSON '''
+        status = 'ok' if self._ok else ('failed' if 'error' in self._phases else 'incomplete')
+        return {
+            'program': 'spectcl-batch',
+            'server': {'host': self._client.host, 'port': self._client.port},
+            'started': self._start,
+            'elapsed': time.time() - self._start,
+            'status': status,
+            'phases': self._phases
+        }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='spectcl-batch',
+        description='Run SpecTcl/Rustogramer analyses without the GUI',
+        epilog='If --service is provided it overrides --port.'
+    )
+    parser.add_argument('-H', '--host', default='localhost', help='Host on which the histogram program is running')
+    parser.add_argument('-p', '--port', default=8000, help='Port on which the histogramer REST server is listening, defaults to 8000')
+    parser.add_argument('-s', '--service', default=None, help='Service the REST server advertises')
+    parser.add_argument('-u', '--service-user', default=OsServices.getlogin(),
+        help=f'Username the REST server advertises under defaults to "{OsServices.getlogin()}"')
+    parser.add_argument('--definitions', default=None, help='Definition (.sqlite) file to load first')
+    parser.add_argument('--keep-existing', action='store_true', help='Do not replace spectra that already exist')
+    parser.add_argument('--cluster', default=None, help='Cluster file of event files to process')
+    parser.add_argument('--fanout', default=None, metavar='PREFIX',
+        help='Share the cluster out among all histogramers on --host whose service names begin with PREFIX')
+    parser.add_argument('--sort', default=None, choices=['run', 'size', 'name'],
+        help='Process the cluster files in run number, size (largest first) or name order')
+    parser.add_argument('--dedupe', action='store_true', help='Skip event files listed more than once')
+    parser.add_argument('--prefetch', action='store_true', help='Read ahead the next event file(s) while processing')
+    parser.add_argument('--poll', default=clusterscheduler.DEFAULT_POLL, type=float, help='Seconds between completion checks')
+    parser.add_argument('--loop', default='sleep', choices=sorted(loops.keys()), help='Event loop used to wait')
+    parser.add_argument('--output', default=None, help='File the spectra are written to at the end')
+    parser.add_argument('--format', default='npz', choices=spectrumwriter.supported_formats(), help='Format of --output')
+    parser.add_argument('--spectra', default=['*'], nargs='+', help='Glob patterns of the spectra to write, default all')
+    parser.add_argument('--report', default='-', help='File the JSON report is written to, "-" (the default) for stdout')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Log progress to stderr')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    connection = {'host': args.host, 'port': args.port, 'pmanport': PORTMAN_PORT}
+    if args.service is not None:
+        connection['service'] = args.service
+        connection['user'] = args.service_user
+    log = None
+    if args.verbose:
+        log = lambda msg: print(f'{time.strftime("%H:%M:%S")} {msg}', file=sys.stderr, flush=True)
+
+    runner = None
+    try:
+        client = RestClient(connection)
+        capabilities.set_client(client)
+        runner = BatchRunner(client, loops[args.loop](), log)
+        if args.definitions is not None:
+            runner.load_definitions(args.definitions, not args.keep_existing)
+        if args.cluster is not None:
+            servers = None
+            if args.fanout is not None:
+                servers = clusterscheduler.discover_servers(args.host, args.fanout, pmanport=PORTMAN_PORT)
+                if len(servers) == 0:
+                    raise RuntimeError(f'No histogramers advertise services beginning with {args.fanout}')
+            runner.process_cluster(args.cluster, servers, args.poll, args.sort, args.dedupe, args.prefetch)
+        if args.output is not None:
+            runner.write_spectra(args.output, args.format, args.spectra)
+    except Exception as e:
+        if runner is None:
+            report = {'program': 'spectcl-batch', 'status': 'failed', 'phases': {'error': str(e)}}
+        else:
+            runner.failed(str(e))
+    if runner is not None:
+        report = runner.report()
+    text = json.dumps(report, indent=2, default=str)
+    if args.report == '-':
+        print(text)
+    else:
+        with open(args.report, 'w') as f:
+            f.write(text + '\n')
+    return {'ok': 0, 'incomplete': 1}.get(report['status'], 2)
+
+if __name__ == '__main__':
+    sys.exit(main())
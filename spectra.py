@@ -23,6 +23,8 @@ from spectrumeditor import Editor
 from capabilities import set_client as set_cap_client
 from ParameterChooser import update_model as load_parameters
 from gatelist import common_condition_model
+from conditiongraph import common_condition_graph
+import bulkapply
 from  rustogramer_client import rustogramer as RClient
 from rustogramer_client import RustogramerException
 _client = None
@@ -89,6 +91,10 @@ class SpectrumWidget(QWidget):
         self._listing.getList().reload.connect(self._reload_spectrum)
         self._listing.getList().update.connect(self._update_spectrum)
 
+    def spectrumModel(self):
+        ''' The model of the spectrum listing (e.g. to keep it current with traceservice) '''
+        return self._spectrumListModel
+
     def _add_to_listing(self, new_name):
         # Get the definition:
 
@@ -144,18 +150,26 @@ class SpectrumWidget(QWidget):
         gate    = self._editor.selected_gate()
         if len(spectra) == 0 or gate.isspace():
             return   
-        for spectrum in spectra:
-            _client.apply_gate(gate, spectrum)
-        # Update the list:
-        self._spectrumListModel.load_spectra(_client, self._listing.mask())
+        self._show_bulk_result(bulkapply.apply_gates(_client, {gate: spectra}), 'apply')
     def _ungate_selected(self):
         global _client
         spectra = self._listing.getSelectedSpectra()
         if len(spectra) == 0:
-            return               # So we don't need to regen list.
-        for spectrum in spectra:
-            _client.ungate_spectrum(spectrum)
-        self._spectrumListModel.load_spectra(_client, self._listing.mask())
+            return
+        self._show_bulk_result(bulkapply.ungate(_client, spectra), 'ungate')
+    def _show_bulk_result(self, result, operation):
+        # Only the gate column of the rows that changed needs updating.
+        
+        self._spectrumListModel.setGates(result.gates)
+        for (spectrum, gate) in result.gates.items():
+            common_condition_graph.set_application(spectrum, gate)
+        if not result.ok():
+            msg = QMessageBox(QMessageBox.Warning, f'Unable to {operation} gates',
+                f'Some gates could not be changed: {result.summary()}',
+                QMessageBox.Ok, self
+            )
+            msg.setDetailedText(result.details())
+            msg.exec()
     def _load_spectrum(self):
         #  Load the single selected spectrum into the editor.
 
@@ -0,0 +1,266 @@
+'''
+This module provides support for getting and putting the channel contents of
+spectra.  Contents are represented sparsely as a dict with the keys:
+
+*  name  - Name of the spectrum.
+*  xbins - numpy int32 array of x bin numbers of the non-zero channels.
+*  ybins - numpy int32 array of y bin numbers of the non-zero channels (all zero
+           for spectra with one axis).
+*  values - numpy float64 array of the channel values.
+
+Bin numbers count from 0 at the low edge of the axis and do not include the
+underflow/overflow channels.  Summary spectra have a channel per x parameter on
+x;  SpecTcl lists them with only a y axis so channel_axes supplies the x axis.
+
+SpecTcl and Rustogramer give back spectrum contents slightly differently:
+
+*  SpecTcl returns channels as dicts with 'x', 'y' (bin numbers) and 'v' (value).
+*  Rustogramer returns channels as dicts with 'x', 'y' (axis coordinates),
+   'bin' (a linear bin number that counts the under/overflow channels), 'chan_type'
+   (Bin, Underflow, Overflow) and 'value'.  We convert the coordinates to bin
+   numbers and drop the under/overflow channels.
+
+Contents are put back in the server with the set_chan request.  For SpecTcl
+set_chan requests can be bundled into a single Tcl script (see tcl_set_script) which
+is much faster than one REST request per channel.  SpecTcl's channel command needs
+as many indices as the spectrum has dimensions so putting contents needs to know
+if the spectrum is two dimensional (is_twod).
+'''
+
+import concurrent.futures
+import math
+
+import numpy as np
+
+import capabilities
+import tclbatch
+
+FETCH_WORKERS = 4              # Concurrent contents requests.
+SET_BATCH = 256                # Most channels per batch when restoring contents.
+SET_BYTES = tclbatch.CHUNK_BYTES   # Most characters of channel -set script per batch.
+SUMMARY_TYPES = ('s', 'gs')
+ONED_TYPES = ('1', 'g1', '1v', 'b', 'S')
+TWOD_TYPES = ('2', 'g2', 'gd', 'm2') + SUMMARY_TYPES
+
+def channel_axes(definition):
+    '''
+    Return (xaxis, yaxis) of the channels of a spectrum definition (as from
+    spectrum_list).  yaxis is None for spectra with one axis and xaxis is None
+    for spectra without axes.  SpecTcl summary spectra are listed with only a
+    y axis;  their x axis is the parameter number (one bin per x parameter).
+    '''
+    xaxis = definition.get('xaxis')
+    yaxis = definition.get('yaxis')
+    if xaxis is not None and len(xaxis) == 0:
+        xaxis = None
+    if yaxis is not None and len(yaxis) == 0:
+        yaxis = None
+    if xaxis is None and yaxis is not None and definition.get('type') in SUMMARY_TYPES:
+        count = len(definition.get('xparameters') or definition.get('parameters') or [])
+        xaxis = {'low': 0.0, 'high': float(count), 'bins': count}
+    return (xaxis, yaxis)
+
+def is_twod(definition):
+    '''
+    True if the channels of a spectrum definition (as from spectrum_list or
+    DefinitionReader.read_spectrum_defs) have x and y indices.
+    '''
+    if definition['type'] in TWOD_TYPES:
+        return True
+    if definition['type'] in ONED_TYPES:
+        return False
+    return channel_axes(definition)[1] is not None
+
+def with_channel_axes(definition):
+    ''' Return a copy of definition whose 'xaxis' and 'yaxis' are its channel_axes '''
+    result = dict(definition)
+    (result['xaxis'], result['yaxis']) = channel_axes(definition)
+    return result
+
+def empty_contents(name):
+    ''' Returns a contents dict with no channels '''
+    return {
+        'name': name,
+        'xbins': np.zeros(0, dtype=np.int32),
+        'ybins': np.zeros(0, dtype=np.int32),
+        'values': np.zeros(0, dtype=np.float64)
+    }
+
+def channels_to_contents(name, channels, definition):
+    '''
+    Convert the 'channels' part of a spectrum_getcontents reply to a contents dict.
+    *  name - spectrum name.
+    *  channels - list of channel dicts from the server.
+    *  definition - spectrum definition with 'xaxis' and 'yaxis' keys (the yaxis
+       can be None) as from spectrum_list or DefinitionReader.read_spectrum_defs.
+    '''
+    if capabilities.get_program() == capabilities.Program.Rustogramer:
+        xbins = list()
+        ybins = list()
+        values = list()
+        (xaxis, yaxis) = channel_axes(definition)
+        for chan in channels:
+            if chan.get('chan_type', 'Bin') != 'Bin':
+                continue                     # Under/overflow.
+            xbins.append(_coordinate_to_bin(chan['x'], xaxis))
+            ybins.append(_coordinate_to_bin(chan['y'], yaxis))
+            values.append(chan['value'])
+    else:
+        xbins = [chan['x'] for chan in channels]
+        ybins = [chan.get('y', 0) for chan in channels]
+        values = [chan['v'] for chan in channels]
+    contents = {
+        'name': name,
+        'xbins': np.array(xbins, dtype=np.int32),
+        'ybins': np.array(ybins, dtype=np.int32),
+        'values': np.array(values, dtype=np.float64)
+    }
+    # Drop any zero channels the server may have given us:
+    return select_channels(contents, contents['values'] != 0)
+
+def select_channels(contents, mask):
+    '''
+    Return a new contents dict with only the channels selected by the boolean
+    numpy array 'mask'.
+    '''
+    return {
+        'name': contents['name'],
+        'xbins': contents['xbins'][mask],
+        'ybins': contents['ybins'][mask],
+        'values': contents['values'][mask]
+    }
+
+def fetch_contents(client, definition):
+    '''
+    Fetch the contents of a spectrum from the server.
+    *  client - REST client.
+    *  definition - the spectrum's definition (from e.g. spectrum_list).
+    Returns a contents dict.
+    '''
+    (xaxis, yaxis) = channel_axes(definition)
+    if yaxis is None:
+        reply = client.spectrum_getcontents(definition['name'], xaxis['low'], xaxis['high'])
+    else:
+        reply = client.spectrum_getcontents(
+            definition['name'], xaxis['low'], xaxis['high'], yaxis['low'], yaxis['high']
+        )
+    channels = reply['detail'].get('channels')
+    if channels is None:
+        channels = list()
+    return channels_to_contents(definition['name'], channels, definition)
+
+def iter_contents(client, definitions, workers=FETCH_WORKERS):
+    '''
+    Generator that fetches the contents of several spectra with up to 'workers'
+    concurrent requests and yields contents dicts in the order of 'definitions'.
+    No more than 'workers' fetched spectra are held in memory at any time
+    so this can be fed straight into e.g. DefinitionWriter.save_spectrum_contents.
+    Spectra with no axis definitions (they have no contents we can restore) are skipped.
+    '''
+    definitions = [d for d in definitions if channel_axes(d)[0] is not None]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        pending = list()
+        for d in definitions:
+            pending.append(pool.submit(fetch_contents, client, d))
+            if len(pending) >= workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+def to_dense(contents, xbins, ybins=None):
+    '''
+    Return a dense numpy array with the contents.  For spectra with one axis,
+    ybins should be None and the result has shape (xbins,); otherwise the result has shape
+    (ybins, xbins).  Channels outside the array are ignored.
+    '''
+    in_range = (contents['xbins'] >= 0) & (contents['xbins'] < xbins)
+    if ybins is None:
+        result = np.zeros(xbins, dtype=np.float64)
+        result[contents['xbins'][in_range]] = contents['values'][in_range]
+    else:
+        in_range &= (contents['ybins'] >= 0) & (contents['ybins'] < ybins)
+        result = np.zeros((ybins, xbins), dtype=np.float64)
+        result[contents['ybins'][in_range], contents['xbins'][in_range]] = contents['values'][in_range]
+    return result
+
+def from_dense(name, array):
+    ''' Inverse of to_dense - make a contents dict from the non-zero channels of an array '''
+    if array.ndim == 1:
+        xbins = np.nonzero(array)[0]
+        ybins = np.zeros(len(xbins), dtype=np.int32)
+        values = array[xbins]
+    else:
+        (ybins, xbins) = np.nonzero(array)
+        values = array[ybins, xbins]
+    return {
+        'name': name,
+        'xbins': xbins.astype(np.int32),
+        'ybins': ybins.astype(np.int32),
+        'values': values.astype(np.float64)
+    }
+
+def batches(contents, twod, size=SET_BATCH, script_bytes=SET_BYTES):
+    '''
+    Generator that splits a contents dict into contents dicts with no more than
+    'size' channels each and, unless a single channel is bigger, no more than
+    'script_bytes' characters of tcl_set_script (the script is sent in the URL of
+    a request).  twod is as for tcl_set_script.
+    '''
+    lengths = np.array([len(x) + 1 for x in _set_lines(contents, twod)], dtype=np.int64)
+    start = 0
+    while start < len(lengths):
+        sizes = np.cumsum(lengths[start:start+size])
+        count = max(1, int(np.searchsorted(sizes, script_bytes, side='right')))
+        yield {
+            'name': contents['name'],
+            'xbins': contents['xbins'][start:start+count],
+            'ybins': contents['ybins'][start:start+count],
+            'values': contents['values'][start:start+count]
+        }
+        start += count
+
+def tcl_set_script(contents, twod):
+    '''
+    Return a Tcl script that sets the channels of contents using SpecTcl's
+    channel -set command.  twod is True if the spectrum is two dimensional
+    (see is_twod) so channels need x and y indices, otherwise only x is given.
+    '''
+    return '\n'.join(_set_lines(contents, twod))
+
+def put_contents(client, contents, twod):
+    '''
+    Put a (usually small, see batches) set of channels into a spectrum.  With
+    SpecTcl this is a single Tcl script request, otherwise it is one set_chan request
+    per channel.  twod is as for tcl_set_script.
+    '''
+    if len(contents['values']) == 0:
+        return
+    if capabilities.get_program() == capabilities.Program.SpecTcl:
+        client.execute_tcl(tcl_set_script(contents, twod))
+    else:
+        name = contents['name']
+        for (x, y, v) in zip(contents['xbins'].tolist(), contents['ybins'].tolist(), contents['values'].tolist()):
+            client.set_chan(name, x, v, y)
+
+# Private functions:
+
+def _set_lines(contents, twod):
+    # The channel -set commands for the channels of contents.
+    name = tclbatch.quote(contents['name'])
+    xs = contents['xbins'].tolist()
+    values = contents['values'].tolist()
+    if twod:
+        return [
+            f'channel -set {name} [list {x} {y}] {v!r}'
+            for (x, y, v) in zip(xs, contents['ybins'].tolist(), values)
+        ]
+    return [f'channel -set {name} {x} {v!r}' for (x, v) in zip(xs, values)]
+
+def _coordinate_to_bin(coordinate, axis):
+    # Convert an axis coordinate to a bin number.  The small
+    # slop handles coordinates at either the low edge or the center of a bin.
+
+    if axis is None or len(axis) == 0:
+        return 0
+    width = (axis['high'] - axis['low'])/axis['bins']
+    return int(math.floor((coordinate - axis['low'])/width + 1.0e-6))
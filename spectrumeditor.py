@@ -33,6 +33,7 @@ import editor1d,  editortwod, editorBitmask
 import  editorG2d, editorGD, editorProjection, editorStripchart
 import editorSummary, EnumeratedTypeSelector, editorGSummary
 import editor1dv
+import projection, projectionview
 from direction import Direction
 from gatelist import ConditionChooser
 
@@ -717,6 +718,7 @@ class ProjectionController(AbstractController):
 
         self._view.spectrumChosen.connect(self._loadContours)
         self._view.commit.connect(self._create)
+        self._view.showLocal.connect(self._show_local)
     
     # slot overrides:
 
@@ -769,6 +771,26 @@ class ProjectionController(AbstractController):
             error(f'Could not bind {name} to display memory but it it has been created: {e}')
 
 
+    def _show_local(self):
+        # Compute the projection from the spectrum contents and show it
+        # without making anything in the server:
+
+        source = self._view.spectrum()
+        if source == '':
+            return
+        direction = 'x' if self._view.direction().value == Direction.X.value else 'y'
+        contour = self._view.contour_name() if self._view.contour() else None
+        try:
+            (definition, contents) = projection.fetch_projection(
+                self._client, source, direction, self._view.name() or None,
+                contour, self._view.limits()
+            )
+        except (ValueError, RustogramerException) as e:
+            error(f'Could not project {source}: {e}')
+            return
+        dialog = projectionview.ProjectionDialog(definition, contents, self._view)
+        dialog.show()
+
     #  Utilties:
 
     def _loadspectra(self):
@@ -0,0 +1,350 @@
+'''
+This module provides a local reader for spectrum files.  Unlike
+rustogramer_client.spectrum_read, which has the server read a file (creating or
+replacing live spectra), this reads the file on this system into numpy arrays
+and needs no histogramer at all.  This is intended for offline comparisons, QA
+scripts and the like.
+
+Supported formats:
+
+*  'ascii' - SpecTcl ASCII spectrum format.
+*  'json'  - Rustogramer JSON spectrum format.
+*  'npz'   - numpy archives as written by spectrumwriter.
+*  'hdf5'  - Only if h5py is installed.  Each dataset is a spectrum.  If it has
+             a 'definition' attribute (spectrumwriter does this) that is used for the
+             definition, otherwise a minimal definition is made from the shape.
+
+All readers are generators that yield (definition, array) pairs one spectrum
+at a time so files with thousands of spectra can be processed with bounded memory.
+The definition is a dict with the same keys as spectrum_list()['detail'] entries:
+'name', 'type', 'chantype', 'parameters', 'xparameters', 'yparameters', 'xaxis' and
+'yaxis' (None for spectra with one axis).  The array is dense with shape (xbins,)
+or (ybins, xbins).
+
+Where the format allows, arrays are memory mapped rather than read: npz members
+that are stored (not compressed) and contiguous, uncompressed, HDF5 datasets.
+'''
+
+import json
+import os
+import struct
+import zipfile
+
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+READ_SIZE = 1024*1024               # Bytes per read when streaming JSON.
+
+def supported_formats():
+    ''' Returns the list of format names read_spectra supports here '''
+    result = ['ascii', 'json', 'npz']
+    if h5py is not None:
+        result.append('hdf5')
+    return result
+
+def format_from_filename(filename):
+    '''
+    Guess the format of a file from its extension.  Returns None if we can't.
+    '''
+    ext = os.path.splitext(filename)[1].lower()
+    return {
+        '.spec': 'ascii', '.asc': 'ascii', '.txt': 'ascii',
+        '.json': 'json', '.npz': 'npz', '.h5': 'hdf5', '.hdf5': 'hdf5'
+    }.get(ext)
+
+def read_spectra(filename, format=None, mmap=True):
+    '''
+    Generator that yields (definition, array) for each spectrum in a file.
+    *  filename - path to the file.
+    *  format  - one of supported_formats() if None it's determined from
+                 the filename extension.
+    *  mmap    - If True, memory map arrays where possible.
+    ValueError is raised if the format is unsupported or the file can't be parsed.
+    '''
+    if format is None:
+        format = format_from_filename(filename)
+    if format not in supported_formats():
+        raise ValueError(f'Unsupported spectrum file format {format} for {filename}')
+    if format == 'ascii':
+        return read_ascii(filename)
+    elif format == 'json':
+        return read_json(filename)
+    elif format == 'npz':
+        return read_npz(filename, mmap)
+    else:
+        return read_hdf5(filename, mmap)
+
+def read_all(filename, format=None, mmap=True):
+    ''' Returns a dict of name -> (definition, array) for all spectra in a file '''
+    return {d['name']: (d, a) for (d, a) in read_spectra(filename, format, mmap)}
+
+def make_definition(name, type, xaxis, yaxis=None, parameters=None, xparameters=None,
+                    yparameters=None, chantype='f64'):
+    ''' Make a definition dict with the keys described in the module comments '''
+    if parameters is None:
+        parameters = list()
+    return {
+        'name': name, 'type': type, 'chantype': chantype,
+        'parameters': parameters,
+        'xparameters': xparameters if xparameters is not None else list(parameters[:1]),
+        'yparameters': yparameters if yparameters is not None else list(parameters[1:2]),
+        'xaxis': xaxis, 'yaxis': yaxis
+    }
+
+# SpecTcl ASCII:
+
+def read_ascii(filename):
+    '''
+    Generator for spectra in a SpecTcl ASCII file.  Each spectrum is a header
+    ending in a line of dashes followed by channel lines of the form
+    '(x) value' or '(x y) value' and terminated by a channel with -1 coordinates.
+    The channel block is parsed in a single vectorized numpy conversion.
+    '''
+    with open(filename, 'r') as f:
+        while True:
+            header = _read_ascii_header(f)
+            if header is None:
+                return
+            (definition, dims) = header
+            lines = list()
+            for line in f:
+                if line.lstrip().startswith('(-1'):
+                    break
+                lines.append(line)
+            else:
+                raise ValueError(f'{filename}: spectrum {definition["name"]} has no end of data line')
+            text = ''.join(lines).replace('(', ' ').replace(')', ' ')
+            channels = np.fromstring(text, sep=' ') if text.strip() else np.zeros(0)
+            channels = channels.reshape(-1, len(dims) + 1)
+            yield (definition, _dense(channels, dims))
+
+def _read_ascii_header(f):
+    # Read one header from the file, returns (definition, dims) or None at end of file.
+    # The first line is the name and dimensions, the lines up to the dashes
+    # end with: type/datatype, (parameters), (low high) per axis.
+
+    first = ''
+    for line in f:
+        if line.strip() != '':
+            first = line.strip()
+            break
+    if first == '':
+        return None
+    paren = first.rfind('(')
+    if paren < 0:
+        raise ValueError(f'Bad spectrum header line: {first}')
+    name = first[:paren].strip().strip('"')
+    dims = [int(x) for x in first[paren+1:].strip(') ').split()]
+
+    body = list()
+    for line in f:
+        if line.startswith('---'):
+            break
+        body.append(line.strip())
+    if len(body) < 3:
+        raise ValueError(f'Spectrum {name} has a truncated header')
+    type_line = body[-3].split()
+    parameters = body[-2].strip('()').split()
+    limits = [float(x) for x in body[-1].replace('(', ' ').replace(')', ' ').split()]
+    stype = type_line[0]
+    chantype = {'double': 'f64', 'long': 'long', 'word': 'short', 'byte': 'byte'}.get(
+        type_line[1] if len(type_line) > 1 else 'long', 'long'
+    )
+    xaxis = {'low': limits[0], 'high': limits[1], 'bins': dims[0]}
+    yaxis = None
+    if len(dims) > 1:
+        yaxis = {'low': limits[2], 'high': limits[3], 'bins': dims[1]}
+    if stype == '2' and len(parameters) == 2:
+        definition = make_definition(name, stype, xaxis, yaxis, parameters, chantype=chantype)
+    else:
+        definition = make_definition(name, stype, xaxis, yaxis, parameters, parameters, list(), chantype)
+    return (definition, dims)
+
+# Rustogramer JSON:
+
+def read_json(filename):
+    '''
+    Generator for spectra in a Rustogramer JSON file.  The file is an array of
+    objects, one per spectrum.  Rather than parsing the whole document, the file is
+    read in blocks and each spectrum object is decoded as soon as it is complete so
+    only one spectrum's JSON is in memory at a time.
+    '''
+    decoder = json.JSONDecoder()
+    with open(filename, 'r') as f:
+        buffer = f.read(READ_SIZE)
+        pos = _skip(buffer, 0, '')
+        if pos >= len(buffer) or buffer[pos] != '[':
+            raise ValueError(f'{filename} is not a Rustogramer JSON spectrum file')
+        pos += 1
+        eof = False
+        while True:
+            pos = _skip(buffer, pos, ',')
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            try:
+                (spectrum, end) = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise ValueError(f'{filename}: truncated or invalid JSON')
+                # Reading at least as much as we have keeps re-parsing a big
+                # spectrum linear in its size:
+                block = f.read(max(READ_SIZE, len(buffer)))
+                eof = block == ''
+                buffer = buffer[pos:] + block
+                pos = 0
+                continue
+            buffer = buffer[end:]
+            pos = 0
+            yield _json_spectrum(spectrum)
+
+def _skip(buffer, pos, extra):
+    # Skip whitespace and any of the characters in 'extra'.
+    while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] in extra):
+        pos += 1
+    return pos
+
+def _json_spectrum(spectrum):
+    # Convert one decoded Rustogramer JSON spectrum to (definition, array).
+
+    d = spectrum['definition']
+    xaxis = _json_axis(d.get('x_axis'))
+    yaxis = _json_axis(d.get('y_axis'))
+    xparams = d.get('x_parameters', list())
+    yparams = d.get('y_parameters', list())
+    definition = make_definition(
+        d['name'], d['type_string'], xaxis, yaxis, xparams + yparams, xparams, yparams
+    )
+    channels = [c for c in spectrum.get('channels', list()) if c.get('chan_type', 'Bin') == 'Bin']
+    x = np.array([c['x'] for c in channels], dtype=np.float64)
+    v = np.array([c['value'] for c in channels], dtype=np.float64)
+    dims = [xaxis['bins']]
+    columns = [_bins(x, xaxis)]
+    if yaxis is not None:
+        y = np.array([c['y'] for c in channels], dtype=np.float64)
+        dims.append(yaxis['bins'])
+        columns.append(_bins(y, yaxis))
+    columns.append(v)
+    return (definition, _dense(np.column_stack(columns) if len(v) else np.zeros((0, len(dims)+1)), dims))
+
+def _json_axis(axis):
+    if axis is None:
+        return None
+    return {'low': axis[0], 'high': axis[1], 'bins': int(axis[2])}
+
+def _bins(coordinates, axis):
+    # Vectorized coordinate -> bin number; see spectrumcontents._coordinate_to_bin.
+    width = (axis['high'] - axis['low'])/axis['bins']
+    return np.floor((coordinates - axis['low'])/width + 1.0e-6)
+
+# numpy .npz:
+
+def read_npz(filename, mmap=True):
+    '''
+    Generator for spectra in an npz archive written by spectrumwriter.  Members
+    that are stored uncompressed are memory mapped if 'mmap' is true, others
+    are decompressed into memory one at a time.
+    '''
+    with zipfile.ZipFile(filename, 'r') as archive:
+        members = archive.namelist()
+        definitions = dict()
+        if 'definitions.json' in members:
+            definitions = json.loads(archive.read('definitions.json'))
+        for member in members:
+            if not member.endswith('.npy'):
+                continue
+            name = member[:-4]
+            info = archive.getinfo(member)
+            array = None
+            if mmap and info.compress_type == zipfile.ZIP_STORED:
+                array = _mmap_member(filename, archive, info)
+            if array is None:
+                with archive.open(member) as f:
+                    array = np.lib.format.read_array(f, allow_pickle=False)
+            definition = definitions.get(name)
+            if definition is None:
+                definition = _shape_definition(name, array.shape)
+            yield (definition, array)
+
+def _mmap_member(filename, archive, info):
+    # Memory map a stored .npy member of a zip archive.  We need the offset of
+    # the member's data which is after its local header (30 bytes + name + extra)
+    # and then the .npy header.  Returns None if that can't be done.
+
+    with open(filename, 'rb') as f:
+        f.seek(info.header_offset)
+        local = f.read(30)
+        if len(local) != 30 or local[:4] != b'PK\x03\x04':
+            return None
+        (name_length, extra_length) = struct.unpack('<HH', local[26:30])
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            (shape, fortran, dtype) = np.lib.format.read_array_header_1_0(f)
+        elif version == (2, 0):
+            (shape, fortran, dtype) = np.lib.format.read_array_header_2_0(f)
+        else:
+            return None
+        if dtype.hasobject:
+            return None
+        offset = f.tell()
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran else 'C')
+
+# HDF5:
+
+def read_hdf5(filename, mmap=True):
+    '''
+    Generator for spectra in an HDF5 file.  Every dataset (at any depth) is a
+    spectrum.  Contiguous, uncompressed datasets are memory mapped if 'mmap' is true.
+    '''
+    if h5py is None:
+        raise ValueError('Reading HDF5 spectrum files requires the h5py package')
+    with h5py.File(filename, 'r') as f:
+        datasets = list()
+        f.visititems(lambda name, obj: datasets.append(name) if isinstance(obj, h5py.Dataset) else None)
+        for name in datasets:
+            dataset = f[name]
+            array = None
+            if mmap and dataset.chunks is None and dataset.compression is None:
+                offset = dataset.id.get_offset()
+                if offset is not None:
+                    array = np.memmap(filename, dtype=dataset.dtype, mode='r',
+                                      offset=offset, shape=dataset.shape)
+            if array is None:
+                array = dataset[()]
+            if 'definition' in dataset.attrs:
+                definition = json.loads(dataset.attrs['definition'])
+            else:
+                definition = _shape_definition(name.split('/')[-1], array.shape)
+            yield (definition, array)
+
+# Common private functions:
+
+def _dense(channels, dims):
+    # channels is an (n, len(dims)+1) array of bin coordinates and values.
+    # Returns the dense spectrum array; channels outside the spectrum are dropped.
+
+    if len(dims) == 1:
+        result = np.zeros(dims[0], dtype=np.float64)
+        x = channels[:, 0].astype(np.int64)
+        ok = (x >= 0) & (x < dims[0])
+        result[x[ok]] = channels[ok, 1]
+    else:
+        result = np.zeros((dims[1], dims[0]), dtype=np.float64)
+        x = channels[:, 0].astype(np.int64)
+        y = channels[:, 1].astype(np.int64)
+        ok = (x >= 0) & (x < dims[0]) & (y >= 0) & (y < dims[1])
+        result[y[ok], x[ok]] = channels[ok, 2]
+    return result
+
+def _shape_definition(name, shape):
+    # Minimal definition for an array with no saved definition; axes are in channels.
+    xaxis = {'low': 0.0, 'high': float(shape[-1]), 'bins': shape[-1]}
+    if len(shape) == 1:
+        return make_definition(name, '1', xaxis)
+    yaxis = {'low': 0.0, 'high': float(shape[0]), 'bins': shape[0]}
+    return make_definition(name, '2', xaxis, yaxis)
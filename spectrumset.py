@@ -11,11 +11,20 @@ Spectrum sets have the following capabilities:
 -  A list of spectrum names that are no longer in the (recently updated) spectrum list
 can be retrieved.
 
+Spectrum sets keep track of their invalid members as the valid names change
+(AddValidNames/RemoveValidNames e.g. from traceservice spectrum events, or
+UpdateValidNames) so that validating them costs nothing when none of their
+spectra went away:  the work is proportional to the names that changed, not
+to the size of the sets.  Generation() changes whenever the valid names do
+so clients can tell if anything needs revalidating at all.
 
 '''
+import weakref
 
 # the list of valid spectrum names is a hash for easy, fast lookup.
 _SpectrumNames = {}
+_generation = 0                      # Incremented when _SpectrumNames changes.
+_sets = weakref.WeakSet()            # Spectrum sets to tell about changes.
 
 def UpdateValidNames(names) :
     '''
@@ -30,7 +39,37 @@ def UpdateValidNames(names) :
         
     '''
     global _SpectrumNames
-    _SpectrumNames= {x : x for x in names}
+    names = {x : x for x in names}
+    removed = [x for x in _SpectrumNames if x not in names]
+    added = [x for x in names if x not in _SpectrumNames]
+    _SpectrumNames= names
+    _names_changed(added, removed)
+
+def AddValidNames(names):
+    ''' Add names to the valid spectrum names (e.g. spectra that were created) '''
+    added = [x for x in names if x not in _SpectrumNames]
+    for name in added:
+        _SpectrumNames[name] = name
+    _names_changed(added, [])
+
+def RemoveValidNames(names):
+    ''' Remove names from the valid spectrum names (e.g. spectra that were deleted) '''
+    removed = [x for x in names if x in _SpectrumNames]
+    for name in removed:
+        del _SpectrumNames[name]
+    _names_changed([], removed)
+
+def Generation():
+    ''' A number that changes whenever the set of valid names does '''
+    return _generation
+
+def _names_changed(added, removed):
+    global _generation
+    if len(added) == 0 and len(removed) == 0:
+        return
+    _generation += 1
+    for spectrum_set in list(_sets):
+        spectrum_set._names_changed(added, removed)
     
 
 def ValidNames() :
@@ -51,6 +90,9 @@ class SpectrumSet :
         self.name = name
         self.description = description
         self.spectra = []
+        self._counts = dict()        # Member name -> number of times in spectra.
+        self._invalid = set()        # Members that are not valid names.
+        _sets.add(self)
     
     def add(self, spectra):
             '''
@@ -67,6 +109,8 @@ class SpectrumSet :
             
             spectra = [_SpectrumNames[x]  for x in spectra]
             self.spectra.extend(spectra)
+            for name in spectra:
+                self._counts[name] = self._counts.get(name, 0) + 1
     
     def remove(self, spectrum):
         '''
@@ -74,18 +118,22 @@ class SpectrumSet :
            is not in the list.
         '''
         self.spectra.remove(spectrum)
+        self._counts[spectrum] -= 1
+        if self._counts[spectrum] == 0:
+            del self._counts[spectrum]
+            self._invalid.discard(spectrum)
 
     def validate(self):
         ''' Return a list of spectra that are not valid
         
         '''
-        
-        result = []
-        for spectrum in self.spectra:
-            if not spectrum in _SpectrumNames:
-                result.append(spectrum)
-        
-        return result
+        if len(self._invalid) == 0:
+            return []
+        return [x for x in self.spectra if x in self._invalid]
+    
+    def invalid_count(self):
+        ''' Number of members that are not valid names (kept up to date as names change) '''
+        return sum([self._counts[x] for x in self._invalid])
     
     def getname(self) :
         ''' Return name of the set: '''
@@ -109,6 +157,14 @@ class SpectrumSet :
         for name in self.spectra:
             function(extra_arg, name)
     
+    def _names_changed(self, added, removed):
+        # Called when the valid names change - only the changed names are looked at.
+        for name in removed:
+            if name in self._counts:
+                self._invalid.add(name)
+        for name in added:
+            self._invalid.discard(name)
+    
     #----------------------------------------------------------------------
     #  Unit tests.
     #---------------------------------------------------------------------
@@ -208,5 +264,31 @@ class TestSpectrumSet(unittest.TestCase):
         UpdateValidNames(s)
         self.assertEqual(s, [x for x in ValidNames().keys()])
         
+    def test_invalid_1(self):
+        s = ['spec1', 'spec2', 'spec3', 'spec4']
+        UpdateValidNames(s)
+        listing = SpectrumSet('aname')
+        listing.add(s)
+        generation = Generation()
+        RemoveValidNames(['spec2', 'junk'])
+        self.assertNotEqual(generation, Generation())
+        self.assertEqual(1, listing.invalid_count())
+        self.assertEqual(['spec2'], listing.validate())
+        AddValidNames(['spec2'])
+        self.assertEqual(0, listing.invalid_count())
+        self.assertEqual([], listing.validate())
+    def test_invalid_2(self):
+        s = ['spec1', 'spec2', 'spec3', 'spec4']
+        UpdateValidNames(s)
+        listing = SpectrumSet('aname')
+        listing.add(s)
+        UpdateValidNames(['spec1', 'spec4'])
+        self.assertEqual(['spec2', 'spec3'], listing.validate())
+        listing.remove('spec3')
+        self.assertEqual(['spec2'], listing.validate())
+        generation = Generation()
+        UpdateValidNames(['spec1', 'spec4'])
+        self.assertEqual(generation, Generation())
+        
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
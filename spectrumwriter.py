@@ -0,0 +1,308 @@
+'''
+This module provides client side spectrum export.  Unlike
+rustogramer_client.spectrum_write, which has the server write a file in the
+server's filesystem, this fetches spectrum contents over the REST interface
+(see spectrumcontents) and writes them to a local file.
+
+Supported formats:
+
+*  'ascii' - SpecTcl ASCII spectrum format - readable by SpecTcl and Rustogramer.
+*  'json'  - Rustogramer JSON spectrum format.
+*  'npz'   - A numpy .npz archive.  Each spectrum is a dense array keyed by its name,
+             (shape (xbins,) or (ybins, xbins)) and the member 'definitions.json' has
+             the spectrum definitions (as from spectrum_list) keyed by name.
+*  'hdf5'  - Only if h5py is installed; one gzipped dataset per spectrum with the
+             definition in the dataset attributes.
+
+Writing is streamed: spectra are fetched by a bounded pool of worker threads
+(the producer) and handed through a bounded queue to the caller's thread (the
+consumer) which writes them as they arrive.  Thus fetching overlaps writing and
+no more than a few spectra are in memory at any time regardless of how many are
+written.  Nothing here depends on Qt.
+'''
+
+import json
+import queue
+import threading
+import time
+import zipfile
+
+import numpy as np
+
+import spectrumcontents
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+QUEUE_DEPTH = 8                     # Fetched spectra waiting to be written.
+
+def supported_formats():
+    ''' Returns the list of format names write_spectra supports here '''
+    result = ['ascii', 'json', 'npz']
+    if h5py is not None:
+        result.append('hdf5')
+    return result
+
+def file_filter(format):
+    ''' Returns a QFileDialog filter string appropriate to a format '''
+    return {
+        'ascii': 'Spectrum (*.spec);;Text (*.txt)',
+        'json': 'Json (*.json);;Text (*.txt)',
+        'npz': 'Numpy (*.npz)',
+        'hdf5': 'HDF5 (*.h5 *.hdf5)'
+    }[format]
+
+def axis_bins(definition):
+    '''
+    Return (xbins, ybins) for a spectrum definition; ybins is None for spectra
+    with only one axis (see spectrumcontents.channel_axes).
+    '''
+    (xaxis, yaxis) = spectrumcontents.channel_axes(definition)
+    if yaxis is None:
+        return (xaxis['bins'], None)
+    return (xaxis['bins'], yaxis['bins'])
+
+def write_spectra(client, filename, format, definitions, progress=None, workers=spectrumcontents.FETCH_WORKERS,
+                  skipped=None):
+    '''
+    Write spectra to a local file.
+    *  client - REST client.
+    *  filename - Path to the file to write.
+    *  format - one of supported_formats().
+    *  definitions - spectrum definitions (spectrum_list()['detail'] entries) of the
+       spectra to write.
+    *  progress - If not None, called as progress(name, done, total) after each spectrum
+       is written.  Return False from it to stop early.
+    *  workers - number of concurrent fetches.
+    *  skipped - If not None, a list the names of spectra that can't be written
+       (they have no axes) are appended to.
+    Summary spectra are written with the x axis spectrumcontents.channel_axes gives them.
+    Returns the number of spectra written.  ValueError is raised for an unsupported format,
+    other errors (REST or I/O) are passed back to the caller.
+    '''
+    if format not in supported_formats():
+        raise ValueError(f'Unsupported spectrum export format: {format}')
+    definitions = [spectrumcontents.with_channel_axes(d) for d in definitions]
+    if skipped is not None:
+        skipped.extend([d['name'] for d in definitions if d['xaxis'] is None])
+    definitions = [d for d in definitions if d['xaxis'] is not None]
+
+    fetched = queue.Queue(maxsize=QUEUE_DEPTH)
+    stop = threading.Event()
+    producer = threading.Thread(
+        target=_produce, args=(client, definitions, workers, fetched, stop), daemon=True
+    )
+    producer.start()
+
+    writer = _writers()[format](filename)
+    done = 0
+    try:
+        while True:
+            item = fetched.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            (definition, contents) = item
+            writer.write(definition, contents)
+            done += 1
+            if progress is not None and progress(definition['name'], done, len(definitions)) is False:
+                break
+    finally:
+        stop.set()
+        writer.close()
+        # Unblock the producer if it's waiting for room in the queue:
+        while producer.is_alive():
+            try:
+                fetched.get(timeout=0.1)
+            except queue.Empty:
+                pass
+    return done
+
+def write_local(filename, format, spectra):
+    '''
+    Write spectra that are already in hand (e.g. computed locally by projection)
+    rather than fetched from the server.
+    *  spectra - iterable of (definition, contents) pairs.
+    Returns the number of spectra written.
+    '''
+    if format not in supported_formats():
+        raise ValueError(f'Unsupported spectrum export format: {format}')
+    writer = _writers()[format](filename)
+    done = 0
+    try:
+        for (definition, contents) in spectra:
+            writer.write(definition, contents)
+            done += 1
+    finally:
+        writer.close()
+    return done
+
+class AsciiWriter:
+    '''
+    Writes spectra in SpecTcl ASCII format.  Each spectrum is a header
+    (name and dimensions, dates, format level, type and data type, parameters,
+    axis limits and a separator line), followed by a line per non-zero
+    channel e.g. (x y) value terminated by a channel with -1 coordinates.
+    '''
+    _datatypes = {'f64': 'double', 'long': 'long', 'short': 'word', 'byte': 'byte'}
+    def __init__(self, filename):
+        self._file = open(filename, 'w')
+
+    def write(self, definition, contents):
+        (xbins, ybins) = axis_bins(definition)
+        now = time.ctime()
+        f = self._file
+        if ybins is None:
+            f.write(f'"{definition["name"]}" ({xbins})\n')
+        else:
+            f.write(f'"{definition["name"]}" ({xbins} {ybins})\n')
+        f.write(f'{now}\nSaved {now}\n5\n')
+        dtype = self._datatypes.get(definition.get('chantype'), 'long')
+        f.write(f'{definition["type"]} {dtype}\n')
+        f.write(f'({" ".join(definition["parameters"])})\n')
+        xaxis = definition['xaxis']
+        if ybins is None:
+            f.write(f'({xaxis["low"]} {xaxis["high"]})\n')
+        else:
+            yaxis = definition['yaxis']
+            f.write(f'({xaxis["low"]} {xaxis["high"]}) ({yaxis["low"]} {yaxis["high"]})\n')
+        f.write('-' * 44 + '\n')
+        values = contents['values'].tolist()
+        if ybins is None:
+            for (x, v) in zip(contents['xbins'].tolist(), values):
+                f.write(f'({x}) {v:.15g}\n')
+            f.write('(-1) 0\n')
+        else:
+            for (x, y, v) in zip(contents['xbins'].tolist(), contents['ybins'].tolist(), values):
+                f.write(f'({x} {y}) {v:.15g}\n')
+            f.write('(-1 -1) 0\n')
+
+    def close(self):
+        self._file.close()
+
+class JsonWriter:
+    '''
+    Writes spectra in Rustogramer JSON format; an array of objects, one per
+    spectrum, with a 'definition' and 'channels'.  The array is written piecewise so
+    the document is never built in memory.
+    '''
+    _chunk = 1024                     # Channels per write.
+    def __init__(self, filename):
+        self._file = open(filename, 'w')
+        self._file.write('[')
+        self._first = True
+
+    def write(self, definition, contents):
+        (xbins, ybins) = axis_bins(definition)
+        xaxis = definition['xaxis']
+        yaxis = definition.get('yaxis') if ybins is not None else None
+        header = {
+            'name': definition['name'],
+            'type_string': definition['type'],
+            'x_parameters': definition.get('xparameters', list()),
+            'y_parameters': definition.get('yparameters', list()),
+            'x_axis': [xaxis['low'], xaxis['high'], xbins],
+            'y_axis': [yaxis['low'], yaxis['high'], ybins] if yaxis is not None else None
+        }
+        f = self._file
+        if not self._first:
+            f.write(',')
+        self._first = False
+        f.write('\n{"definition": ' + json.dumps(header) + ', "channels": [')
+
+        # Rustogramer channels have coordinates and a linear bin number that counts
+        # the under/overflow bins:
+
+        xwidth = (xaxis['high'] - xaxis['low'])/xbins
+        xs = xaxis['low'] + contents['xbins'] * xwidth
+        if yaxis is not None:
+            ywidth = (yaxis['high'] - yaxis['low'])/ybins
+            ys = yaxis['low'] + contents['ybins'] * ywidth
+        else:
+            ys = np.zeros(len(xs))
+        linear = (contents['xbins'] + 1) + (contents['ybins'] + 1 if yaxis is not None else 0) * (xbins + 2)
+
+        first = True
+        for start in range(0, len(contents['values']), self._chunk):
+            end = start + self._chunk
+            pieces = [
+                json.dumps({'chan_type': 'Bin', 'x': x, 'y': y, 'bin': b, 'value': v})
+                for (x, y, b, v) in zip(xs[start:end].tolist(), ys[start:end].tolist(),
+                                        linear[start:end].tolist(), contents['values'][start:end].tolist())
+            ]
+            if not first:
+                f.write(',')
+            first = False
+            f.write(','.join(pieces))
+        f.write(']}')
+
+    def close(self):
+        self._file.write('\n]\n')
+        self._file.close()
+
+class NpzWriter:
+    '''
+    Writes spectra as dense arrays into a numpy .npz archive.  Each array is
+    written directly into its zip member so only one spectrum is ever expanded in memory.
+    If 'compress' is False, members are stored so that readers can memory map them.
+    '''
+    def __init__(self, filename, compress=True):
+        self._zip = zipfile.ZipFile(
+            filename, 'w', zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED, allowZip64=True
+        )
+        self._definitions = dict()
+
+    def write(self, definition, contents):
+        (xbins, ybins) = axis_bins(definition)
+        array = spectrumcontents.to_dense(contents, xbins, ybins)
+        with self._zip.open(definition['name'] + '.npy', 'w', force_zip64=True) as member:
+            np.lib.format.write_array(member, array, allow_pickle=False)
+        self._definitions[definition['name']] = definition
+
+    def close(self):
+        self._zip.writestr('definitions.json', json.dumps(self._definitions, default=str))
+        self._zip.close()
+
+class Hdf5Writer:
+    '''
+    Writes spectra to an HDF5 file; one dataset per spectrum.  The definition
+    is stored as a JSON string in the 'definition' attribute.  Requires h5py.
+    '''
+    def __init__(self, filename):
+        if h5py is None:
+            raise ValueError('HDF5 export requires the h5py package')
+        self._file = h5py.File(filename, 'w')
+
+    def write(self, definition, contents):
+        (xbins, ybins) = axis_bins(definition)
+        array = spectrumcontents.to_dense(contents, xbins, ybins)
+        dataset = self._file.create_dataset(
+            definition['name'], data=array, compression='gzip', chunks=True
+        )
+        dataset.attrs['definition'] = json.dumps(definition, default=str)
+
+    def close(self):
+        self._file.close()
+
+# Private functions:
+
+def _writers():
+    return {
+        'ascii': AsciiWriter, 'json': JsonWriter, 'npz': NpzWriter, 'hdf5': Hdf5Writer
+    }
+
+def _produce(client, definitions, workers, fetched, stop):
+    # Producer thread: fetch contents and queue (definition, contents).
+    # None marks the end, an exception object marks a failure.
+
+    try:
+        for (definition, contents) in zip(definitions, spectrumcontents.iter_contents(client, definitions, workers)):
+            if stop.is_set():
+                return
+            fetched.put((definition, contents))
+        fetched.put(None)
+    except Exception as e:
+        fetched.put(e)
@@ -0,0 +1,278 @@
+'''
+This module batches many SpecTcl operations into a few execute_tcl requests.
+SpecTcl can run an arbitrary Tcl script in one request (rustogramer.execute_tcl)
+so instead of one REST request per spectrum, condition, gate application,
+tree variable or binding, the equivalent Tcl commands are collected and run by
+a small procedure that catches each command's error:
+
+    proc ::_pyGuiBatch {commands} {
+        ...  foreach command: [list status message]
+    }
+    ::_pyGuiBatch {command1 command2 ...}
+
+The script's result is the list of per command {status message} pairs which is
+parsed back into dicts like the client's replies:  {'status': 'OK', 'detail': message}
+or, for a failed command, {'status': 'ERROR', 'detail': message} (check turns a
+failure into the RustogramerException the client would have raised).
+
+*  The *_command functions make the Tcl command for an operation from the same
+   definitions restorepipeline uses.  They return None if the operation has no
+   Tcl equivalent here (it must then be done with the normal REST request).
+*  chunks splits commands so each script stays well under the size of a
+   request URL;  run_commands runs one chunk.
+*  use_batches decides if batching is worthwhile:  only SpecTcl has Tcl and
+   only restores with at least BATCH_THRESHOLD operations gain much.
+
+Nothing here depends on Qt.
+'''
+
+import capabilities
+from rustogramer_client import RustogramerException
+
+BATCH_THRESHOLD = 64           # Operations before batching is used automatically.
+CHUNK_COMMANDS = 256           # Most commands in one script.
+CHUNK_BYTES = 8192             # Most command characters in one script.
+
+_PROCEDURE = '''proc ::_pyGuiBatch {commands} {
+    set results [list]
+    foreach command $commands {
+        set status [catch {uplevel #0 $command} message]
+        lappend results [list $status $message]
+    }
+    return $results
+}
+'''
+
+_SPECIAL = set(' \t\n\r{}[]$";\\')
+
+def use_batches(count):
+    ''' True if 'count' operations should be batched into scripts '''
+    return capabilities.get_program() == capabilities.Program.SpecTcl and count >= BATCH_THRESHOLD
+
+# Tcl formatting:
+
+def quote(value):
+    ''' Quote a value so it's a single Tcl list element/word '''
+    value = str(value)
+    if value == '':
+        return '{}'
+    if not any([c in _SPECIAL for c in value]):
+        return value
+    if _brace_safe(value):
+        return '{' + value + '}'
+    return ''.join(['\\n' if c == '\n' else ('\\' + c if c in _SPECIAL else c) for c in value])
+
+def tcl_list(values):
+    ''' A Tcl list of values '''
+    return ' '.join([quote(x) for x in values])
+
+def parse_list(text):
+    '''
+    Split a Tcl list into its elements (braced elements are not substituted,
+    quoted and bare ones have backslash sequences replaced).  ValueError is raised
+    if the list is malformed.
+    '''
+    result = list()
+    i = 0
+    n = len(text)
+    while True:
+        while i < n and text[i].isspace():
+            i += 1
+        if i >= n:
+            return result
+        if text[i] == '{':
+            depth = 1
+            j = i + 1
+            while j < n and depth > 0:
+                if text[j] == '\\':
+                    j += 1
+                elif text[j] == '{':
+                    depth += 1
+                elif text[j] == '}':
+                    depth -= 1
+                j += 1
+            if depth != 0:
+                raise ValueError(f'Unmatched open brace in Tcl list: {text}')
+            result.append(text[i+1:j-1])
+            i = j
+        else:
+            quoted = text[i] == '"'
+            if quoted:
+                i += 1
+            element = list()
+            while i < n and (text[i] != '"' if quoted else not text[i].isspace()):
+                if text[i] == '\\' and i + 1 < n:
+                    element.append(_backslash(text[i+1]))
+                    i += 2
+                else:
+                    element.append(text[i])
+                    i += 1
+            if quoted:
+                if i >= n:
+                    raise ValueError(f'Unmatched quote in Tcl list: {text}')
+                i += 1
+            result.append(''.join(element))
+
+# Commands:
+
+def spectrum_command(definition, chantype):
+    '''
+    spectrum -new command for a definition as from DefinitionReader.read_spectrum_defs
+    with the channel type 'chantype' (a SpecTcl data type string).
+    '''
+    stype = definition['type']
+    xaxis = definition['xaxis']
+    yaxis = definition['yaxis']
+    if stype == '1':
+        parameters = definition['xparameters'][:1]
+        axes = [xaxis]
+    elif stype == '2':
+        parameters = definition['xparameters'][:1] + definition['yparameters'][:1]
+        axes = [xaxis, yaxis]
+    elif stype == 'g1':
+        parameters = definition['parameters']
+        axes = [xaxis]
+    elif stype == 'g2':
+        parameters = definition['parameters']
+        axes = [xaxis, yaxis]
+    elif stype == 'gd':
+        parameters = [tcl_list(definition['xparameters']), tcl_list(definition['yparameters'])]
+        axes = [xaxis, yaxis]
+    elif stype == 's':
+        parameters = definition['parameters']
+        axes = [yaxis if yaxis is not None and len(yaxis) != 0 else xaxis]
+    elif stype == 'm2':
+        if definition['yparameters'] is None or len(definition['yparameters']) == 0:
+            parameters = definition['parameters']        # Already x y pairs.
+        else:
+            parameters = list()
+            for (x, y) in zip(definition['xparameters'], definition['yparameters']):
+                parameters += [x, y]
+        axes = [xaxis, yaxis]
+    elif stype == 'S':
+        parameters = definition['xparameters'][:1] + definition['yparameters'][:1]
+        axes = [xaxis]
+    else:
+        return None
+    return tcl_list([
+        'spectrum', '-new', definition['name'], stype, tcl_list(parameters),
+        tcl_list([_axis(x) for x in axes]), chantype
+    ])
+
+def spectrum_delete_command(name):
+    return tcl_list(['spectrum', '-delete', name])
+
+def condition_command(condition):
+    ''' gate -new command for a definition as from DefinitionReader.read_condition_defs '''
+    ctype = condition['type']
+    parameters = condition['parameters']
+    points = condition['points']
+    if ctype in ('T', 'F'):
+        description = ''
+    elif ctype == '-':
+        description = tcl_list(condition['dependencies'][:1])
+    elif ctype in ('*', '+'):
+        description = tcl_list(condition['dependencies'])
+    elif ctype == 's':
+        description = tcl_list([parameters[0], tcl_list([points[0][0], points[1][0]])])
+    elif ctype in ('c', 'b'):
+        description = tcl_list([tcl_list(parameters[:2]), _points(points)])
+    elif ctype == 'gs':
+        description = tcl_list([tcl_list([points[0][0], points[1][0]]), tcl_list(parameters)])
+    elif ctype in ('gc', 'gb'):
+        description = tcl_list([_points(points), tcl_list(parameters)])
+    elif ctype in ('em', 'am', 'nm'):
+        description = tcl_list([parameters[0], condition['mask']])
+    else:
+        return None
+    return tcl_list(['gate', '-new', condition['name'], ctype, description])
+
+def apply_command(gate, spectra):
+    return tcl_list(['apply', gate] + list(spectra))
+
+def ungate_command(spectra):
+    return tcl_list(['ungate'] + list(spectra))
+
+def treevariable_command(name, value, units=None):
+    words = ['treevariable', '-set', name, value]
+    if units is not None:
+        words.append(units)
+    return tcl_list(words)
+
+def sbind_command(spectra):
+    return tcl_list(['sbind'] + list(spectra))
+
+# Running:
+
+def script(commands):
+    ''' The Tcl script that runs commands and returns their statuses '''
+    return _PROCEDURE + '::_pyGuiBatch ' + quote(tcl_list(commands))
+
+def chunks(items, command=lambda x: x):
+    '''
+    Generator that splits items into lists small enough for one script:  no more
+    than CHUNK_COMMANDS items and, unless a single command is bigger, CHUNK_BYTES
+    characters of commands.  command(item) gives the item's command.
+    '''
+    chunk = list()
+    size = 0
+    for item in items:
+        length = len(command(item))
+        if len(chunk) > 0 and (len(chunk) >= CHUNK_COMMANDS or size + length > CHUNK_BYTES):
+            yield chunk
+            chunk = list()
+            size = 0
+        chunk.append(item)
+        size += length
+    if len(chunk) > 0:
+        yield chunk
+
+def run_commands(client, commands):
+    '''
+    Run commands in one execute_tcl request.  Returns a list with one reply
+    dict per command (see the module comments).  If the request itself fails the
+    client's exception is raised;  ValueError is raised if the statuses can't be
+    understood.
+    '''
+    reply = client.execute_tcl(script(commands))['detail']
+    statuses = parse_list(reply if isinstance(reply, str) else str(reply))
+    if len(statuses) != len(commands):
+        raise ValueError(f'Expected {len(commands)} statuses from the server, got {len(statuses)}')
+    result = list()
+    for status in statuses:
+        fields = parse_list(status)
+        if len(fields) != 2:
+            raise ValueError(f'Malformed command status: {status}')
+        result.append({'status': 'OK' if fields[0] == '0' else 'ERROR', 'detail': fields[1]})
+    return result
+
+def check(result):
+    ''' Raise RustogramerException if a per command result is a failure '''
+    if result['status'] != 'OK':
+        raise RustogramerException(result)
+    return result
+
+# Private functions:
+
+def _axis(axis):
+    return tcl_list([axis['low'], axis['high'], axis['bins']])
+
+def _points(points):
+    return tcl_list([tcl_list([x, y]) for (x, y) in points])
+
+def _brace_safe(value):
+    # Can value be put in braces as is?
+    if '\\' in value:
+        return False
+    depth = 0
+    for c in value:
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth < 0:
+                return False
+    return depth == 0
+
+def _backslash(c):
+    return {'n': '\n', 't': '\t', 'r': '\r'}.get(c, c)
@@ -0,0 +1,370 @@
+'''
+This module provides a service that keeps the GUI's models in step with
+changes made in the histogramer by other clients (other GUIs, scripts, the
+SpecTcl command line) without full reloads.
+
+Changes are delivered as (operation, name) pairs by the TraceService signals:
+   parameter, spectrum, condition, binding
+where operation is one of 'add', 'delete' or 'changed'.
+
+Two sources of changes are supported:
+
+*  TraceSource - SpecTcl's queued traces (trace_establish/fetch/done).  Traces
+   are queued by the server for the retention period so they are fetched
+   at half that period.  If the token is lost (e.g. the server restarted or we
+   did not poll in time), a new one is established and the resync signal is
+   emitted so views can do one full reload.
+*  DiffSource - For servers without traces (Rustogramer).  The parameter,
+   spectrum, condition and binding lists are fetched periodically and compared
+   with the previous ones.
+
+The changes are fetched on a pollscheduler worker thread along with the
+definitions of the spectra and conditions that were added or changed (one listing
+per kind of item per batch) so nothing is requested in the GUI thread.  A batch
+of more than MAX_BATCH changes is treated as a resync:  one full reload is
+cheaper than that many updates.
+
+ModelUpdater applies the changes to the shared models (gatelist.common_condition_model,
+conditiongraph.common_condition_graph, the ParameterChooser tree and any number of
+SpectrumList.SpectrumModel).
+'''
+import json
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+import capabilities
+import ParameterChooser
+import pollscheduler
+from conditiongraph import common_condition_graph
+from gatelist import common_condition_model
+
+DEFAULT_RETENTION = 10           # Seconds the server keeps traces for us.
+DEFAULT_DIFF_INTERVAL = 5        # Seconds between listings when diffing.
+MAX_BATCH = 500                  # More changes than this in a poll -> resync.
+
+KINDS = ('parameter', 'spectrum', 'condition', 'binding')
+
+# Trace operation names -> ours:
+
+_operations = {
+    'add': 'add', 'create': 'add', 'define': 'add',
+    'delete': 'delete', 'remove': 'delete', 'unbind': 'delete',
+    'changed': 'changed', 'change': 'changed', 'modify': 'changed'
+}
+
+class TraceSource:
+    '''
+    Change source using SpecTcl traces.
+      * client - REST client.
+      * retention - seconds the server retains traces.
+    '''
+    def __init__(self, client, retention=DEFAULT_RETENTION):
+        self._client = client
+        self._retention = retention
+        self._token = None
+
+    def interval(self):
+        ''' Poll interval (seconds): half the retention period '''
+        return self._retention/2.0
+
+    def start(self):
+        self._token = self._client.trace_establish(self._retention)['detail']
+
+    def stop(self):
+        if self._token is not None:
+            try:
+                self._client.trace_done(self._token)
+            except:
+                pass                       # Server may already be gone.
+            self._token = None
+
+    def fetch(self):
+        '''
+        Returns (events, resync) where events is a list of (kind, operation, name)
+        and resync is True if traces may have been lost.
+        '''
+        if self._token is None:
+            self.start()
+            return ([], True)
+        try:
+            detail = self._client.trace_fetch(self._token)['detail']
+        except Exception:
+            self._token = None             # Re-establish next time.
+            self.start()
+            return ([], True)
+        events = list()
+        for (kind, key) in (('parameter', 'parameter'), ('spectrum', 'spectrum'),
+                            ('condition', 'gate'), ('binding', 'binding')):
+            for trace in detail.get(key, []):
+                event = _parse_trace(trace)
+                if event is not None:
+                    events.append((kind,) + event)
+        return (events, False)
+
+class DiffSource:
+    '''
+    Change source that lists the definitions and compares them with the
+    previous listing.
+      * client - REST client.
+      * interval - seconds between listings.
+    '''
+    def __init__(self, client, interval=DEFAULT_DIFF_INTERVAL):
+        self._client = client
+        self._interval = interval
+        self._previous = None
+
+    def interval(self):
+        return self._interval
+
+    def start(self):
+        self._previous = self._snapshot()
+
+    def stop(self):
+        self._previous = None
+
+    def fetch(self):
+        ''' See TraceSource.fetch - a diff source never loses changes '''
+        current = self._snapshot()
+        if self._previous is None:
+            self._previous = current
+            return ([], True)
+        events = list()
+        for kind in KINDS:
+            events.extend([(kind,) + change for change in diff(self._previous[kind], current[kind])])
+        self._previous = current
+        return (events, False)
+
+    # Private methods:
+
+    def _snapshot(self):
+        # kind -> {name: serialized definition} for everything listable.
+        return {
+            'parameter': _by_name(self._client.parameter_list()['detail']),
+            'spectrum': _by_name(self._client.spectrum_list()['detail']),
+            'condition': _by_name(self._client.condition_list()['detail']),
+            'binding': _by_name(self._client.sbind_list()['detail'])
+        }
+
+def diff(before, after):
+    '''
+    Compare two dicts of name -> definition.  Returns a list of (operation, name)
+    for added, deleted and changed names.
+    '''
+    changes = [('delete', name) for name in before.keys() - after.keys()]
+    for (name, definition) in after.items():
+        if name not in before:
+            changes.append(('add', name))
+        elif before[name] != definition:
+            changes.append(('changed', name))
+    return changes
+
+class TraceService(QObject):
+    '''
+    Polls a change source (TraceSource if the server has traces, else DiffSource)
+    and emits a signal per change.
+    Signals:
+       parameter(operation, name), spectrum(operation, name),
+       condition(operation, name), binding(operation, name) - A change.
+       resync() - Changes may have been missed; reload everything.
+       failed(message) - The changes could not be fetched (tried again next poll).
+    While a spectrum or condition signal is emitted, definition(kind, name) gives
+    the definition fetched with the change.
+    '''
+    parameter = pyqtSignal(str, str)
+    spectrum  = pyqtSignal(str, str)
+    condition = pyqtSignal(str, str)
+    binding   = pyqtSignal(str, str)
+    resync    = pyqtSignal()
+    failed    = pyqtSignal(str)
+
+    def __init__(self, client, source=None, scheduler=None, *args, max_batch=MAX_BATCH):
+        super().__init__(*args)
+        if source is None:
+            source = TraceSource(client) if capabilities.has_traces() else DiffSource(client)
+        self._client = client
+        self._source = source
+        self._max_batch = max_batch
+        self._definitions = dict()
+        self._scheduler = scheduler if scheduler is not None else pollscheduler.get_scheduler()
+        self._scheduler.add_request('traces', self._fetch)
+        self._job = None
+
+    def start(self):
+        ''' Fetches are made by the pollscheduler on its worker threads '''
+        self._source.start()
+        self._job = self._scheduler.register(
+            'traces', self._fetched, self._source.interval(),
+            max_staleness=0, requests=('traces',), errback=self._failed,
+            delay=self._source.interval()
+        )
+
+    def stop(self):
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+        self._source.stop()
+
+    def poll(self):
+        ''' Fetch and emit pending changes now '''
+        try:
+            results = {'traces': self._fetch()}
+        except Exception as e:
+            self._failed(e)                  # Server unreachable, try next time.
+            return
+        self._fetched(results)
+
+    def definition(self, kind, name):
+        '''
+        The definition of the spectrum or condition 'name' fetched with the change
+        being signalled (None if it no longer exists).
+        '''
+        return self._definitions.get((kind, name))
+
+    # Private methods:
+
+    def _fetch(self):
+        # Worker thread: the changes and the definitions of what they add or change.
+        (events, resync) = self._source.fetch()
+        events = _coalesce(events)
+        if len(events) > self._max_batch:
+            return ([], True, dict())
+        return (events, resync, _fetch_definitions(self._client, events))
+
+    def _fetched(self, results):
+        (events, resync, definitions) = results['traces']
+        if resync:
+            self.resync.emit()
+        signals = {
+            'parameter': self.parameter, 'spectrum': self.spectrum,
+            'condition': self.condition, 'binding': self.binding
+        }
+        self._definitions = definitions
+        try:
+            for (kind, operation, name) in events:
+                signals[kind].emit(operation, name)
+        finally:
+            self._definitions = dict()
+
+    def _failed(self, exception):
+        self.failed.emit(f'Unable to fetch changes made by other clients: {exception}')
+
+class ModelUpdater(QObject):
+    '''
+    Applies the changes from a TraceService to the shared models.
+      *  service - the TraceService.
+      *  client  - REST client used to reload everything on a resync.
+      *  spectrum_models - SpectrumList.SpectrumModel objects to keep current.
+    Signals:
+       failed(message) - A resync reload failed.
+    '''
+    failed = pyqtSignal(str)
+
+    def __init__(self, service, client, spectrum_models=(), *args):
+        super().__init__(*args)
+        self._service = service
+        self._client = client
+        self._spectrum_models = list(spectrum_models)
+        service.parameter.connect(self._parameter)
+        service.spectrum.connect(self._spectrum)
+        service.condition.connect(self._condition)
+        service.resync.connect(self._reload)
+
+    def add_spectrum_model(self, model):
+        self._spectrum_models.append(model)
+
+    # Private slots:
+
+    def _parameter(self, operation, name):
+        if operation == 'add':
+            ParameterChooser.add_parameter(name)
+        elif operation == 'delete':
+            ParameterChooser.remove_parameter(name)
+
+    def _spectrum(self, operation, name):
+        if operation == 'delete':
+            common_condition_graph.remove_spectrum(name)
+            for model in self._spectrum_models:
+                model.removeSpectrum(name)
+            return
+        definition = self._service.definition('spectrum', name)
+        if definition is None:
+            return                        # Deleted again since.
+        common_condition_graph.set_application(name, definition.get('gate'))
+        for model in self._spectrum_models:
+            model.replaceSpectrum(definition)
+
+    def _condition(self, operation, name):
+        if operation == 'delete':
+            common_condition_model.remove(name)
+            common_condition_graph.remove_condition(name)
+            return
+        definition = self._service.definition('condition', name)
+        if definition is not None:
+            common_condition_model.replace(definition)
+            common_condition_graph.set_condition(definition)
+
+    def _reload(self):
+        try:
+            ParameterChooser.update_model(self._client)
+            common_condition_model.load(self._client)
+            common_condition_graph.load(self._client)
+            for model in self._spectrum_models:
+                model.load_spectra(self._client)
+        except Exception as e:
+            self.failed.emit(f'Unable to reload the definitions: {e}')
+
+# Private functions:
+
+def _parse_trace(trace):
+    # A trace is "operation name" or [operation, name].  Returns (operation, name)
+    # or None if it can't be understood.
+    if isinstance(trace, str):
+        parts = trace.split(None, 1)
+    else:
+        parts = list(trace)
+    if len(parts) < 2:
+        return None
+    operation = _operations.get(str(parts[0]).lower())
+    if operation is None:
+        return None
+    return (operation, str(parts[1]).strip())
+
+def _coalesce(events):
+    # Keep only the last operation on each item but preserve first-seen order.
+    # An add followed by a change is still an add.
+    latest = dict()
+    for (kind, operation, name) in events:
+        key = (kind, name)
+        if latest.get(key) == 'add' and operation == 'changed':
+            continue
+        latest.pop(key, None)
+        latest[key] = operation
+    return [(kind, operation, name) for ((kind, name), operation) in latest.items()]
+
+def _fetch_definitions(client, events):
+    # (kind, name) -> definition for the spectra and conditions added or changed.
+    # One name is listed by itself (unless it has glob characters), more than one
+    # with a single full listing.
+    listers = {'spectrum': client.spectrum_list, 'condition': client.condition_list}
+    result = dict()
+    for (kind, lister) in listers.items():
+        names = [name for (k, operation, name) in events if k == kind and operation != 'delete']
+        if len(names) == 0:
+            continue
+        pattern = '*'
+        if len(names) == 1 and not any([c in names[0] for c in '*?[\\']):
+            pattern = names[0]
+        definitions = lister(pattern)['detail']
+        for name in names:
+            result[(kind, name)] = _lookup(definitions, name)
+    return result
+
+def _by_name(definitions, key='name'):
+    return {d[key]: json.dumps(d, sort_keys=True, default=str) for d in definitions}
+
+def _lookup(definitions, name):
+    # condition_list/spectrum_list take patterns so pick out the exact name.
+    for d in definitions:
+        if d['name'] == name:
+            return d
+    return None
@@ -0,0 +1,245 @@
+'''
+This module provides waveform capture:  rather than looking at one
+waveform/fit snapshot at a time, successive waveform_getall results are kept
+in a preallocated ring buffer per waveform so that many traces can be viewed
+at once.
+
+*  WaveformRing holds the most recent traces of one waveform:  the samples,
+   the fits evaluated at each sample, the capture time and the MPI rank that
+   contributed each trace (always 0 for serial SpecTcl).
+*  The analyses are vectorized over the buffer:
+   -  overlay - the traces for persistence style overlays.
+   -  envelope - mean, RMS, min and max at each sample position.
+   -  heatmap - the traces as a time (trace) vs. sample image.
+   -  density - a 2D histogram of sample value vs. sample position.
+*  WaveformCapture keeps a ring per waveform and appends waveform_getall results
+   to them.  fetch gets the results for several waveforms;  it is meant to be run
+   on a worker thread (e.g. as a pollscheduler request) with the results added in
+   the GUI thread, so nothing here depends on Qt.
+
+Waveforms are resized rarely;  if the length of a waveform changes its ring
+is cleared and reallocated for the new length.
+'''
+import time
+
+import numpy as np
+
+DEFAULT_CAPACITY = 256           # Traces kept per waveform.
+DEFAULT_DENSITY_BINS = 128
+
+class WaveformRing:
+    '''
+    Ring buffer of the traces of one waveform.
+      *  samples - Number of samples in each trace.
+      *  capacity - Number of traces kept.
+    Traces are returned oldest first.  All accessors take an optional rank to
+    select the traces contributed by one MPI rank.
+    '''
+    def __init__(self, samples, capacity=DEFAULT_CAPACITY):
+        self._capacity = max(1, int(capacity))
+        self._samples = int(samples)
+        self._traces = np.zeros((self._capacity, self._samples), dtype=np.float64)
+        self._times = np.zeros(self._capacity, dtype=np.float64)
+        self._ranks = np.zeros(self._capacity, dtype=np.int32)
+        self._fits = dict()               # fit name -> (capacity, samples) array.
+        self._next = 0
+        self._count = 0
+
+    def capacity(self):
+        return self._capacity
+
+    def samples(self):
+        return self._samples
+
+    def __len__(self):
+        return self._count
+
+    def append(self, samples, rank=0, when=None, fits=None):
+        '''
+        Add a trace.
+        *  samples - the waveform samples (length samples()).
+        *  rank - MPI rank that contributed the trace.
+        *  when - capture time (default time.time()).
+        *  fits - dict of fit name -> points at each sample.
+        '''
+        row = self._next
+        self._traces[row] = samples
+        self._times[row] = time.time() if when is None else when
+        self._ranks[row] = rank
+        for name in list(self._fits.keys()):
+            if fits is None or name not in fits:
+                self._fits[name][row] = np.nan      # No fit for this trace.
+        if fits is not None:
+            for (name, points) in fits.items():
+                if name not in self._fits:
+                    self._fits[name] = np.full((self._capacity, self._samples), np.nan)
+                self._fits[name][row] = _fit(points, self._samples)
+        self._next = (self._next + 1) % self._capacity
+        self._count = min(self._count + 1, self._capacity)
+
+    def last(self, rank=None):
+        ''' The most recent trace (from 'rank' if not None) or None '''
+        newest_first = (self._next - 1 - np.arange(self._count)) % self._capacity
+        if rank is not None:
+            newest_first = newest_first[self._ranks[newest_first] == rank]
+        if len(newest_first) == 0:
+            return None
+        return self._traces[newest_first[0]]
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+        self._fits = dict()
+
+    def traces(self, rank=None):
+        ''' (n, samples) array of the traces oldest first '''
+        return self._select(self._traces, rank)
+
+    def times(self, rank=None):
+        return self._select(self._times, rank)
+
+    def ranks(self):
+        ''' The distinct ranks that contributed traces '''
+        return np.unique(self._ordered(self._ranks))
+
+    def fit_names(self):
+        return list(self._fits.keys())
+
+    def fits(self, name, rank=None):
+        ''' (n, samples) array of the fit 'name' for each trace (NaN where it was missing) '''
+        return self._select(self._fits[name], rank)
+
+    def overlay(self, count=None, rank=None):
+        ''' The newest 'count' traces (all if None) oldest first for persistence displays '''
+        traces = self.traces(rank)
+        if count is not None:
+            traces = traces[-count:]
+        return traces
+
+    def envelope(self, rank=None):
+        '''
+        Returns a dict of arrays (one value per sample position) computed over
+        the traces: mean, rms (spread about the mean), min, max and count.
+        '''
+        traces = self.traces(rank)
+        if len(traces) == 0:
+            empty = np.full(self._samples, np.nan)
+            return {'mean': empty, 'rms': empty, 'min': empty, 'max': empty, 'count': 0}
+        mean = traces.mean(axis=0)
+        return {
+            'mean': mean,
+            'rms': np.sqrt(((traces - mean)**2).mean(axis=0)),
+            'min': traces.min(axis=0),
+            'max': traces.max(axis=0),
+            'count': len(traces)
+        }
+
+    def heatmap(self, rank=None):
+        ''' (n, samples) image of the traces, row i is the i'th oldest trace (same as traces) '''
+        return self.traces(rank)
+
+    def density(self, bins=DEFAULT_DENSITY_BINS, value_range=None, rank=None):
+        '''
+        2D histogram of sample value vs. sample position over the traces.
+        Returns (counts, edges): counts has shape (bins, samples) and edges are the
+        bins+1 value bin edges.  value_range is (low, high), default the data range.
+        '''
+        traces = self.traces(rank)
+        if value_range is None:
+            if len(traces) == 0:
+                value_range = (0.0, 1.0)
+            else:
+                value_range = (float(traces.min()), float(traces.max()))
+        (low, high) = value_range
+        if high <= low:
+            high = low + 1.0
+        edges = np.linspace(low, high, bins + 1)
+        counts = np.zeros((bins, self._samples), dtype=np.int64)
+        if len(traces) == 0:
+            return (counts, edges)
+        vbin = np.floor((traces - low) * (bins/(high - low))).astype(np.int64)
+        inside = (vbin >= 0) & (vbin < bins)
+        vbin[traces == high] = bins - 1           # Top edge is in the last bin.
+        inside |= traces == high
+        position = np.broadcast_to(np.arange(self._samples), traces.shape)
+        flat = vbin[inside] * self._samples + position[inside]
+        counts += np.bincount(flat, minlength=bins*self._samples).reshape(bins, self._samples)
+        return (counts, edges)
+
+    # Private methods:
+
+    def _ordered(self, array):
+        # The filled part of a ring array oldest first.
+        if self._count < self._capacity:
+            return array[:self._count]
+        return np.concatenate((array[self._next:], array[:self._next]))
+
+    def _select(self, array, rank):
+        result = self._ordered(array)
+        if rank is not None:
+            result = result[self._ordered(self._ranks) == rank]
+        return result
+
+class WaveformCapture:
+    '''
+    Keeps a WaveformRing per captured waveform.
+      *  capacity - traces kept per waveform.
+      *  skip_repeats - if True, a trace identical to the previous one from the same
+         rank is not stored (polling faster than events arrive returns the
+         same trace again).
+    '''
+    def __init__(self, capacity=DEFAULT_CAPACITY, skip_repeats=True):
+        self._capacity = capacity
+        self._skip_repeats = skip_repeats
+        self._rings = dict()
+
+    def names(self):
+        return list(self._rings.keys())
+
+    def ring(self, name):
+        ''' The WaveformRing for 'name' or None if nothing was captured '''
+        return self._rings.get(name)
+
+    def set_capacity(self, capacity):
+        ''' Change the traces kept;  existing captures are discarded '''
+        self._capacity = capacity
+        self._rings = dict()
+
+    def clear(self, name=None):
+        ''' Forget the captured traces of 'name' (all if None) '''
+        if name is None:
+            self._rings = dict()
+        else:
+            self._rings.pop(name, None)
+
+    def add(self, detail, when=None):
+        '''
+        Store a waveform_getall result detail.  Returns True if it was stored,
+        False if it was a repeat.
+        '''
+        waveform = detail['waveform']
+        name = detail.get('name', waveform.get('name'))
+        samples = np.asarray(waveform['samples'], dtype=np.float64)
+        rank = int(waveform.get('rank', 0))
+        ring = self._rings.get(name)
+        if ring is None or ring.samples() != len(samples):
+            ring = WaveformRing(len(samples), self._capacity)
+            self._rings[name] = ring
+        elif self._skip_repeats:
+            previous = ring.last(rank)
+            if previous is not None and np.array_equal(previous, samples):
+                return False
+        fits = {fit['name']: fit['points'] for fit in detail.get('fits', [])}
+        ring.append(samples, rank, when, fits)
+        return True
+
+def fetch(client, names):
+    ''' The waveform_getall details of each of 'names' (to be given to WaveformCapture.add) '''
+    return [client.waveform_getall(name)['detail'] for name in names]
+
+def _fit(points, samples):
+    # Fit points padded with NaN or truncated to the number of samples.
+    points = np.asarray(points, dtype=np.float64)[:samples]
+    if len(points) < samples:
+        points = np.concatenate((points, np.full(samples - len(points), np.nan)))
+    return points
@@ -4,7 +4,14 @@
     It handles view signals and handles updating the view
 '''
 from PyQt5.QtGui import QStandardItemModel, QStandardItem
-from PyQt5.QtWidgets import QAbstractItemView
+from PyQt5.QtWidgets import QAbstractItemView, QMessageBox
+
+import pollscheduler
+import waveformcapture
+import waveformrecorder
+
+REPLAY_PERIOD = 0.05             # Seconds between replay steps.
+
 class WaveformController:
     def __init__(self, view, client):
         '''
@@ -31,7 +38,27 @@ class WaveformController:
             self._update_waveform
         )
         self._view.refresh_plot.connect(self._update_plot)
+        self._view.auto_refresh.connect(self._auto_refresh)
+        self._view.capture_selection_changed.connect(self._capture_selection_changed)
+        self._auto_job = None
         
+        # Every refresh is also captured for the overlay/envelope/heat map displays:
+        
+        self._capture = waveformcapture.WaveformCapture(self._view.capture_depth())
+        self._view.capture_depth_changed.connect(self._capture.set_capacity)
+        self._view.clear_capture.connect(self._clear_capture)
+        self._view.display_changed.connect(self._redisplay)
+        
+        # What is captured can be recorded and recordings replayed:
+        
+        self._recorder = None
+        self._replayer = None
+        self._replay_job = None
+        self._replay_name = None
+        self._view.record.connect(self._record)
+        self._view.replay.connect(self._replay)
+        self._view.replay_speed_changed.connect(self._replay_speed)
+        self._view.stop_replay.connect(self._stop_replay)
         
     
     def _load_waveform_list(self):
@@ -71,6 +98,8 @@ class WaveformController:
         info = waveform_info['detail'][0]
         self._load_metadata_model(info['metadata'])
         self._view.set_metadata_waveform(info['name'], info['samples'], self._metadatamodel)
+        if self._auto_job is not None:
+            self._auto_refresh(True, 1.0/self._period)    # Now refresh this waveform.
     
     def _add_metadata(self):
         ''' Add a metadata row with editable name/value'''
@@ -109,14 +138,152 @@ class WaveformController:
         
         (name, _) = self._view.get_metadata_info()  # Don't care about the metadata.
         data = self._client.waveform_getall(name)['detail']   # Waveform and fits.
-        waveform_data = data['waveform']
+        self._show(name, data)
+    
+    def _show(self, name, data):
+        ''' Capture, record and plot the waveform and fits from waveform_getall '''
+        
+        self._store(data)
+        self._display(name, data)
+    
+    def _store(self, data):
+        ''' Capture and record a waveform_getall result '''
+        if self._capture.add(data) and self._recorder is not None:
+            self._recorder.add(data)
+    
+    def _display(self, name, data):
+        ''' Plot captured data per the display mode;  data is the latest waveform_getall '''
+        if self._view.display_mode() != 'Latest':
+            self._view.show_capture(name, self._capture.ring(name))
+            return
+        
+        # The waveform data is (name, points, rank) so:
+        
+        fits = {fit['name']: fit['points'] for fit in data['fits']}
+        self._view.show_waveform(name, data['waveform']['samples'], fits)
+    
+    def _clear_capture(self):
+        (name, _) = self._view.get_metadata_info()
+        self._capture.clear(name)
+    
+    def _redisplay(self):
+        ''' The display mode changed - show the captured data in the new mode '''
+        (name, _) = self._view.get_metadata_info()
+        ring = self._capture.ring(name)
+        if ring is None or len(ring) == 0:
+            return
+        if self._view.display_mode() == 'Latest':
+            fits = {fit: ring.fits(fit)[-1] for fit in ring.fit_names()}
+            self._view.show_waveform(name, ring.last(), fits)
+        else:
+            self._view.show_capture(name, ring)
+    
+    def _auto_refresh(self, enabled, rate):
+        ''' 
+            Auto refresh turned on/off or its rate changed.  The refreshes are
+            LOW priority pollscheduler jobs;  the shown waveform and those selected
+            in the waveform list are fetched on the scheduler's worker thread (see
+            waveformcapture.fetch), then captured and plotted in the GUI thread.
+        '''
+        if self._auto_job is not None:
+            self._auto_job.cancel()
+            self._auto_job = None
+        if not enabled:
+            return
+        (name, _) = self._view.get_metadata_info()
+        names = self._view.captured_waveforms()
+        scheduler = pollscheduler.get_scheduler()
+        scheduler.add_request('waveform/getall', lambda: waveformcapture.fetch(self._client, names))
+        self._period = 1.0/rate
+        self._auto_job = scheduler.register(
+            'waveform refresh', lambda results: self._auto_show(name, results),
+            self._period, pollscheduler.LOW, max_staleness=0, requests=('waveform/getall',),
+            errback=self._auto_failed
+        )
+    
+    def _auto_failed(self, exception):
+        ''' A refresh failed (server gone, waveform deleted...) - stop refreshing and say why '''
+        self._auto_refresh(False, 0.0)
+        self._view.set_auto_refresh(False)
+        QMessageBox.warning(self._view, 'Auto refresh stopped', f'Unable to refresh the waveform: {exception}')
+    
+    def _capture_selection_changed(self):
+        if self._auto_job is not None:
+            self._auto_refresh(True, 1.0/self._period)    # Capture the new selection.
+    
+    def _auto_show(self, name, results):
+        # Everything fetched is captured; the first is the waveform shown.
         
-        # waveform_data is (name, points, rank) so:
+        details = results['waveform/getall']
+        for data in details:
+            self._store(data)
+        self._display(name, details[0])
         
-        self._view.plot(name, waveform_data['samples'])
+        # Hold a rate we can draw:  never spend more than half the time drawing.
         
-        # Now add fits:
+        self._auto_job.set_period(max(self._period, 2*self._view.draw_seconds()))
+    
+    def _record(self, path):
+        ''' Start recording what is captured to path or stop if path is empty '''
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
+        if path == '':
+            return
+        try:
+            self._recorder = waveformrecorder.WaveformRecorder(path, self._client)
+        except OSError as e:
+            self._view.set_recording(False)
+            QMessageBox.warning(self._view, 'Recording failed', f'Unable to record to {path}: {e}')
+    
+    def _replay(self, path):
+        '''
+            Replay a recording.  Only one waveform is replayed:  the selected one
+            if it was recorded, otherwise the first one recorded.  Replayed
+            traces go through the capture so all display modes work.
+        '''
+        try:
+            recording = waveformrecorder.WaveformRecording(path)
+        except (OSError, ValueError, KeyError) as e:
+            QMessageBox.warning(self._view, 'Replay failed', f'{path} is not a waveform recording: {e}')
+            return
+        names = recording.names()
+        if len(names) == 0:
+            return
+        self._stop_replay()
+        self._record('')
+        self._view.set_recording(False)
+        self._auto_refresh(False, 0.0)
+        
+        (selected, _) = self._view.get_metadata_info()
+        name = selected if selected in names else names[0]
+        self._replay_name = name
+        self._capture.clear(name)
+        self._replayer = waveformrecorder.Replayer(recording, self._view.replay_speed(), [name])
+        self._replay_job = pollscheduler.get_scheduler().register(
+            'waveform replay', self._replay_step, REPLAY_PERIOD, pollscheduler.LOW
+        )
+        self._view.set_replaying(True)
+    
+    def _replay_step(self):
+        # Capture everything that's due but only draw the newest.
         
-        for fit in data['fits']:
-            self._view.add_fit(fit['name'], fit['points'])
+        records = self._replayer.due()
+        for record in records:
+            self._capture.add(record, record['time'])
+        if len(records) > 0:
+            self._display(self._replay_name, records[-1])
+        if self._replayer.done():
+            self._stop_replay()
+    
+    def _replay_speed(self, speed):
+        if self._replayer is not None:
+            self._replayer.set_speed(speed)
+    
+    def _stop_replay(self):
+        if self._replay_job is not None:
+            self._replay_job.cancel()
+            self._replay_job = None
+        self._replayer = None
+        self._view.set_replaying(False)
         
\ No newline at end of file
@@ -0,0 +1,303 @@
+'''
+This module records waveforms (as returned by waveform_getall) to disk and
+reads the recordings back for replay.
+
+A recording is a directory:
+
+*  header.json - The waveforms recorded.  Each has an id, name, number of samples,
+   the metadata from waveform_get_metadata and the names of its fits.  A
+   waveform that is resized during a recording gets a new id.
+*  index.dat   - One INDEX_DTYPE record per captured trace in capture order:
+   time, waveform id, MPI rank and the row of the trace in the waveform's files.
+*  wf<id>.dat  - The samples of waveform <id>, one row of float64 per trace.
+*  wf<id>.fit<k>.dat - The k'th fit of waveform <id> evaluated at each sample;
+   rows line up with wf<id>.dat (NaN where a trace had no such fit).
+
+Rows are buffered and written a chunk at a time.  The reader maps the files
+with numpy.memmap so even long recordings open instantly and only the traces
+actually looked at are read.
+
+Replayer meters records out of a recording at any speed relative to the
+recorded times.  Nothing here depends on Qt.
+'''
+import json
+import os
+import time
+
+import numpy as np
+
+CHUNK_ROWS = 64                  # Traces buffered before writing.
+HEADER = 'header.json'
+INDEX = 'index.dat'
+VERSION = 1
+INDEX_DTYPE = np.dtype([('time', '<f8'), ('waveform', '<i4'), ('rank', '<i4'), ('row', '<i8')])
+
+class WaveformRecorder:
+    '''
+    Records waveform_getall results.
+      *  path - Directory to record into (created; must not already hold a recording).
+      *  client - If not None, used to fetch each waveform's metadata the
+                  first time the waveform is recorded.
+    Use add() for each waveform_getall detail and close() when done (or use
+    as a context manager).
+    '''
+    def __init__(self, path, client=None):
+        if os.path.exists(os.path.join(path, HEADER)):
+            raise FileExistsError(f'{path} already holds a waveform recording')
+        os.makedirs(path, exist_ok=True)
+        self._path = path
+        self._client = client
+        self._waveforms = list()         # header entries.
+        self._current = dict()           # name -> header entry being recorded.
+        self._rows = dict()              # id -> rows written or buffered.
+        self._buffers = dict()           # filename -> list of arrays to write.
+        self._index = list()
+        self._records = 0
+        self._index_file = open(os.path.join(path, INDEX), 'wb')
+        self._write_header()
+
+    def path(self):
+        return self._path
+
+    def records(self):
+        return self._records
+
+    def add(self, detail, when=None):
+        ''' Record a waveform_getall detail captured at 'when' (default now) '''
+        waveform = detail['waveform']
+        name = detail.get('name', waveform.get('name'))
+        samples = np.asarray(waveform['samples'], dtype=np.float64)
+        entry = self._current.get(name)
+        if entry is None or entry['samples'] != len(samples):
+            entry = self._new_waveform(name, len(samples))
+        id = entry['id']
+        row = self._rows[id]
+
+        fits = {fit['name']: fit['points'] for fit in detail.get('fits', [])}
+        for fit in fits.keys():
+            if fit not in entry['fits']:
+                self._new_fit(entry, fit, row)
+        self._buffer(_samples_file(id), samples)
+        for (k, fit) in enumerate(entry['fits']):
+            points = np.full(len(samples), np.nan)
+            if fit in fits:
+                given = np.asarray(fits[fit], dtype=np.float64)[:len(samples)]
+                points[:len(given)] = given
+            self._buffer(_fit_file(id, k), points)
+
+        self._index.append((time.time() if when is None else when, id, int(waveform.get('rank', 0)), row))
+        self._rows[id] = row + 1
+        self._records += 1
+        if len(self._index) >= CHUNK_ROWS:
+            self.flush()
+
+    def flush(self):
+        ''' Write everything buffered '''
+        for (filename, rows) in self._buffers.items():
+            if len(rows) > 0:
+                with open(os.path.join(self._path, filename), 'ab') as f:
+                    f.write(np.vstack(rows).tobytes())
+        self._buffers = {filename: list() for filename in self._buffers.keys()}
+        if len(self._index) > 0:
+            self._index_file.write(np.array(self._index, dtype=INDEX_DTYPE).tobytes())
+            self._index_file.flush()
+            self._index = list()
+
+    def close(self):
+        if self._index_file is not None:
+            self.flush()
+            self._index_file.close()
+            self._index_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Private methods:
+
+    def _new_waveform(self, name, samples):
+        metadata = dict()
+        if self._client is not None:
+            try:
+                metadata = self._client.waveform_get_metadata(name)['detail']
+            except Exception:
+                pass                          # No metadata.
+        entry = {'id': len(self._waveforms), 'name': name, 'samples': samples,
+                 'metadata': metadata, 'fits': list()}
+        self._waveforms.append(entry)
+        self._current[name] = entry
+        self._rows[entry['id']] = 0
+        self._buffers[_samples_file(entry['id'])] = list()
+        self._write_header()
+        return entry
+
+    def _new_fit(self, entry, fit, rows):
+        # A fit first seen after 'rows' traces - earlier traces didn't have it.
+        k = len(entry['fits'])
+        entry['fits'].append(fit)
+        filename = _fit_file(entry['id'], k)
+        self._buffers[filename] = list()
+        if rows > 0:
+            self._buffers[filename].append(np.full((rows, entry['samples']), np.nan))
+        self._write_header()
+
+    def _buffer(self, filename, row):
+        self._buffers[filename].append(row.reshape(1, -1))
+
+    def _write_header(self):
+        temp = os.path.join(self._path, HEADER + '.tmp')
+        with open(temp, 'w') as f:
+            json.dump({'version': VERSION, 'waveforms': self._waveforms}, f, indent=1)
+        os.replace(temp, os.path.join(self._path, HEADER))
+
+class WaveformRecording:
+    '''
+    Read access to a recording.
+      *  path - the recording directory.
+    Methods:
+       waveforms - header entries (id, name, samples, metadata, fits).
+       names     - distinct waveform names.
+       __len__   - number of records.
+       times     - capture times of all records.
+       record(i) - record i as a waveform_getall style detail with a 'time' key.
+       traces(name) - (n, samples) array of all traces of a waveform.
+    '''
+    def __init__(self, path):
+        self._path = path
+        with open(os.path.join(path, HEADER)) as f:
+            header = json.load(f)
+        self._waveforms = header['waveforms']
+        self._index = _map(os.path.join(path, INDEX), INDEX_DTYPE, None)
+        self._samples = dict()
+        self._fits = dict()
+        for entry in self._waveforms:
+            id = entry['id']
+            self._samples[id] = _map(os.path.join(path, _samples_file(id)), np.float64, entry['samples'])
+            self._fits[id] = [
+                _map(os.path.join(path, _fit_file(id, k)), np.float64, entry['samples'])
+                for k in range(len(entry['fits']))
+            ]
+
+    def waveforms(self):
+        return list(self._waveforms)
+
+    def names(self):
+        return list(dict.fromkeys([w['name'] for w in self._waveforms]))
+
+    def metadata(self, name):
+        ''' Metadata of the (last recorded version of) waveform 'name' '''
+        entries = [w for w in self._waveforms if w['name'] == name]
+        return entries[-1]['metadata'] if len(entries) > 0 else {}
+
+    def __len__(self):
+        # Records whose rows were all written (a recording may still be growing).
+        return len(self._index)
+
+    def times(self):
+        return self._index['time']
+
+    def waveform_ids(self):
+        ''' The waveform id of each record '''
+        return self._index['waveform']
+
+    def record(self, i):
+        (when, id, rank, row) = self._index[i]
+        entry = self._waveforms[id]
+        fits = [
+            {'name': fit, 'points': self._fits[id][k][row]}
+            for (k, fit) in enumerate(entry['fits'])
+            if row < len(self._fits[id][k]) and not np.all(np.isnan(self._fits[id][k][row]))
+        ]
+        return {
+            'name': entry['name'], 'time': float(when),
+            'waveform': {'name': entry['name'], 'samples': self._samples[id][row], 'rank': int(rank)},
+            'fits': fits
+        }
+
+    def traces(self, name):
+        ''' All traces of waveform 'name' (of its last recorded size) '''
+        entries = [w for w in self._waveforms if w['name'] == name]
+        if len(entries) == 0:
+            return np.zeros((0, 0))
+        return self._samples[entries[-1]['id']]
+
+class Replayer:
+    '''
+    Meters out records of a recording in recorded time order.
+      *  recording - WaveformRecording.
+      *  speed - Replay speed relative to the recording (2.0 is twice as fast).
+                 0 delivers every remaining record at the next call of due().
+      *  names - If not None, only records of these waveforms are delivered.
+    '''
+    def __init__(self, recording, speed=1.0, names=None):
+        self._recording = recording
+        self._speed = speed
+        self._times = recording.times()
+        self._selected = None
+        if names is not None:
+            names = set(names)
+            ids = np.array([w['id'] for w in recording.waveforms() if w['name'] in names])
+            self._selected = np.isin(recording.waveform_ids(), ids)
+        self._next = 0
+        self._start = None               # (wall time, recording time) at start.
+
+    def set_speed(self, speed, now=None):
+        ''' Change the speed from now on '''
+        now = time.monotonic() if now is None else now
+        if self._start is not None and self._next < len(self._times):
+            self._start = (now, self._times[self._next])
+        self._speed = speed
+
+    def seek(self, fraction):
+        ''' Move to a fraction [0, 1] of the way through the recording '''
+        self._next = int(fraction * len(self._times))
+        self._start = None
+
+    def done(self):
+        return self._next >= len(self._times)
+
+    def position(self):
+        ''' (records delivered, total records) '''
+        return (self._next, len(self._times))
+
+    def due(self, now=None):
+        ''' Returns the list of records due at 'now' (time.monotonic() based) '''
+        now = time.monotonic() if now is None else now
+        if self.done():
+            return []
+        if self._start is None:
+            self._start = (now, self._times[self._next])
+        if self._speed <= 0:
+            last = len(self._times)
+        else:
+            (wall, recorded) = self._start
+            until = recorded + (now - wall) * self._speed
+            last = int(np.searchsorted(self._times, until, side='right'))
+            last = max(last, self._next)
+        indices = range(self._next, last)
+        self._next = last
+        if self._selected is not None:
+            indices = [i for i in indices if self._selected[i]]
+        return [self._recording.record(i) for i in indices]
+
+# Private functions:
+
+def _samples_file(id):
+    return f'wf{id}.dat'
+
+def _fit_file(id, k):
+    return f'wf{id}.fit{k}.dat'
+
+def _map(filename, dtype, columns):
+    # Memory map a file of records (rows of 'columns' values if not None),
+    # ignoring any partially written record at the end.
+    dtype = np.dtype(dtype)
+    record = dtype.itemsize * (columns if columns is not None else 1)
+    size = os.path.getsize(filename) if os.path.exists(filename) else 0
+    rows = size // record if record > 0 else 0
+    shape = (rows, columns) if columns is not None else (rows,)
+    if rows == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', shape=shape)
@@ -20,8 +20,13 @@
 
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, 
                              QLabel, QLineEdit, QPushButton, QListView,
-                             QTableView)
+                             QTableView, QCheckBox, QDoubleSpinBox, QComboBox, QSpinBox,
+                             QFileDialog, QAbstractItemView)
 from PyQt5.QtCore import  pyqtSignal
+import os
+import time
+
+import numpy as np
 
 import matplotlib
 matplotlib.use('Qt5Agg')
@@ -29,6 +34,12 @@ matplotlib.use('Qt5Agg')
 
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 from matplotlib.figure import Figure
+from matplotlib.collections import LineCollection
+
+import waveformcapture
+
+DEFAULT_REFRESH_RATE = 5.0          # Auto refreshes/second.
+MIN_DECIMATION_WIDTH = 1024         # Pixels assumed before the plot is laid out.
 
 class WaveformListWidget(QWidget):
     '''
@@ -37,14 +48,17 @@ class WaveformListWidget(QWidget):
         
         Methods:
             set_model -sets the model with the waveforms to display
+            selected  - names of the waveforms selected in the list (to be captured).
         Signals:
             waveform_selected(waveform_id) - emitted when a waveform
                 is selected from the list.  The slot is passed the
                 string name of the selected waveform.  This is emitted
                 on a double click in the box.
+            selection_changed - the waveforms selected in the list changed.
             
     '''
     waveform_selected = pyqtSignal(str)
+    selection_changed = pyqtSignal()
     def __init__(self, parent=None):
         super(WaveformListWidget, self).__init__(parent)
         
@@ -55,6 +69,7 @@ class WaveformListWidget(QWidget):
         self._layout.addWidget(self._label)
         
         self._listview = QListView(self)
+        self._listview.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self._layout.addWidget(self._listview)
         
         self._listview.doubleClicked.connect(self._waveform_double_clicked)
@@ -67,6 +82,10 @@ class WaveformListWidget(QWidget):
                     the waveform list.
         '''
         self._listview.setModel(model)
+        self._listview.selectionModel().selectionChanged.connect(self.selection_changed)
+    
+    def selected(self):
+        return [index.data() for index in self._listview.selectionModel().selectedIndexes()]
     
     # Private slots:
     
@@ -180,54 +199,160 @@ class WaveformDataEditor(QWidget):
 class PlotWidget(FigureCanvasQTAgg):
     ''' 
         Encapsulates the magic needed to use matplottlib to plot a waveform.
+        The axes and lines are made once.  Updates replace the line data and,
+        unless the axis limits must change, are drawn by blitting the lines onto
+        a saved background rather than redrawing the whole figure.  Waveforms
+        with more samples than there are pixels across the plot are reduced to
+        a min/max envelope per pixel column so drawing time does not grow with
+        the number of samples.
         Methods:
-           plot - erases any prior waveform plot and puts in new points.
-           add_fit - adds a fitline.
+           plot - replaces the waveform points.
+           add_fit - adds or replaces a fitline.
+           set_fits - replace all fit lines.
+           update_waveform - replace the waveform and its fits.
            set_title - set plot title
+           draw_seconds - time taken by the last update.
+        Captured traces (see waveformcapture) are shown in a second axis that
+        replaces the one above until the next waveform update:
+           show_overlay - persistence overlay of many traces.
+           show_envelope - mean with RMS band and min/max.
+           show_heatmap - trace (time) vs. sample image.
+           show_density - sample value vs. sample position histogram.
     '''       
-    fit_colors = ['red', 'green', 'blue', 'magenta', 'cyan', 'yellow ',
-        'dark green', 'brown', 'hot pink']
+    fit_colors = ['red', 'green', 'blue', 'magenta', 'cyan', 'yellow',
+        'darkgreen', 'brown', 'hotpink']
     def __init__(self, parent=None):
         self._fig=Figure()
-        self._axis=None
         self._next_color = 0
         super().__init__(self._fig)
+        self._axis = self._fig.add_subplot(111, anchor='C')
+        (self._waveform,) = self._axis.plot([], [], label='waveform', animated=True)
+        self._fits = dict()                   # fit name -> Line2D.
+        self._capture_axis = self._fig.add_subplot(111, anchor='C')
+        self._capture_axis.set_visible(False)
+        self._background = None
+        self._draw_seconds = 0.0
+        self.mpl_connect('draw_event', self._on_draw)
         
     def plot(self, samples):
         '''
-            If there is an axis, remove it... then add a new one
-            and plot in it.
+            Replace the waveform's points.  Fits from the prior waveform are removed.
         '''
-        if self._axis is not None:
-            self._fig.delaxes(self._axis)
-            # Kill off any fit axes.
-           
-        self._next_color = 0   # Reset the next fit color.
-        
-        # make a new axis and plot in it.
-        # note we need to make the xpts. the ypts are the samples.
-        
-        self._axis = self._fig.add_subplot(111, anchor='C')
+        self.set_fits({})
+        self._set_line(self._waveform, samples)
+        self._update()
         
-        self._axis.plot(samples, label='waveform')
-        self._axis.legend(loc='best')
-        self.draw()
     def add_fit(self, name, points):
-        ''' Add a fitline to the plot.  The waveform must have been
-            drawn first with plot().
+        ''' Add a fitline to the plot or replace the points of an existing one.
             name - name of the fit.
             points - fit points.
         '''
-        
-        self._axis.plot(points, color=self._color(), label=f'Fit: {name}')
-        self._axis.legend(loc='best')
-        self.draw()
+        self._set_fit(name, points)
+        self._update()
+        
+    def set_fits(self, fits):
+        ''' Replace all fits - fits is a dict of name -> points '''
+        for name in list(self._fits.keys()):
+            if name not in fits:
+                self._fits.pop(name).remove()
+                self._background = None        # Legend changed.
+        if len(self._fits) == 0:
+            self._next_color = 0
+        for (name, points) in fits.items():
+            self._set_fit(name, points)
+        
+    def update_waveform(self, samples, fits):
+        ''' Replace the waveform and its fits in one update '''
+        self.set_fits(fits)
+        self._set_line(self._waveform, samples)
+        self._update()
         
     def set_title(self, text):
         '''
            Set figure title text (e.g. waveform name.)
         '''
         self._fig.suptitle(text)
+        self._background = None
+        
+    def draw_seconds(self):
+        return self._draw_seconds
+    
+    def show_overlay(self, traces, fits=None):
+        '''
+        traces - (n, samples) array oldest first.  Older traces are drawn fainter.
+        fits - optional dict of fit name -> (n, samples) fits of those traces; the
+               newest of each is drawn.
+        All the traces are one LineCollection so this stays cheap for hundreds of them.
+        '''
+        axis = self._begin_capture()
+        n = len(traces)
+        if n > 0:
+            x = np.arange(traces.shape[1])
+            segments = np.empty((n, traces.shape[1], 2))
+            segments[:, :, 0] = x
+            segments[:, :, 1] = traces
+            colors = np.zeros((n, 4))
+            colors[:, 2] = 1.0
+            colors[:, 3] = np.linspace(0.05, 0.6, n)       # Fade the old ones.
+            axis.add_collection(LineCollection(segments, colors=colors, linewidths=0.8))
+            axis.plot(x, traces[-1], color='black', linewidth=1.2, label='newest')
+            if fits is not None:
+                for (i, (name, points)) in enumerate(fits.items()):
+                    axis.plot(x, points[-1], color=self.fit_colors[i % len(self.fit_colors)],
+                        label=f'Fit: {name}')
+            axis.autoscale_view()
+            axis.legend(loc='best')
+        axis.set_title(f'{n} traces')
+        self._end_capture()
+    
+    def show_envelope(self, envelope):
+        ''' envelope - dict with mean, rms, min, max, count (see WaveformRing.envelope) '''
+        axis = self._begin_capture()
+        mean = envelope['mean']
+        x = np.arange(len(mean))
+        axis.fill_between(x, envelope['min'], envelope['max'], color='lightgray', label='min/max')
+        axis.fill_between(x, mean - envelope['rms'], mean + envelope['rms'],
+            color='lightblue', label='mean \u00b1 rms')
+        axis.plot(x, mean, color='blue', label='mean')
+        axis.set_title(f'{envelope["count"]} traces')
+        axis.legend(loc='best')
+        self._end_capture()
+    
+    def show_heatmap(self, image):
+        ''' image - (n, samples) traces oldest first:  shown with time going up '''
+        axis = self._begin_capture()
+        if len(image) > 0:
+            axis.imshow(image, aspect='auto', origin='lower', interpolation='nearest')
+        axis.set_xlabel('Sample')
+        axis.set_ylabel('Trace')
+        self._end_capture()
+    
+    def show_density(self, counts, edges):
+        ''' counts (bins, samples) and value edges as from WaveformRing.density '''
+        axis = self._begin_capture()
+        axis.imshow(counts, aspect='auto', origin='lower', interpolation='nearest',
+            extent=(0, counts.shape[1], edges[0], edges[-1]), cmap='viridis')
+        axis.set_xlabel('Sample')
+        axis.set_ylabel('Value')
+        self._end_capture()
+    
+    # Private methods:
+    
+    def _begin_capture(self):
+        # Switch to (and clear) the capture axis.
+        self._axis.set_visible(False)
+        self._capture_axis.set_visible(True)
+        self._capture_axis.clear()
+        self._start = time.monotonic()
+        return self._capture_axis
+    
+    def _end_capture(self):
+        self.draw()
+        self._draw_seconds = time.monotonic() - self._start
+    
+    def _capturing(self):
+        return self._capture_axis.get_visible()
+    
     def _color(self): 
         # Assign a color:
         result = self.fit_colors[self._next_color]
@@ -235,19 +360,133 @@ class PlotWidget(FigureCanvasQTAgg):
         if self._next_color >= len(self.fit_colors):
             self._next_color = 0            # cycle if needed.
         return result
+    
+    def _set_fit(self, name, points):
+        if name not in self._fits:
+            (self._fits[name],) = self._axis.plot(
+                [], [], color=self._color(), label=f'Fit: {name}', animated=True
+            )
+            self._background = None
+        self._set_line(self._fits[name], points)
+    
+    def _set_line(self, line, points):
+        # Load a line with points decimated to the plot width.
+        y = np.asarray(points, dtype=np.float64).ravel()
+        (x, y) = _decimate(y, max(MIN_DECIMATION_WIDTH, int(self._axis.bbox.width)))
+        line.set_data(x, y)
+    
+    def _lines(self):
+        return [self._waveform] + list(self._fits.values())
+    
+    def _limits_ok(self):
+        # True if all the data are inside the current axis limits.
+        (xlow, xhigh) = self._axis.get_xlim()
+        (ylow, yhigh) = self._axis.get_ylim()
+        for line in self._lines():
+            (x, y) = line.get_data()
+            if len(x) == 0:
+                continue
+            if x[0] < xlow or x[-1] > xhigh or np.nanmin(y) < ylow or np.nanmax(y) > yhigh:
+                return False
+        return True
+    
+    def _update(self):
+        # Blit if we can, otherwise rescale and redraw everything
+        # (_on_draw then blits the lines).
+        start = time.monotonic()
+        if self._capturing():
+            self._capture_axis.set_visible(False)
+            self._axis.set_visible(True)
+            self._background = None
+        if self._background is None or not self._limits_ok():
+            self._axis.relim()
+            self._axis.autoscale_view()
+            self._axis.legend(handles=self._lines(), loc='best')
+            self.draw()
+        else:
+            self.restore_region(self._background)
+            self._draw_lines()
+        self._draw_seconds = time.monotonic() - start
+    
+    def _on_draw(self, event):
+        # After a full draw (update, resize...) save the background without
+        # the (animated) lines and then put the lines on top.
+        if self._capturing():
+            self._background = None
+            return
+        self._background = self.copy_from_bbox(self._fig.bbox)
+        self._draw_lines()
+    
+    def _draw_lines(self):
+        for line in self._lines():
+            self._axis.draw_artist(line)
+        self.blit(self._fig.bbox)
+
+def _decimate(y, width):
+    # Returns (x, y) for plotting y with at most ~2*width points.  When
+    # reduced, each pixel column's samples are replaced by their min and max so
+    # peaks are not lost.
+    n = len(y)
+    if n <= 2*width:
+        return (np.arange(n), y)
+    per = int(np.ceil(n/width))
+    columns = n // per
+    body = y[:columns*per].reshape(columns, per)
+    x = np.repeat(np.arange(columns)*per, 2)
+    envelope = np.empty(2*columns)
+    envelope[0::2] = body.min(axis=1)
+    envelope[1::2] = body.max(axis=1)
+    if columns*per < n:                         # Partial last column.
+        tail = y[columns*per:]
+        x = np.append(x, [columns*per, columns*per])
+        envelope = np.append(envelope, [tail.min(), tail.max()])
+    return (x, envelope)
+
 class WaveformPlot(QWidget) :
     '''
         This widget provides a plot widget for viewing waveforms.  It consists of
         a matplotlib canvas in which the plot is generated and updated and
         a button labeled refresh that is, initially disabled (plots can only
         be updated once the enclosing widget has selected a waveform in the
-        larger scheme of things.
+        larger scheme of things.  Next to the refresh button an Auto refresh
+        checkbox and rate (updates/second) request continuous updates.
+        Below those, the display selects between the latest waveform and displays
+        of the captured traces (see waveformcapture) and how many traces are kept.
+        The bottom row records what is plotted to disk and replays recordings
+        (see waveformrecorder) at a chosen speed.
         
         Methods:
            enable  - enable the update method.
            plot    - Provides a waveform to the plot.
+           show_waveform - Provides a waveform and its fits.
+           show_capture - Display a waveformcapture.WaveformRing per the display mode.
+           display_mode - One of DISPLAY_MODES.
+           capture_depth - Number of traces to keep.
+           draw_seconds - Time taken by the last plot update.
+           set_recording - Show whether a recording is in progress.
+           set_replaying - Show whether a replay is in progress.
+           replay_speed - The replay speed multiplier.
+        Signals:
+           refresh - Refresh clicked.
+           auto_refresh(enabled, rate) - Auto refresh was turned on/off or its rate changed.
+           capture_depth_changed(traces) - Number of traces to keep changed.
+           clear_capture - Clear clicked.
+           display_changed - The display mode changed.
+           record(path) - Start recording to the directory path, '' to stop.
+           replay(path) - Replay the recording in the directory path.
+           replay_speed_changed(speed) - The replay speed changed.
+           stop_replay - Stop clicked while replaying.
     '''
+    DISPLAY_MODES = ['Latest', 'Overlay', 'Envelope', 'Heat map', 'Density']
     refresh = pyqtSignal()                  # Refresh clicked.
+    auto_refresh = pyqtSignal(bool, float)
+    capture_depth_changed = pyqtSignal(int)
+    clear_capture = pyqtSignal()
+    display_changed = pyqtSignal()
+    record = pyqtSignal(str)
+    replay = pyqtSignal(str)
+    replay_speed_changed = pyqtSignal(float)
+    stop_replay = pyqtSignal()
     
     def __init__(self, parent=None):
             super(WaveformPlot, self).__init__(parent)
@@ -263,27 +502,173 @@ class WaveformPlot(QWidget) :
             self._plot = PlotWidget()
             self._layout.addWidget(self._plot)
             
-            # The push button and signal relay:
+            # The push button and signal relay and the auto refresh controls:
             
+            controls = QHBoxLayout()
             self._button = QPushButton ("Refresh", self)
             self._button.setDisabled(True)
             self._button.clicked.connect(self.refresh)
-            self._layout.addWidget(self._button)
+            controls.addWidget(self._button)
+            
+            self._auto = QCheckBox('Auto refresh', self)
+            self._auto.setDisabled(True)
+            controls.addWidget(self._auto)
+            self._rate = QDoubleSpinBox(self)
+            self._rate.setRange(0.1, 30.0)
+            self._rate.setValue(DEFAULT_REFRESH_RATE)
+            self._rate.setSuffix(' /s')
+            controls.addWidget(self._rate)
+            self._auto.stateChanged.connect(self._auto_changed)
+            self._rate.valueChanged.connect(self._auto_changed)
+            self._layout.addLayout(controls)
+            
+            # Capture display controls:
+            
+            capture = QHBoxLayout()
+            capture.addWidget(QLabel('Display:', self))
+            self._mode = QComboBox(self)
+            self._mode.addItems(self.DISPLAY_MODES)
+            capture.addWidget(self._mode)
+            capture.addWidget(QLabel('Keep', self))
+            self._depth = QSpinBox(self)
+            self._depth.setRange(1, 100000)
+            self._depth.setValue(waveformcapture.DEFAULT_CAPACITY)
+            self._applied_depth = self._depth.value()
+            self._depth.setSuffix(' traces')
+            capture.addWidget(self._depth)
+            self._clear = QPushButton('Clear', self)
+            capture.addWidget(self._clear)
+            self._layout.addLayout(capture)
+            self._mode.currentIndexChanged.connect(self.display_changed)
+            self._depth.editingFinished.connect(self._depth_changed)
+            self._clear.clicked.connect(self.clear_capture)
+            
+            # Recording and replay controls:
+            
+            recording = QHBoxLayout()
+            self._record = QPushButton('Record...', self)
+            self._record.setCheckable(True)
+            self._record.setDisabled(True)
+            recording.addWidget(self._record)
+            self._replay = QPushButton('Replay...', self)
+            recording.addWidget(self._replay)
+            recording.addWidget(QLabel('Speed', self))
+            self._speed = QDoubleSpinBox(self)
+            self._speed.setRange(0.1, 100.0)
+            self._speed.setValue(1.0)
+            self._speed.setSuffix(' x')
+            recording.addWidget(self._speed)
+            self._stop = QPushButton('Stop', self)
+            self._stop.setDisabled(True)
+            recording.addWidget(self._stop)
+            self._layout.addLayout(recording)
+            self._record.clicked.connect(self._record_clicked)
+            self._replay.clicked.connect(self._replay_clicked)
+            self._speed.valueChanged.connect(self.replay_speed_changed)
+            self._stop.clicked.connect(self.stop_replay)
+            self._title = None
 
     def plot(self, name,  samples):
         '''
           Plot a waveform in self._plot. 
         '''
-        self._plot.plot(samples)
         self._plot.set_title(name)
+        self._title = name
+        self._plot.plot(samples)
         
     def add_fit(self, name, points):
         self._plot.add_fit(name, points)    # Need to add to the plot object.
+    
+    def show_waveform(self, name, samples, fits):
+        ''' Plot a waveform and its fits (dict of name -> points) in one update '''
+        if name != self._title:
+            self._plot.set_title(name)
+            self._title = name
+        self._plot.update_waveform(samples, fits)
+    
+    def display_mode(self):
+        return self._mode.currentText()
+    
+    def capture_depth(self):
+        return self._depth.value()
+    
+    def show_capture(self, name, ring):
+        '''
+        Show captured traces per the display mode (nothing is done in Latest mode).
+        ring - waveformcapture.WaveformRing of the waveform 'name'.
+        '''
+        mode = self.display_mode()
+        if mode == 'Latest' or ring is None:
+            return
+        self._plot.set_title(name)
+        self._title = name
+        if mode == 'Overlay':
+            self._plot.show_overlay(
+                ring.overlay(), {fit: ring.fits(fit) for fit in ring.fit_names()}
+            )
+        elif mode == 'Envelope':
+            self._plot.show_envelope(ring.envelope())
+        elif mode == 'Heat map':
+            self._plot.show_heatmap(ring.heatmap())
+        elif mode == 'Density':
+            self._plot.show_density(*ring.density())
+    
+    def draw_seconds(self):
+        return self._plot.draw_seconds()
         
     def enable(self):
         ''' turn on the refresh button: 
         '''
         self._button.setDisabled(False)
+        self._auto.setDisabled(False)
+        self._record.setDisabled(False)
+    
+    def set_recording(self, recording):
+        self._record.setChecked(recording)
+    
+    def set_auto_refresh(self, enabled):
+        self._auto.setChecked(enabled)
+    
+    def set_replaying(self, replaying):
+        ''' While replaying the server can't be polled or recorded '''
+        if replaying:
+            self._auto.setChecked(False)
+        self._stop.setDisabled(not replaying)
+        self._replay.setDisabled(replaying)
+        self._button.setDisabled(replaying)
+        self._auto.setDisabled(replaying)
+        self._record.setDisabled(replaying)
+    
+    def replay_speed(self):
+        return self._speed.value()
+    
+    def _auto_changed(self):
+        self.auto_refresh.emit(self._auto.isChecked(), self._rate.value())
+    
+    def _depth_changed(self):
+        # Only when the user is done typing - a change discards the captures.
+        if self._depth.value() != self._applied_depth:
+            self._applied_depth = self._depth.value()
+            self.capture_depth_changed.emit(self._applied_depth)
+    
+    def _record_clicked(self, checked):
+        if not checked:
+            self.record.emit('')
+            return
+        path = QFileDialog.getSaveFileName(
+            self, 'Record waveforms to', os.getcwd(), 'Waveform recordings (*.wfr)'
+        )[0]
+        if path == '':
+            self._record.setChecked(False)
+            return
+        if not path.endswith('.wfr'):
+            path = path + '.wfr'
+        self.record.emit(path)
+    
+    def _replay_clicked(self):
+        path = QFileDialog.getExistingDirectory(self, 'Waveform recording to replay', os.getcwd())
+        if path != '':
+            self.replay.emit(path)
                 
 
 class WaveformViewTab(QWidget):
@@ -293,19 +678,37 @@ class WaveformViewTab(QWidget):
             set_metadata_waveform - sets the metadata editor.
             get_metadata_info  - Gets data from the meatdata editor.
             plot          - Plot a waveform.
+            show_waveform - Plot a waveform and its fits.
+            draw_seconds  - Time taken by the last plot update.
         Signals:
             waveform_selected(waveform_id) - emitted when a waveform is selected from the list.
                via a double click.. this just relays the signal from the waveform list widget.
+            capture_selection_changed - The waveforms selected in the list (see
+                    captured_waveforms) changed.
             commit_metadata commit the meatadata of the current waveform.
             add_meatadata_row - add a row to the metadata model.
             refresh_plot      - User clicked the plot refresh button. It is expected the
                     plot method will be called.
+            auto_refresh(enabled, rate) - Relays WaveformPlot.auto_refresh.
+            capture_depth_changed, clear_capture, display_changed - Relay the
+                    WaveformPlot capture signals.
+            record, replay, replay_speed_changed, stop_replay - Relay the
+                    WaveformPlot recording signals.
     '''
     
     waveform_selected = pyqtSignal(str)
+    capture_selection_changed = pyqtSignal()
     commit_metadata   = pyqtSignal()
     add_metadata_row  = pyqtSignal()
     refresh_plot      = pyqtSignal()
+    auto_refresh      = pyqtSignal(bool, float)
+    capture_depth_changed = pyqtSignal(int)
+    clear_capture     = pyqtSignal()
+    display_changed   = pyqtSignal()
+    record            = pyqtSignal(str)
+    replay            = pyqtSignal(str)
+    replay_speed_changed = pyqtSignal(float)
+    stop_replay       = pyqtSignal()
     
     def __init__(self, parent=None):
         super(WaveformViewTab, self).__init__(parent)
@@ -336,12 +739,21 @@ class WaveformViewTab(QWidget):
         self._layout.addLayout(self._toplayout)
         
         self.listing.waveform_selected.connect(self._waveform_selected)
+        self.listing.selection_changed.connect(self.capture_selection_changed)
         
         # Add the plot widget on the bottom:
         
         self._plot = WaveformPlot(self)
         self._layout.addWidget(self._plot)
         self._plot.refresh.connect(self.refresh_plot)
+        self._plot.auto_refresh.connect(self.auto_refresh)
+        self._plot.capture_depth_changed.connect(self.capture_depth_changed)
+        self._plot.clear_capture.connect(self.clear_capture)
+        self._plot.display_changed.connect(self.display_changed)
+        self._plot.record.connect(self.record)
+        self._plot.replay.connect(self.replay)
+        self._plot.replay_speed_changed.connect(self.replay_speed_changed)
+        self._plot.stop_replay.connect(self.stop_replay)
     
     # Public methods:
     
@@ -383,6 +795,30 @@ class WaveformViewTab(QWidget):
     def add_fit(self, fit_name, points):
         ''' delegates to waveform plotter - add a fit to the curren plot'''
         self._plot.add_fit(fit_name, points)
+    def show_waveform(self, name, samples, fits):
+        ''' delegates to the waveform plotter - fits is a dict of fit name -> points '''
+        self._plot.show_waveform(name, samples, fits)
+    def draw_seconds(self):
+        return self._plot.draw_seconds()
+    def show_capture(self, name, ring):
+        ''' delegates to the waveform plotter - display captured traces '''
+        self._plot.show_capture(name, ring)
+    def display_mode(self):
+        return self._plot.display_mode()
+    def capture_depth(self):
+        return self._plot.capture_depth()
+    def set_recording(self, recording):
+        self._plot.set_recording(recording)
+    def set_auto_refresh(self, enabled):
+        self._plot.set_auto_refresh(enabled)
+    def captured_waveforms(self):
+        ''' Waveforms auto refresh captures:  the one shown and those selected in the list '''
+        (name, _) = self.get_metadata_info()
+        return list(dict.fromkeys([name] + self.listing.selected()))
+    def set_replaying(self, replaying):
+        self._plot.set_replaying(replaying)
+    def replay_speed(self):
+        return self._plot.replay_speed()
     # Private slots:
     
     def _waveform_selected(self, waveform_id):